@@ -0,0 +1,347 @@
+#! /usr/bin/env python3
+""" Script to benchmark performance-critical parts on a given log file """
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from timeit import default_timer as timer
+
+import numpy as np
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
+#pylint: disable=wrong-import-position
+from plot_app.downsampling import DOWNSAMPLE_METHODS, get_downsample_indices
+from plot_app.log_storage import compress_log_file
+from plot_app.minmax_pyramid import MinMaxPyramid
+from plot_app.ulog_index import LazyULog
+from tornado_handlers.multipart_streamer import MultiPartStreamer
+
+#pylint: disable=invalid-name
+
+
+def benchmark_decode(args):
+    """ decode all topics of a log, sequentially and with different numbers
+    of worker processes """
+    ulog = LazyULog.load(args.log_file)
+    num_messages = sum(len(dataset.offsets) for dataset in ulog.data_list)
+    print('{:}: {:.1f} MB, {:} topics, {:} messages'.format(
+        args.log_file, os.path.getsize(args.log_file) / 1024**2,
+        len(ulog.data_list), num_messages))
+
+    def decode_sequential():
+        ulog = LazyULog.load(args.log_file)
+        start_time = timer()
+        for dataset in ulog.data_list:
+            dataset.data # pylint: disable=pointless-statement
+        return timer() - start_time
+
+    def decode_parallel(executor):
+        ulog = LazyULog.load(args.log_file)
+        start_time = timer()
+        ulog.decode_parallel(ulog.data_list, executor)
+        return timer() - start_time
+
+    sequential_time = min(decode_sequential() for _ in range(args.repeat))
+    print('{:>8} {:>10} {:>8}'.format('workers', 'time [s]', 'speedup'))
+    print('{:>8} {:>10.3f} {:>8.2f}'.format('-', sequential_time, 1))
+    for num_workers in args.workers:
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=multiprocessing.get_context('fork')) \
+                as executor:
+            decode_parallel(executor) # start the worker processes
+            parallel_time = min(decode_parallel(executor) for _ in range(args.repeat))
+        print('{:>8} {:>10.3f} {:>8.2f}'.format(num_workers, parallel_time,
+                                                 sequential_time / parallel_time))
+
+
+def benchmark_storage(args):
+    """ compare loading a log stored uncompressed and compressed """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        raw_file = os.path.join(temp_dir, 'raw.ulg')
+        compressed_file = os.path.join(temp_dir, 'compressed.ulg')
+        shutil.copy(args.log_file, raw_file)
+        shutil.copy(args.log_file, compressed_file)
+        start_time = timer()
+        compress_log_file(compressed_file)
+        print('compression: {:.3f} s'.format(timer() - start_time))
+
+        def load(file_name):
+            start_time = timer()
+            LazyULog(file_name)
+            return timer() - start_time
+
+        def decode(file_name):
+            ulog = LazyULog.load(file_name)
+            start_time = timer()
+            for dataset in ulog.data_list:
+                dataset.data # pylint: disable=pointless-statement
+            return timer() - start_time
+
+        def read_ranges(file_name):
+            # random time windows of 1% of the log of random topics
+            ulog = LazyULog.load(file_name)
+            rng = np.random.default_rng(0)
+            duration = ulog.last_timestamp - ulog.start_timestamp
+            start_time = timer()
+            for _ in range(args.ranges):
+                dataset = ulog.data_list[rng.integers(len(ulog.data_list))]
+                t_start = ulog.start_timestamp + int(rng.uniform(0, 0.99) * duration)
+                dataset.get_range(t_start, t_start + duration // 100)
+            return timer() - start_time
+
+        print('{:<20} {:>12} {:>12}'.format('', 'raw', 'compressed'))
+        print('{:<20} {:>12.1f} {:>12.1f}'.format(
+            'size [MB]', os.path.getsize(raw_file) / 1024**2,
+            os.path.getsize(compressed_file) / 1024**2))
+        for name, func in [('load (index) [s]', load), ('decode all [s]', decode),
+                           ('{:} ranges [s]'.format(args.ranges), read_ranges)]:
+            print('{:<20} {:>12.3f} {:>12.3f}'.format(
+                name, min(func(raw_file) for _ in range(args.repeat)),
+                min(func(compressed_file) for _ in range(args.repeat))))
+
+
+def benchmark_upload(args):
+    """ parse a multipart/form-data upload of a log file (repeated to the
+    requested size), fed in chunks like the upload handler receives it """
+    with open(args.log_file, 'rb') as log_file:
+        log_data = log_file.read()
+    file_data = log_data * max(1, round(args.size * 1024**2 / len(log_data)))
+    boundary = b'----FlightReviewBenchmarkBoundary'
+    body = b''.join([
+        b'--'+boundary+b'\r\n',
+        b'Content-Disposition: form-data; name="description"\r\n\r\nbenchmark\r\n',
+        b'--'+boundary+b'\r\n',
+        b'Content-Disposition: form-data; name="filearg"; filename="log.ulg"\r\n',
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        file_data, b'\r\n--'+boundary+b'--\r\n'])
+    body_view = memoryview(body)
+    print('upload: {:.1f} MB, chunk size: {:} kB'.format(
+        len(body) / 1024**2, args.chunk_size // 1024))
+
+    def parse():
+        streamer = MultiPartStreamer(len(body))
+        start_time = timer()
+        start_cpu_time = time.process_time()
+        for i in range(0, len(body), args.chunk_size):
+            streamer.data_received(bytes(body_view[i:i + args.chunk_size]))
+        streamer.data_complete()
+        elapsed_time = timer() - start_time
+        cpu_time = time.process_time() - start_cpu_time
+        file_part = streamer.get_parts_by_name('filearg')[0]
+        assert file_part.size == len(file_data), 'wrong file size'
+        streamer.release_parts()
+        return elapsed_time, cpu_time
+
+    elapsed_time, cpu_time = min(parse() for _ in range(args.repeat))
+    print('time: {:.3f} s, CPU: {:.3f} s, throughput: {:.1f} MB/s'.format(
+        elapsed_time, cpu_time, len(body) / 1024**2 / elapsed_time))
+
+
+def benchmark_downsample(args):
+    """ compare the downsampling methods of the time series plots: CPU time,
+    number of samples and fidelity (per pixel min/max envelope compared to the
+    full data) """
+    ulog = LazyULog.load(args.log_file)
+    topics = []
+    for dataset in ulog.data_list:
+        x = dataset.data['timestamp']
+        columns = [value for key, value in dataset.data.items()
+                   if key != 'timestamp' and value.dtype.kind == 'f']
+        if len(x) > args.width * 3 and len(columns) > 0 and np.all(np.diff(x) >= 0):
+            topics.append((x, columns))
+    print('{:}: {:} topics with more than {:} samples'.format(
+        args.log_file, len(topics), args.width * 3))
+
+    def get_envelope(x, x_range, y):
+        """ per pixel min and max """
+        pixels = ((x.astype(np.float64) - x_range[0]) * args.width /
+                  (x_range[1] - x_range[0] + 1)).astype(np.int64)
+        envelope = np.full((2, args.width), np.nan)
+        with np.errstate(invalid='ignore'):
+            np.fmin.at(envelope[0], pixels, y)
+            np.fmax.at(envelope[1], pixels, y)
+        return envelope
+
+    # the envelopes of the full data
+    full_envelopes = []
+    for x, columns in topics:
+        x_range = (float(x[0]), float(x[-1]))
+        full_envelopes.append([get_envelope(x, x_range, y) for y in columns])
+
+    print('{:>8} {:>10} {:>10} {:>16} {:>14}'.format(
+        'method', 'time [ms]', 'samples', 'envelope error', 'extrema kept'))
+    for method in DOWNSAMPLE_METHODS:
+        def run(method):
+            start_time = time.process_time()
+            for x, columns in topics:
+                get_downsample_indices(x, columns, method, args.width, 3)
+            return time.process_time() - start_time
+        cpu_time = min(run(method) for _ in range(args.repeat))
+
+        num_samples = 0
+        errors = []
+        num_extrema = 0
+        num_extrema_kept = 0
+        for (x, columns), envelopes in zip(topics, full_envelopes):
+            x_range = (float(x[0]), float(x[-1]))
+            indices = get_downsample_indices(x, columns, method, args.width, 3)
+            num_samples += len(x[indices])
+            for y, envelope in zip(columns, envelopes):
+                ds_envelope = get_envelope(x[indices], x_range, y[indices])
+                y_range = np.nanmax(envelope) - np.nanmin(envelope)
+                valid = ~np.isnan(envelope[0])
+                if y_range == 0 or not np.any(valid):
+                    continue
+                # pixels without a sample: the line is interpolated (error 0)
+                diff = np.nan_to_num(np.abs(ds_envelope - envelope)[:, valid])
+                errors.append(np.mean(diff) / y_range)
+                num_extrema += 2
+                num_extrema_kept += np.nanmax(ds_envelope[1]) == np.nanmax(envelope[1])
+                num_extrema_kept += np.nanmin(ds_envelope[0]) == np.nanmin(envelope[0])
+        print('{:>8} {:>10.1f} {:>10} {:>15.2f}% {:>13.1f}%'.format(
+            method, cpu_time * 1000, num_samples, np.mean(errors) * 100,
+            num_extrema_kept / num_extrema * 100))
+
+    # zooming: M4 of the visible range vs. the min/max pyramid
+    rng = np.random.default_rng(0)
+    ranges = []
+    for x, columns in topics:
+        for _ in range(args.zooms):
+            start, end = np.sort(rng.integers(0, len(x), 2))
+            ranges.append((x, columns, start, end + 1))
+    start_time = time.process_time()
+    for x, columns, start, end in ranges:
+        mask = (x >= x[start]) & (x <= x[end - 1])
+        get_downsample_indices(x[mask], [y[mask] for y in columns], 'm4', args.width, 3)
+    m4_time = time.process_time() - start_time
+    start_time = time.process_time()
+    pyramids = [MinMaxPyramid.build(dict(enumerate(columns)), len(x)) for x, columns in topics]
+    build_time = time.process_time() - start_time
+    pyramid_by_x = {id(x): pyramid for (x, _), pyramid in zip(topics, pyramids)}
+    start_time = time.process_time()
+    for x, columns, start, end in ranges:
+        pyramid_by_x[id(x)].get_indices(range(len(columns)), start, end, args.width)
+    pyramid_time = time.process_time() - start_time
+    print('zoom ({:} ranges): M4 {:.3f} ms, pyramid {:.3f} ms per range '
+          '(pyramid build: {:.1f} ms)'.format(
+              len(ranges), m4_time * 1000 / len(ranges), pyramid_time * 1000 / len(ranges),
+              build_time * 1000))
+
+
+def benchmark_payload(args):
+    """ size of the plot page data sent to the browser and the server time
+    until it can be sent, without and with payload narrowing. The time in the
+    browser (decoding and rendering) is not included. """
+    #pylint: disable=import-outside-toplevel
+    # imported here: these need all the dependencies of the plot page
+    from bokeh.document import Document
+    from bokeh.io.doc import set_curdoc
+    from bokeh.layouts import column
+    from bokeh.protocol import Protocol
+    from pyulog.px4 import PX4ULog
+    from configured_plots import generate_plots
+    from db_entry import DBData
+    from downsampling import set_payload_narrowing
+    from helper import load_ulog_file, add_roll_pitch_yaw
+
+    ulog = load_ulog_file(os.path.abspath(args.log_file))
+    px4_ulog = PX4ULog(ulog)
+    add_roll_pitch_yaw(ulog)
+    for dataset in ulog.data_list:
+        dataset.data # pylint: disable=pointless-statement
+
+    def run():
+        doc = Document()
+        set_curdoc(doc)
+        start_time = timer()
+        doc.add_root(column(generate_plots(ulog, px4_ulog, DBData(), None, '', '')))
+        generate_time = timer() - start_time
+        start_time = timer()
+        # the message with the document, sent after the page is loaded
+        message = Protocol().create('PULL-DOC-REPLY', 'benchmark', doc)
+        num_bytes = len(message.header_json) + len(message.metadata_json) + \
+            len(message.content_json) + \
+            sum(len(buffer.to_bytes()) for buffer in message.buffers)
+        serialize_time = timer() - start_time
+        return generate_time, serialize_time, num_bytes
+
+    print('{:>10} {:>12} {:>14} {:>15} {:>14} {:>16}'.format(
+        'narrowing', 'size [MB]', 'plots [ms]', 'serialize [ms]',
+        'transfer [ms]', 'total [ms]'))
+    for enable in (False, True):
+        set_payload_narrowing(enable)
+        results = [run() for _ in range(args.repeat)]
+        generate_time = min(result[0] for result in results)
+        serialize_time = min(result[1] for result in results)
+        num_bytes = results[0][2]
+        transfer_time = num_bytes * 8 / (args.bandwidth * 1e6)
+        print('{:>10} {:>12.2f} {:>14.1f} {:>15.1f} {:>14.1f} {:>16.1f}'.format(
+            'on' if enable else 'off', num_bytes / 1024**2, generate_time * 1000,
+            serialize_time * 1000, transfer_time * 1000,
+            (generate_time + serialize_time + transfer_time) * 1000))
+    set_payload_narrowing(None)
+
+
+parser = argparse.ArgumentParser(description='Benchmark Flight Review')
+subparsers = parser.add_subparsers(dest='command', required=True)
+
+parser_decode = subparsers.add_parser(
+    'decode', help='topic decoding speed-up vs. number of worker processes')
+parser_decode.add_argument('log_file', help='ULog file')
+parser_decode.add_argument('--workers', type=int, nargs='+',
+                           default=sorted({1, 2, 4, 8, 16, 32, os.cpu_count()}),
+                           help='numbers of worker processes to test')
+parser_decode.add_argument('--repeat', type=int, default=3,
+                           help='number of runs (the fastest is reported)')
+parser_decode.set_defaults(func=benchmark_decode)
+
+parser_storage = subparsers.add_parser(
+    'storage', help='load time of uncompressed vs. compressed log storage')
+parser_storage.add_argument('log_file', help='ULog file (uncompressed)')
+parser_storage.add_argument('--ranges', type=int, default=100,
+                            help='number of random time ranges to read')
+parser_storage.add_argument('--repeat', type=int, default=3,
+                            help='number of runs (the fastest is reported)')
+parser_storage.set_defaults(func=benchmark_storage)
+
+parser_upload = subparsers.add_parser(
+    'upload', help='throughput of the multipart/form-data upload parser')
+parser_upload.add_argument('log_file', help='ULog file')
+parser_upload.add_argument('--size', type=float, default=300,
+                           help='upload size in MB (the log is repeated)')
+parser_upload.add_argument('--chunk-size', type=int, default=64 * 1024,
+                           help='size of the received chunks in bytes')
+parser_upload.add_argument('--repeat', type=int, default=3,
+                           help='number of runs (the fastest is reported)')
+parser_upload.set_defaults(func=benchmark_upload)
+
+parser_downsample = subparsers.add_parser(
+    'downsample', help='CPU time and fidelity of the plot downsampling methods')
+parser_downsample.add_argument('log_file', help='ULog file')
+parser_downsample.add_argument('--width', type=int, default=840,
+                               help='plot width in pixels')
+parser_downsample.add_argument('--zooms', type=int, default=20,
+                               help='number of random zoom ranges per topic')
+parser_downsample.add_argument('--repeat', type=int, default=3,
+                               help='number of runs (the fastest is reported)')
+parser_downsample.set_defaults(func=benchmark_downsample)
+
+parser_payload = subparsers.add_parser(
+    'payload', help='plot page data size and time until it is sent, with and '
+    'without payload narrowing')
+parser_payload.add_argument('log_file', help='ULog file')
+parser_payload.add_argument('--bandwidth', type=float, default=20,
+                            help='network bandwidth in Mbit/s, to estimate the '
+                            'transfer time (default: %(default)s)')
+parser_payload.add_argument('--repeat', type=int, default=3,
+                            help='number of runs (the fastest is reported)')
+parser_payload.set_defaults(func=benchmark_payload)
+
+args = parser.parse_args()
+args.func(args)
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+""" Script to convert existing log files to compressed storage (zstd seekable
+format, see plot_app/log_storage.py). It can be stopped and restarted at any
+time, already compressed logs are skipped. """
+
+import argparse
+import os
+import sys
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
+#pylint: disable=wrong-import-position
+from plot_app.config import get_log_filepath
+from plot_app.helper import create_ulog_index, clear_ulog_cache
+from plot_app.log_storage import compress_log_file
+from plot_app.file_storage import replace_with_link
+from plot_app.ulog_index import get_index_filename
+
+#pylint: disable=invalid-name
+
+parser = argparse.ArgumentParser(description='Compress the stored log files')
+parser.add_argument('--dry-run', action='store_true', default=False,
+                    help='only print the number of logs and their size')
+args = parser.parse_args()
+
+log_dir = get_log_filepath()
+# group the log files by inode: deduplicated logs are hard links to the same
+# file (see plot_app/file_storage.py), which must stay shared
+log_files = {} # key: (device, inode), value: list of file names
+for dir_path, _, file_names in os.walk(log_dir):
+    for file_name in sorted(file_names):
+        if file_name.endswith('.ulg'):
+            log_file = os.path.join(dir_path, file_name)
+            stat = os.stat(log_file)
+            log_files.setdefault((stat.st_dev, stat.st_ino), []).append(log_file)
+print('{:} log files in {:} ({:.1f} MB)'.format(
+    len(log_files), log_dir,
+    sum(os.path.getsize(file_names[0]) for file_names in log_files.values()) / 1024**2))
+if args.dry_run:
+    sys.exit(0)
+
+num_compressed = 0
+size_before = 0
+size_after = 0
+for i, file_names in enumerate(log_files.values()):
+    log_file = file_names[0]
+    file_size = os.path.getsize(log_file)
+    try:
+        if not compress_log_file(log_file):
+            continue
+        for linked_file in file_names[1:]:
+            replace_with_link(log_file, linked_file)
+    except Exception as e:
+        print('Failed to compress', log_file, e)
+        continue
+
+    num_compressed += 1
+    size_before += file_size
+    size_after += os.path.getsize(log_file)
+    print('[{:}/{:}] {:}: {:.1f} MB -> {:.1f} MB'.format(
+        i + 1, len(log_files), log_file, file_size / 1024**2,
+        os.path.getsize(log_file) / 1024**2))
+
+    # the cached data of the logs is outdated now (it would also be detected
+    # on the next load): remove it and recreate the index
+    for file_name in file_names:
+        log_id = os.path.basename(file_name)[:-4]
+        clear_ulog_cache(log_id)
+        if os.path.exists(get_index_filename(file_name)):
+            create_ulog_index(file_name)
+
+if num_compressed > 0:
+    print('Compressed {:} logs: {:.1f} MB -> {:.1f} MB ({:.1%})'.format(
+        num_compressed, size_before / 1024**2, size_after / 1024**2,
+        size_after / size_before))
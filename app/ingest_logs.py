@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+""" Script to add many log files at once (e.g. the logs of a fleet), the
+server-side equivalent of the /bulk_upload endpoint. The log files are copied
+into the log storage; the processing jobs are run by the job workers of the
+server. """
+
+import argparse
+import os
+import sys
+import tempfile
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
+#pylint: disable=wrong-import-position
+from tornado_handlers.bulk_upload import ARCHIVE_SUFFIXES, LogFile, \
+    extract_log_files, ingest_log_files
+
+#pylint: disable=invalid-name
+
+parser = argparse.ArgumentParser(description='Add log files to the database')
+parser.add_argument('paths', metavar='PATH', nargs='+',
+                    help='log file (.ulg), tar/zip archive or directory '
+                    '(searched recursively for .ulg files)')
+parser.add_argument('--source', default='bulk',
+                    help='source of the logs (default: %(default)s)')
+parser.add_argument('--description', default='', help='description of the logs')
+parser.add_argument('--allow-for-analysis', action='store_true', default=False,
+                    help='allow the logs to be used for analysis')
+parser.add_argument('--workers', type=int, default=None,
+                    help='number of threads to validate and store the files')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    log_files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                for file_name in sorted(file_names):
+                    if file_name.lower().endswith('.ulg'):
+                        file_name = os.path.join(dir_path, file_name)
+                        log_files.append(LogFile(file_name, file_name, None))
+        elif path.lower().endswith(ARCHIVE_SUFFIXES):
+            archive_dir = os.path.join(temp_dir, str(len(log_files)))
+            os.makedirs(archive_dir)
+            try:
+                log_files.extend(extract_log_files(path, path, archive_dir))
+            except Exception as e:
+                print('Failed to extract', path, e)
+        else:
+            log_files.append(LogFile(path, path, None))
+    print('Adding {:} log files'.format(len(log_files)))
+
+    results, stats = ingest_log_files(
+        log_files, args.source, args.description, int(args.allow_for_analysis),
+        keep_files=True, num_workers=args.workers)
+
+for result in results:
+    if 'log_id' in result:
+        print('{:}: {:} {:}'.format(result['name'], result['status'], result['url']))
+    else:
+        print('{:}: {:} ({:})'.format(result['name'], result['status'], result['error']))
+print('{:} logs stored ({:} duplicates), {:} failed, {:.1f} MB in {:.2f} s ({:.1f} MB/s)'.format(
+    stats['num_stored'], stats['num_duplicates'], stats['num_failed'],
+    stats['total_bytes'] / 1024**2, stats['duration_s'], stats['throughput_mb_s']))
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+""" Script to move the stored files (logs, KML files, overview images) from the
+flat directory layout to the sharded layout (see plot_app/file_storage.py).
+It can be run while the server is running, and be stopped and restarted at any
+time. """
+
+import argparse
+import os
+import sys
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
+#pylint: disable=wrong-import-position
+from plot_app.config import get_log_filepath, get_kml_filepath, get_overview_img_filepath
+from plot_app.file_storage import get_sharded_filename, make_parent_dirs, store_log_file
+from plot_app.ulog_index import get_index_filename
+
+#pylint: disable=invalid-name
+
+parser = argparse.ArgumentParser(description='Move the stored files to the sharded layout')
+parser.add_argument('--deduplicate', action='store_true', default=False,
+                    help='also store identical log files only once')
+args = parser.parse_args()
+
+
+def move_file(old_file_name, new_file_name):
+    """ move a file such that it can be found at any time: the new location is
+    preferred by the resolver, so first add it, then remove the old one """
+    if os.path.exists(new_file_name):
+        if not os.path.samefile(old_file_name, new_file_name):
+            print('Warning: both {:} and {:} exist, keeping both'.format(
+                old_file_name, new_file_name))
+            return
+    else:
+        make_parent_dirs(new_file_name)
+        os.link(old_file_name, new_file_name)
+    os.unlink(old_file_name)
+
+
+for base_path, suffix in [(get_log_filepath(), '.ulg'),
+                          (get_kml_filepath(), '.kml'),
+                          (get_overview_img_filepath(), '.png')]:
+    if not os.path.exists(base_path):
+        continue
+    num_moved = 0
+    num_duplicates = 0
+    for file_name in sorted(os.listdir(base_path)):
+        if not file_name.endswith(suffix):
+            continue
+        file_id = file_name[:-len(suffix)]
+        flat_file_name = os.path.join(base_path, file_name)
+        sharded_file_name = get_sharded_filename(base_path, file_id, suffix)
+        try:
+            if suffix == '.ulg':
+                # move the index first, so that it is not missing when the
+                # log gets loaded from the new location
+                if os.path.exists(get_index_filename(flat_file_name)):
+                    move_file(get_index_filename(flat_file_name),
+                              get_index_filename(sharded_file_name))
+                move_file(flat_file_name, sharded_file_name)
+                if args.deduplicate and store_log_file(base_path, sharded_file_name):
+                    num_duplicates += 1
+            else:
+                move_file(flat_file_name, sharded_file_name)
+            num_moved += 1
+        except Exception as e:
+            print('Failed to move', flat_file_name, e)
+
+    print('{:}: moved {:} files'.format(base_path, num_moved))
+    if num_duplicates > 0:
+        print('{:} duplicate logs are now stored once'.format(num_duplicates))
@@ -31,7 +31,27 @@ __PARAMETERS_URL = _conf.get('general', 'parameters_url')
 __EVENTS_URL = _conf.get('general', 'events_url')
 __MAPBOX_API_ACCESS_TOKEN = _conf.get('general', 'mapbox_api_access_token')
 __CESIUM_API_KEY = _conf.get('general', 'cesium_api_key')
-__LOG_CACHE_SIZE = int(_conf.get('general', 'log_cache_size'))
+__LOG_CACHE_SIZE_MB = int(_conf.get('general', 'log_cache_size_mb'))
+if _conf.has_option('general', 'log_cache_size'):
+    # old setting (number of logs), only set by the user config
+    print('Warning: config option log_cache_size (number of logs) is not used '
+          'anymore, set log_cache_size_mb instead (using {:} MB)'
+          .format(__LOG_CACHE_SIZE_MB))
+__ULOG_DISK_CACHE = int(_conf.get('general', 'ulog_disk_cache'))
+__ULOG_DISK_CACHE_SIZE_MB = int(_conf.get('general', 'ulog_disk_cache_size_mb'))
+__ULOG_SHARED_CACHE_PATH = _conf.get('general', 'ulog_shared_cache_path')
+__ULOG_SHARED_CACHE_SIZE_MB = int(_conf.get('general', 'ulog_shared_cache_size_mb'))
+__STREAMING_THRESHOLD_MB = int(_conf.get('general', 'streaming_threshold_mb'))
+__STREAMING_MAX_SAMPLES = int(_conf.get('general', 'streaming_max_samples'))
+__PARALLEL_DECODE_WORKERS = int(_conf.get('general', 'parallel_decode_workers'))
+__COMPRESS_LOGS = int(_conf.get('general', 'compress_logs'))
+__JOB_WORKERS = int(_conf.get('general', 'job_workers'))
+__DOWNSAMPLE_METHOD = _conf.get('general', 'downsample_method')
+__ZOOM_DEBOUNCE_MS = int(_conf.get('general', 'zoom_debounce_ms'))
+__PLOT_PAYLOAD_NARROWING = int(_conf.get('general', 'plot_payload_narrowing'))
+__RESUMABLE_UPLOAD_CHUNK_SIZE_MB = int(_conf.get('general', 'resumable_upload_chunk_size_mb'))
+__RESUMABLE_UPLOAD_EXPIRY_HOURS = float(_conf.get('general', 'resumable_upload_expiry_hours'))
+__RESUMABLE_UPLOAD_MAX_SIZE_MB = int(_conf.get('general', 'resumable_upload_max_size_mb'))
 __DB_FILENAME_CUSTOM = _conf.get('general', 'db_filename')
 
 __STORAGE_PATH = _conf.get('general', 'storage_path')
@@ -40,6 +60,7 @@ if not os.path.isabs(__STORAGE_PATH):
 
 __LOG_FILE_PATH = os.path.join(__STORAGE_PATH, 'log_files')
 __DB_FILENAME = os.path.join(__STORAGE_PATH, 'logs.sqlite')
+__UPLOAD_FILE_PATH = os.path.join(__STORAGE_PATH, 'uploads')
 __CACHE_FILE_PATH = os.path.join(__STORAGE_PATH, 'cache')
 __AIRFRAMES_FILENAME = os.path.join(__CACHE_FILE_PATH, 'airframes.xml')
 __PARAMETERS_FILENAME = os.path.join(__CACHE_FILE_PATH, 'parameters.xml')
@@ -89,6 +110,10 @@ def get_log_filepath():
     """ get configured log files directory """
     return __LOG_FILE_PATH
 
+def get_upload_filepath():
+    """ get configured directory for incomplete (resumable) uploads """
+    return __UPLOAD_FILE_PATH
+
 def get_cache_filepath():
     """ get configured cache directory """
     return __CACHE_FILE_PATH
@@ -97,6 +122,10 @@ def get_kml_filepath():
     """ get configured KML files directory """
     return os.path.join(get_cache_filepath(), 'kml')
 
+def get_ulog_cache_filepath():
+    """ get configured directory for the persistent ulog cache """
+    return os.path.join(get_cache_filepath(), 'ulog')
+
 def get_overview_img_filepath():
     """ get configured overview image directory """
     return os.path.join(get_cache_filepath(), 'img')
@@ -143,9 +172,72 @@ def get_cesium_api_key():
     """ get Cesium API key """
     return __CESIUM_API_KEY
 
-def get_log_cache_size():
-    """ get maximum number of cached logs in RAM """
-    return __LOG_CACHE_SIZE
+def get_log_cache_max_bytes():
+    """ get maximum size of the cached logs in RAM in bytes """
+    return __LOG_CACHE_SIZE_MB * 1024 * 1024
+
+def use_ulog_disk_cache():
+    """ use the persistent on-disk ulog cache? """
+    return __ULOG_DISK_CACHE == 1
+
+def get_ulog_disk_cache_max_bytes():
+    """ get maximum size of the on-disk ulog cache in bytes """
+    return __ULOG_DISK_CACHE_SIZE_MB * 1024 * 1024
+
+def get_ulog_shared_cache_filepath():
+    """ get configured directory for the ulog cache shared between processes
+    (None if disabled) """
+    if __ULOG_SHARED_CACHE_PATH == '':
+        return None
+    return __ULOG_SHARED_CACHE_PATH
+
+def get_ulog_shared_cache_max_bytes():
+    """ get maximum size of the shared ulog cache in bytes """
+    return __ULOG_SHARED_CACHE_SIZE_MB * 1024 * 1024
+
+def get_streaming_threshold_bytes():
+    """ get the log file size above which logs are loaded in streaming mode """
+    return __STREAMING_THRESHOLD_MB * 1024 * 1024
+
+def get_streaming_max_samples():
+    """ get the maximum number of samples per topic in streaming mode """
+    return __STREAMING_MAX_SAMPLES
+
+def get_parallel_decode_workers():
+    """ get the number of worker processes for decoding topics (0=disabled) """
+    return __PARALLEL_DECODE_WORKERS
+
+def use_log_compression():
+    """ store uploaded logs compressed? """
+    return __COMPRESS_LOGS == 1
+
+def get_job_workers():
+    """ get the number of background job threads (per process) """
+    return max(1, __JOB_WORKERS)
+
+def get_resumable_upload_chunk_size():
+    """ get the chunk size of resumable uploads in bytes """
+    return __RESUMABLE_UPLOAD_CHUNK_SIZE_MB * 1024 * 1024
+
+def get_resumable_upload_max_size():
+    """ get the maximum size of a resumable upload in bytes """
+    return __RESUMABLE_UPLOAD_MAX_SIZE_MB * 1024 * 1024
+
+def get_resumable_upload_expiry_s():
+    """ get the time after which incomplete resumable uploads are removed [s] """
+    return __RESUMABLE_UPLOAD_EXPIRY_HOURS * 3600
+
+def get_downsample_method():
+    """ get the downsampling method of the time series plots """
+    return __DOWNSAMPLE_METHOD
+
+def get_zoom_debounce_ms():
+    """ get the debounce time of the plot zoom callbacks [ms] """
+    return __ZOOM_DEBOUNCE_MS
+
+def get_plot_payload_narrowing():
+    """ send the time series plot data with smaller types? """
+    return __PLOT_PAYLOAD_NARROWING == 1
 
 def debug_print_timing():
     """ print timing information? """
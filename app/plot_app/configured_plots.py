@@ -43,18 +43,8 @@ def generate_plots(ulog, px4_ulog, db_data, vehicle_data, link_to_3d_page,
     manual_control_sp_throttle_range = '[-1, 1]'
     vehicle_gps_position_altitude = None
     for topic in data:
-        if topic.name == 'system_power':
-            # COMPATIBILITY: rename fields to new format
-            if 'voltage5V_v' in topic.data:     # old (prior to PX4/Firmware:213aa93)
-                topic.data['voltage5v_v'] = topic.data.pop('voltage5V_v')
-            if 'voltage3V3_v' in topic.data:    # old (prior to PX4/Firmware:213aa93)
-                topic.data['sensors3v3[0]'] = topic.data.pop('voltage3V3_v')
-            if 'voltage3v3_v' in topic.data:
-                topic.data['sensors3v3[0]'] = topic.data.pop('voltage3v3_v')
-        elif topic.name == 'tecs_status':
-            if 'airspeed_sp' in topic.data: # old (prior to PX4-Autopilot/pull/16585)
-                topic.data['true_airspeed_sp'] = topic.data.pop('airspeed_sp')
-        elif topic.name == 'manual_control_setpoint':
+        # (renamed fields of system_power and tecs_status are handled when loading)
+        if topic.name == 'manual_control_setpoint':
             if 'throttle' not in topic.data: # old (prior to PX4-Autopilot/pull/15949)
                 manual_control_sp_controls = ['y', 'x', 'r', 'z']
                 manual_control_sp_throttle_range = '[0, 1]'
@@ -78,51 +68,14 @@ def generate_plots(ulog, px4_ulog, db_data, vehicle_data, link_to_3d_page,
         manual_control_switches_topic = 'manual_control_setpoint'
     dynamic_control_alloc = any(elem.name in ('actuator_motors', 'actuator_servos')
                                 for elem in data)
-    actuator_controls_0 = ActuatorControls(ulog, dynamic_control_alloc, 0)
-    actuator_controls_1 = ActuatorControls(ulog, dynamic_control_alloc, 1)
+    actuator_controls_0 = get_actuator_controls(ulog, dynamic_control_alloc, 0)
+    actuator_controls_1 = get_actuator_controls(ulog, dynamic_control_alloc, 1)
 
     # initialize flight mode changes
     flight_mode_changes = get_flight_mode_changes(ulog)
 
     # VTOL state changes & vehicle type
-    vtol_states = None
-    is_vtol = False
-    is_vtol_tailsitter = False
-    try:
-        cur_dataset = ulog.get_dataset('vehicle_status')
-        if np.amax(cur_dataset.data['is_vtol']) == 1:
-            is_vtol = True
-            # check if is tailsitter
-            is_vtol_tailsitter = ('is_vtol_tailsitter' in cur_dataset.data and
-                                  np.amax(cur_dataset.data['is_vtol_tailsitter']) == 1)
-            # find mode after transitions (states: 1=transition, 2=FW, 3=MC)
-            if 'vehicle_type' in cur_dataset.data:
-                vehicle_type_field = 'vehicle_type'
-                vtol_state_mapping = {2: 2, 1: 3}
-                vehicle_type = cur_dataset.data['vehicle_type']
-                in_transition_mode = cur_dataset.data['in_transition_mode']
-                vtol_states = []
-                for i in range(len(vehicle_type)):
-                    # a VTOL can change state also w/o in_transition_mode set
-                    # (e.g. in Manual mode)
-                    if i == 0 or in_transition_mode[i-1] != in_transition_mode[i] or \
-                        vehicle_type[i-1] != vehicle_type[i]:
-                        vtol_states.append((cur_dataset.data['timestamp'][i],
-                                            in_transition_mode[i]))
-
-            else: # COMPATIBILITY: old logs (https://github.com/PX4/Firmware/pull/11918)
-                vtol_states = cur_dataset.list_value_changes('in_transition_mode')
-                vehicle_type_field = 'is_rotary_wing'
-                vtol_state_mapping = {0: 2, 1: 3}
-            for i in range(len(vtol_states)):
-                if vtol_states[i][1] == 0:
-                    t = vtol_states[i][0]
-                    idx = np.argmax(cur_dataset.data['timestamp'] >= t) + 1
-                    vtol_states[i] = (t, vtol_state_mapping[
-                        cur_dataset.data[vehicle_type_field][idx]])
-            vtol_states.append((ulog.last_timestamp, -1))
-    except (KeyError, IndexError) as error:
-        vtol_states = None
+    is_vtol, is_vtol_tailsitter, vtol_states = get_vtol_states(ulog)
 
 
 
@@ -733,7 +686,7 @@ def generate_plots(ulog, px4_ulog, db_data, vehicle_data, link_to_3d_page,
 
     # FIFO accel
     for instance in range(3):
-        if add_virtual_fifo_topic_data(ulog, 'sensor_accel_fifo', instance):
+        if has_virtual_fifo_topic_data(ulog, 'sensor_accel_fifo', instance):
             # Raw data
             data_plot = DataPlot(data, plot_config, 'sensor_accel_fifo_virtual',
                                  y_axis_label='[m/s^2]',
@@ -769,7 +722,7 @@ def generate_plots(ulog, px4_ulog, db_data, vehicle_data, link_to_3d_page,
 
     # FIFO gyro
     for instance in range(3):
-        if add_virtual_fifo_topic_data(ulog, 'sensor_gyro_fifo', instance):
+        if has_virtual_fifo_topic_data(ulog, 'sensor_gyro_fifo', instance):
             # Raw data
             data_plot = DataPlot(data, plot_config, 'sensor_gyro_fifo_virtual',
                                  y_axis_label='[deg/s]', title=f'Raw Gyro (FIFO, IMU{instance})',
@@ -1059,7 +1012,9 @@ def generate_plots(ulog, px4_ulog, db_data, vehicle_data, link_to_3d_page,
     param_changes_button.on_click(param_changes_button_clicked)
 
 
-    user_agent = curdoc().session_context.request.headers.get("User-Agent", "")
+    user_agent = ''
+    if curdoc().session_context is not None: # None if not served (e.g. benchmark)
+        user_agent = curdoc().session_context.request.headers.get("User-Agent", "")
     is_mobile = re.search(r'Mobile|iP(hone|od|ad)|Android|BlackBerry|'
             r'IEMobile|Kindle|NetFront|Silk-Accelerated|(hpw|web)OS|Fennec|'
             r'Minimo|Opera M(obi|ini)|Blazer|Dolfin|'
@@ -1,9 +1,174 @@
 """ Class for server-side dynamic data downsampling """
 
+from collections import Counter
 from timeit import default_timer as timer
 import numpy as np
+from bokeh.core.property.validation import without_property_validation
 from bokeh.models import ColumnDataSource
-from helper import print_timing
+from config import get_downsample_method, get_zoom_debounce_ms, \
+    get_plot_payload_narrowing
+from helper import get_minmax_pyramid, print_timing
+from minmax_pyramid import MinMaxPyramid
+
+# 'stride': every N-th sample, 'm4': first, last, min and max sample per pixel,
+# 'lttb': largest triangle three buckets
+DOWNSAMPLE_METHODS = ('stride', 'm4', 'lttb')
+
+# zoom callback statistics of this process (see print_zoom_stats())
+_zoom_stats = Counter()
+
+# payload narrowing: None to use the configuration (see set_payload_narrowing())
+_payload_narrowing = {'enable': None}
+
+
+def set_payload_narrowing(enable):
+    """ enable or disable the payload narrowing, overriding the configuration
+    (e.g. for benchmarking)
+    :param enable: bool, None to use the configuration
+    """
+    _payload_narrowing['enable'] = enable
+
+def is_payload_narrowing_enabled():
+    """ check whether plot data is narrowed (see narrow_plot_data()) """
+    if _payload_narrowing['enable'] is None:
+        return get_plot_payload_narrowing()
+    return _payload_narrowing['enable']
+
+def narrow_array(values, is_x=False):
+    """ convert an array to a smaller type that bokeh sends binary encoded:
+    float64 values to float32, and 64 bit integers to 32 bit if they fit or
+    else to float64 (bokeh sends 64 bit integers as JSON lists). Integer
+    values stay exact, so timestamps [us] remain valid x coordinates.
+    :param is_x: x values: float64 values are kept
+    """
+    if not isinstance(values, np.ndarray) or values.dtype.itemsize != 8 or \
+            values.dtype.kind not in 'iuf':
+        return values
+    if values.dtype.kind == 'f':
+        if is_x:
+            return values
+        with np.errstate(over='ignore'):
+            return values.astype(np.float32)
+    if len(values) == 0:
+        return values.astype(np.int32)
+    min_value, max_value = values.min(), values.max()
+    if min_value >= np.iinfo(np.int32).min and max_value <= np.iinfo(np.int32).max:
+        return values.astype(np.int32)
+    if min_value >= 0 and max_value <= np.iinfo(np.uint32).max:
+        return values.astype(np.uint32)
+    return values.astype(np.float64)
+
+def narrow_plot_data(data, x_key):
+    """ narrow the arrays of plot data (see narrow_array()), if enabled
+    :param data: dict of column name: array (not modified)
+    :return: dict with the narrowed arrays
+    """
+    if not is_payload_narrowing_enabled():
+        return data
+    return {k: narrow_array(value, k == x_key) for k, value in data.items()}
+
+
+def _get_buckets(x, num_buckets):
+    """ split sorted samples into buckets of equal x range
+    :return: tuple (start index, number of samples) of the non-empty buckets
+    """
+    edges = np.linspace(float(x[0]), float(x[-1]), num_buckets + 1)[1:-1]
+    starts = np.unique(np.concatenate(([0], np.searchsorted(x, edges))))
+    counts = np.diff(np.append(starts, len(x)))
+    return starts, counts
+
+def _first_per_bucket(mask, bucket_ids):
+    """ get the index of the first sample per bucket for which mask is set """
+    indices = np.flatnonzero(mask)
+    if len(indices) == 0:
+        return indices
+    buckets = bucket_ids[indices]
+    is_first = np.empty(len(indices), dtype=bool)
+    is_first[0] = True
+    np.not_equal(buckets[1:], buckets[:-1], out=is_first[1:])
+    return indices[is_first]
+
+def _nan_indices(y, bucket_ids):
+    """ get the first NaN sample per bucket (so that gaps stay visible) """
+    if y.dtype.kind != 'f':
+        return np.empty(0, dtype=np.int64)
+    return _first_per_bucket(np.isnan(y), bucket_ids)
+
+def m4_indices(x, columns, num_buckets):
+    """ M4 downsampling: the first, last, minimum and maximum sample of every
+    bucket (pixel) of every column, which preserves the shape of a line plot
+    (including spikes).
+    :param x: sorted x values
+    :param columns: list of y value arrays
+    :return: sorted sample indices
+    """
+    starts, counts = _get_buckets(x, num_buckets)
+    bucket_ids = np.repeat(np.arange(len(starts)), counts)
+    indices = [starts, starts + counts - 1]
+    for y in columns:
+        # fmin/fmax ignore NaN's
+        y_min = np.repeat(np.fmin.reduceat(y, starts), counts)
+        y_max = np.repeat(np.fmax.reduceat(y, starts), counts)
+        indices.append(_first_per_bucket(y == y_min, bucket_ids))
+        indices.append(_first_per_bucket(y == y_max, bucket_ids))
+        indices.append(_nan_indices(y, bucket_ids))
+    return np.unique(np.concatenate(indices))
+
+def lttb_indices(x, columns, num_points):
+    """ Largest triangle three buckets downsampling: per bucket, the sample
+    forming the largest triangle with the neighboring buckets. All buckets are
+    processed at once: the left point is the average of the previous bucket
+    (instead of the sample selected there).
+    :param x: sorted x values
+    :param columns: list of y value arrays (the selected samples are merged)
+    :param num_points: number of samples per column
+    :return: sorted sample indices
+    """
+    num_samples = len(x)
+    if num_points < 3 or num_points >= num_samples:
+        return np.arange(num_samples)
+    # the first and last sample are always kept
+    edges = np.linspace(1, num_samples - 1, num_points - 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    bucket_ids = np.repeat(np.arange(len(starts)), counts)
+    x = np.asarray(x, dtype=np.float64) - float(x[0])
+    x_inner = x[1:-1]
+    avg_x = np.add.reduceat(x_inner, starts - 1) / counts
+    left_x = np.concatenate(([x[0]], avg_x[:-1]))[bucket_ids]
+    right_x = np.concatenate((avg_x[1:], [x[-1]]))[bucket_ids]
+    indices = [[0, num_samples - 1]]
+    for y in columns:
+        y = np.asarray(y, dtype=np.float64)
+        y_inner = y[1:-1]
+        avg_y = np.add.reduceat(np.nan_to_num(y_inner), starts - 1) / counts
+        left_y = np.concatenate(([y[0]], avg_y[:-1]))[bucket_ids]
+        right_y = np.concatenate((avg_y[1:], [y[-1]]))[bucket_ids]
+        area = np.abs((left_x - right_x) * (y_inner - left_y) -
+                      (left_x - x_inner) * (right_y - left_y))
+        max_area = np.repeat(np.fmax.reduceat(area, starts - 1), counts)
+        indices.append(_first_per_bucket(area == max_area, bucket_ids) + 1)
+        indices.append(_nan_indices(y_inner, bucket_ids) + 1)
+    return np.unique(np.concatenate(indices))
+
+def get_downsample_indices(x, columns, method, num_pixels, density):
+    """ get the samples to plot
+    :param x: sorted x values
+    :param columns: list of y value arrays
+    :param method: one of DOWNSAMPLE_METHODS
+    :param num_pixels: width of the x range in pixels
+    :param density: number of samples per pixel (for M4 this is given by the
+                    number of columns)
+    :return: slice or index array, None if no downsampling is needed
+    """
+    max_num_data_points = int(num_pixels * density)
+    if len(x) <= max_num_data_points:
+        return None
+    if method == 'm4':
+        return m4_indices(x, columns, max(1, int(num_pixels)))
+    if method == 'lttb':
+        return lttb_indices(x, columns, max_num_data_points)
+    return slice(None, None, int(len(x) / max_num_data_points))
 
 
 class DynamicDownsample:
@@ -12,21 +177,42 @@ class DynamicDownsample:
         Initializes the plot with a fixed number of samples per pixel and then
         dynamically loads samples when zooming in or out based on density
         thresholds.
-        Currently uses a very simple downsampling by picking every N-th sample
+        The samples are selected with one of DOWNSAMPLE_METHODS. For M4, they
+        are taken from min/max pyramids (see minmax_pyramid.py), so that a zoom
+        only needs O(number of pixels) instead of O(number of samples).
+        Several data sources with the same x values can be added (see
+        add_data()): the samples are selected once for all of them.
     """
-    def __init__(self, bokeh_plot, data, x_key):
+    def __init__(self, bokeh_plot, data, x_key, method=None, dataset=None,
+                 registry=None):
         """ Initialize and setup callback
 
         Args:
             bokeh_plot (bokeh.plotting.figure) : plot for downsampling
             data (dict) : data source of the plots, contains all samples. Arrays
-                          are expected to be numpy
+                          are expected to be numpy, x values sorted
             x_key (str): key for x axis in data
+            method (str): downsampling method (if None, the configured one)
+            dataset (ULog.Data): topic of the data (optional). The pyramids of
+                                 its fields are shared with other plots.
+            registry (DownsampleRegistry): if set, x range changes are
+                                           coalesced by the registry
         """
         self.bokeh_plot = bokeh_plot
+        self.registry = registry
         self.x_key = x_key
-        self.data = data
+        self.dataset = dataset
         self.last_step_size = 1
+        if method is None:
+            method = get_downsample_method()
+        if method not in DOWNSAMPLE_METHODS:
+            print('Unknown downsampling method', method)
+            method = 'stride'
+        self.method = method
+        # pyramids of the dataset fields and of the other columns, created when
+        # first needed
+        self._dataset_pyramid = None
+        self._pyramid = None
 
         # parameters
         # minimum number of samples/pixel. Below that, we load new data
@@ -40,25 +226,69 @@ class DynamicDownsample:
         # when loading new data, add a percentage of data on both sides
         self.range_margin = 0.2
 
-        # create a copy of the initial data
-        self.init_data = {}
+        # all samples of the columns of all data sources (columns with the
+        # same name but different data are renamed), and the current samples
+        self.init_data = {x_key: data[x_key]}
         self.cur_data = {}
-        for k in data:
-            self.init_data[k] = data[k]
-            self.cur_data[k] = data[k]
+        # list of (ColumnDataSource, dict of column name: key in init_data)
+        self._data_sources = []
+        # arguments of the current _update() call
+        self._cur_selection = (0, len(data[x_key]), self.bokeh_plot.width,
+                               self.startup_density)
 
         # first downsampling
-        self.downsample(self.cur_data, self.bokeh_plot.width *
-                        self.startup_density)
-        self.data_source = ColumnDataSource(data=self.cur_data)
+        self.data_source = self.add_data(data)
 
         # register the callbacks
         bokeh_plot.x_range.on_change('start', self.x_range_change_cb)
         bokeh_plot.x_range.on_change('end', self.x_range_change_cb)
 
+    @property
+    def max_density(self):
+        """ above this number of samples/pixel, we load new data """
+        max_density = self.init_density * 3
+        if self.method == 'm4':
+            # up to first, last, min and max of every column per pixel
+            num_columns = len(self._get_column_names())
+            max_density = max(max_density, 3 * (2 + 2 * num_columns))
+        return max_density
+
+    def add_data(self, data):
+        """ add a data source with the same x values
+        :param data: dict (see constructor)
+        :return: ColumnDataSource with the downsampled data
+        """
+        if data[self.x_key] is not self.init_data[self.x_key] and \
+                not np.array_equal(data[self.x_key], self.init_data[self.x_key]):
+            raise ValueError('Data with different x values')
+        columns = {}
+        for k, value in data.items():
+            key = k
+            if k != self.x_key and k in self.init_data and self.init_data[k] is not value:
+                key = k + '.' + str(len(self.init_data))
+            if k != self.x_key:
+                self.init_data[key] = value
+            columns[k] = key
+        data_source = ColumnDataSource(data={})
+        self._data_sources.append((data_source, columns))
+        # select the samples again, including the new columns
+        self._update(*self._cur_selection)
+        return data_source
+
 
     def x_range_change_cb(self, attr, old, new):
         """ bokeh server-side callback when plot x-range changes (zooming) """
+        _zoom_stats['callbacks'] += 1
+        if self.registry is not None:
+            self.registry.schedule_update(self)
+        else:
+            self.update_range()
+
+    # the data is valid by construction, validating every element is slower
+    # than the downsampling itself
+    @without_property_validation
+    def update_range(self):
+        """ load new data for the current x range of the plot, if needed """
         cb_start_time = timer()
 
         new_range = [self.bokeh_plot.x_range.start, self.bokeh_plot.x_range.end]
@@ -74,14 +304,17 @@ class DynamicDownsample:
                 (new_range[1] > cur_range[1] and cur_range[1] < init_x[-self.last_step_size]):
             need_update = True # zooming out / panning
 
-        visible_points = ((new_range[0] < cur_x) & (cur_x < new_range[1])).sum()
+        # the samples within (new_range[0], new_range[1])
+        visible_points = np.searchsorted(cur_x, new_range[1], 'left') - \
+            np.searchsorted(cur_x, new_range[0], 'right')
         if visible_points / plot_width < self.min_density:
-            visible_points_all_data = ((new_range[0] < init_x) & (init_x < new_range[1])).sum()
+            visible_points_all_data = np.searchsorted(init_x, new_range[1], 'left') - \
+                np.searchsorted(init_x, new_range[0], 'right')
             if visible_points_all_data > visible_points:
                 need_update = True
             # else: reached maximum zoom level
 
-        if visible_points / plot_width > self.init_density * 3:
+        if visible_points / plot_width > self.max_density:
             # mostly a precaution, the panning case above catches most cases
             need_update = True
 
@@ -89,27 +322,188 @@ class DynamicDownsample:
             drange = new_range[1] - new_range[0]
             new_range[0] -= drange * self.range_margin
             new_range[1] += drange * self.range_margin
-            num_data_points = plot_width * self.init_density * (1 + 2*self.range_margin)
-            indices = np.logical_and(init_x > new_range[0], init_x < new_range[1])
-
-            self.cur_data = {}
-            for k,value in self.init_data.items():
-                self.cur_data[k] = value[indices]
+            num_pixels = plot_width * (1 + 2*self.range_margin)
+            start = np.searchsorted(init_x, new_range[0], 'right')
+            end = np.searchsorted(init_x, new_range[1], 'left')
 
-            # downsample
-            self.downsample(self.cur_data, num_data_points)
+            if (start, end, num_pixels, self.init_density) == self._cur_selection:
+                # e.g. the range moved back before the update was handled
+                _zoom_stats['unchanged'] += 1
+                _zoom_stats['bytes_saved'] += self.get_payload_bytes()
+                return
 
-            self.data_source.data = self.cur_data
+            self._update(start, end, num_pixels, self.init_density)
+            _zoom_stats['updates'] += 1
+            _zoom_stats['bytes_sent'] += self.get_payload_bytes()
 
             print_timing("Data update", cb_start_time)
 
+    def get_payload_bytes(self):
+        """ get the size of the current data of all data sources (i.e. of an
+        update sent to the browser, approximately) """
+        return sum(self.cur_data[key].nbytes for _, columns in self._data_sources
+                   for key in columns.values())
+
+
+    def _get_column_names(self):
+        """ get the keys of the numeric y value arrays in init_data """
+        return [k for k, value in self.init_data.items() if k != self.x_key and
+                isinstance(value, np.ndarray) and value.dtype.kind in 'biuf']
+
+    def _get_pyramids(self):
+        """ get the min/max pyramids of the numeric y columns: the fields of
+        the dataset use the shared pyramid of the topic, computed columns get
+        their own
+        :return: list of (MinMaxPyramid, list of keys in init_data)
+        """
+        data = self.init_data
+        column_names = self._get_column_names()
+        field_names = []
+        if self.dataset is not None and \
+                data[self.x_key] is self.dataset.data.get('timestamp'):
+            field_names = [k for k in column_names if data[k] is self.dataset.data.get(k)]
+        other_names = [k for k in column_names if k not in field_names]
+        pyramids = []
+        if len(field_names) > 0:
+            # the pyramid of the dataset is shared: only look it up once
+            if self._dataset_pyramid is None or \
+                    not all(self._dataset_pyramid.has_field(k) for k in field_names):
+                self._dataset_pyramid = get_minmax_pyramid(self.dataset, field_names)
+            pyramids.append((self._dataset_pyramid, field_names))
+        if len(other_names) > 0:
+            if self._pyramid is None:
+                self._pyramid = MinMaxPyramid(len(data[self.x_key]))
+            for k in other_names:
+                if not self._pyramid.has_field(k):
+                    self._pyramid.add_field(k, MinMaxPyramid.build_field(data[k]))
+            pyramids.append((self._pyramid, other_names))
+        return pyramids
+
+    def _get_indices(self, start, end, num_pixels, density):
+        """ get the samples to plot of an index range
+        :param start, end: index range [start, end) of the initial data
+        :return: slice or index array
+        """
+        self.last_step_size = 1
+        if end - start <= int(num_pixels * density):
+            return slice(start, end)
+        if self.method == 'm4':
+            return np.unique(np.concatenate(
+                [pyramid.get_indices(field_names, start, end, max(1, int(num_pixels)))
+                 for pyramid, field_names in self._get_pyramids()] +
+                [np.array([start, end - 1])]))
+        data = {k: value[start:end] for k, value in self.init_data.items()}
+        columns = [data[k] for k in self._get_column_names()]
+        indices = get_downsample_indices(data[self.x_key], columns, self.method,
+                                         num_pixels, density)
+        if indices is None:
+            return slice(start, end)
+        if isinstance(indices, slice):
+            self.last_step_size = indices.step
+            return slice(start, end, indices.step)
+        return indices + start
+
+    def _update(self, start, end, num_pixels, density):
+        """ select the samples of an index range and update the data sources
+        :param start, end: index range [start, end) of the initial data
+        """
+        self._cur_selection = (start, end, num_pixels, density)
+        indices = self._get_indices(start, end, num_pixels, density)
+        # the columns are shared between the data sources
+        self.cur_data = narrow_plot_data(
+            {k: value[indices] for k, value in self.init_data.items()}, self.x_key)
+        for data_source, columns in self._data_sources:
+            data_source.data = {k: self.cur_data[key] for k, key in columns.items()}
+
+
+class DownsampleRegistry: #pylint: disable=too-few-public-methods
+    """ Shares the downsampling between the plots of a document: the data
+    sources of a topic (instance) with the same x range (bokeh model) use one
+    DynamicDownsample, so that the samples are selected once per zoom for all
+    of them. """
+
+    # while the x range keeps changing (e.g. dragging), handle the changes at
+    # least after this many debounce intervals
+    MAX_DEBOUNCE_INTERVALS = 4
+
+    def __init__(self, doc=None):
+        """
+        :param doc: bokeh Document, used to debounce x range changes (see
+                    schedule_update())
+        """
+        self._doc = doc
+        # key: (topic name, multi id, x range id, method)
+        self._downsamplers = {}
+        # downsamplers with x range changes to handle (dict used as ordered set)
+        self._pending = {}
+        self._timeout_callback = None
+        self._first_pending_time = 0
+
+    def get_data_source(self, bokeh_plot, data, x_key, method=None, dataset=None):
+        """ get a downsampled data source (see DynamicDownsample for the
+        arguments). The data is only shared if dataset is given and the x
+        values are its timestamps.
+        :return: ColumnDataSource
+        """
+        if method is None:
+            method = get_downsample_method()
+        if dataset is None or data[x_key] is not dataset.data.get('timestamp'):
+            return DynamicDownsample(bokeh_plot, data, x_key, method, dataset,
+                                     self).data_source
+        key = (dataset.name, dataset.multi_id, bokeh_plot.x_range.id, method)
+        downsampler = self._downsamplers.get(key)
+        if downsampler is None:
+            downsampler = DynamicDownsample(bokeh_plot, data, x_key, method, dataset, self)
+            self._downsamplers[key] = downsampler
+            return downsampler.data_source
+        return downsampler.add_data(data)
+
+    def schedule_update(self, downsampler):
+        """ handle the x range change of a downsampler, debounced: the changes
+        of all plots of the document are handled together once the ranges did
+        not change for a while, and only the latest range of each plot. """
+        debounce_ms = get_zoom_debounce_ms()
+        if debounce_ms <= 0 or self._doc is None or self._doc.session_context is None:
+            downsampler.update_range()
+            return
+        if downsampler in self._pending:
+            # this callback is coalesced with the pending one (counted as
+            # saved: the size of an update it could have sent)
+            _zoom_stats['dropped'] += 1
+            _zoom_stats['bytes_saved'] += downsampler.get_payload_bytes()
+        self._pending[downsampler] = None
+        if self._timeout_callback is None:
+            self._first_pending_time = timer()
+        elif timer() - self._first_pending_time < \
+                debounce_ms * self.MAX_DEBOUNCE_INTERVALS / 1000:
+            self._doc.remove_timeout_callback(self._timeout_callback)
+        else:
+            return # keep the pending timeout
+        self._timeout_callback = self._doc.add_timeout_callback(
+            self._handle_pending_updates, debounce_ms)
+
+    def _handle_pending_updates(self):
+        """ timeout callback: handle the latest x ranges """
+        self._timeout_callback = None
+        pending = list(self._pending)
+        self._pending = {}
+        for downsampler in pending:
+            downsampler.update_range()
+
 
-    def downsample(self, data, max_num_data_points):
-        """ downsampling with a given maximum number of samples """
-        if len(data[self.x_key]) > max_num_data_points:
-            step_size = int(len(data[self.x_key]) / max_num_data_points)
-            self.last_step_size = step_size
-            for k in data:
-                data[k] = data[k][::step_size]
+def get_downsample_registry(doc):
+    """ get the DownsampleRegistry of a bokeh document (created on first use) """
+    registry = getattr(doc, '_downsample_registry', None)
+    if registry is None:
+        registry = DownsampleRegistry(doc)
+        setattr(doc, '_downsample_registry', registry)
+    return registry
 
 
+def print_zoom_stats():
+    """ print the zoom callback statistics of this process """
+    print('zoom callbacks: {:} ({:} dropped by debouncing), updates: {:} sent, '
+          '{:} unchanged, {:.1f} MB sent, {:.1f} MB saved'.format(
+              _zoom_stats['callbacks'], _zoom_stats['dropped'], _zoom_stats['updates'],
+              _zoom_stats['unchanged'], _zoom_stats['bytes_sent'] / 1024**2,
+              _zoom_stats['bytes_saved'] / 1024**2))
@@ -0,0 +1,127 @@
+""" Layout of the stored files (logs, KML files, overview images).
+
+Files are stored in sharded directories: <base>/ab/cd/<id><suffix>, where ab
+and cd are the first characters of the id, so that no directory gets too large.
+Files in the previous flat layout (<base>/<id><suffix>) are still found, they
+can be moved with migrate_storage.py while the server is running.
+
+Log files are also deduplicated by content: identical uploads share the same
+file, through hard links to <log dir>/sha256/ab/cd/<sha256 of the content>.
+"""
+
+import hashlib
+import os
+import uuid
+
+from log_storage import open_log_file, compress_log_file, is_compressed_log_file
+
+CONTENT_DIR_NAME = 'sha256'
+
+
+def get_sharded_filename(base_path, file_id, suffix):
+    """ get the file name in the sharded layout """
+    return os.path.join(base_path, file_id[0:2], file_id[2:4], file_id+suffix)
+
+def resolve_filename(base_path, file_id, suffix):
+    """ get the file name of a stored file, in the sharded or the flat layout.
+    :return: file name (in the sharded layout if the file does not exist)
+    """
+    sharded_file_name = get_sharded_filename(base_path, file_id, suffix)
+    if os.path.exists(sharded_file_name):
+        return sharded_file_name
+    flat_file_name = os.path.join(base_path, file_id+suffix)
+    if os.path.exists(flat_file_name):
+        return flat_file_name
+    return sharded_file_name
+
+def make_parent_dirs(file_name):
+    """ create the (shard) directories of a file name """
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+def get_log_file_sha256(file_name):
+    """ get the SHA-256 digest of the (uncompressed) content of a log file """
+    digest = hashlib.sha256()
+    with open_log_file(file_name) as file_handle:
+        while True:
+            data = file_handle.read(1024 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+def _get_content_filename(log_path, digest):
+    return get_sharded_filename(os.path.join(log_path, CONTENT_DIR_NAME), digest, '.ulg')
+
+def replace_with_link(source_file_name, file_name):
+    """ atomically replace a file with a hard link to another file """
+    temp_file_name = file_name+'.'+str(uuid.uuid4())
+    os.link(source_file_name, temp_file_name)
+    os.replace(temp_file_name, file_name)
+
+def store_log_file(log_path, file_name, digest=None):
+    """ finish storing a new log file: if an identical log is stored already,
+    the file is replaced by a hard link to it. Otherwise it is added to the
+    content store (uncompressed, see compress_stored_log_file()).
+    :param log_path: log files directory
+    :param digest: SHA-256 of the content if known already
+    :return: True if the log is a duplicate
+    """
+    if digest is None:
+        digest = get_log_file_sha256(file_name)
+    content_file_name = _get_content_filename(log_path, digest)
+    if os.path.exists(content_file_name):
+        replace_with_link(content_file_name, file_name)
+        return True
+    make_parent_dirs(content_file_name)
+    try:
+        os.link(file_name, content_file_name)
+    except FileExistsError:
+        # an identical log got stored concurrently
+        replace_with_link(content_file_name, file_name)
+        return True
+    return False
+
+def compress_stored_log_file(log_path, file_name, digest=None):
+    """ compress a stored log file in place (after storing it uncompressed with
+    store_log_file(), e.g. in a background job). The content store entry is
+    compressed and the log file replaced by a hard link to it, so identical
+    logs keep sharing the file (each one is relinked when it is processed).
+    Note that this changes the modification time of the log (see
+    log_storage.compress_log_file()).
+    :param digest: SHA-256 of the content if known already
+    :return: True if the log file changed
+    """
+    if is_compressed_log_file(file_name):
+        return False
+    if digest is None:
+        digest = get_log_file_sha256(file_name)
+    content_file_name = _get_content_filename(log_path, digest)
+    try:
+        if is_compressed_log_file(content_file_name):
+            # compressed already for an identical log
+            replace_with_link(content_file_name, file_name)
+            return True
+        if os.path.samefile(content_file_name, file_name):
+            compress_log_file(content_file_name)
+            replace_with_link(content_file_name, file_name)
+            return True
+    except FileNotFoundError:
+        pass # not in the content store
+    return compress_log_file(file_name)
+
+def remove_log_file(log_path, file_name, digest=None):
+    """ delete a log file (and its content store entry if it was the last log
+    with this content)
+    :param digest: SHA-256 of the content if known (Logs.Sha256), otherwise it
+                   is computed if the file is in the content store
+    """
+    if not digest and os.stat(file_name).st_nlink > 1:
+        digest = get_log_file_sha256(file_name)
+    os.unlink(file_name)
+    if digest:
+        content_file_name = _get_content_filename(log_path, digest)
+        try:
+            if os.stat(content_file_name).st_nlink == 1:
+                os.unlink(content_file_name)
+        except FileNotFoundError:
+            pass
@@ -1,4 +1,6 @@
 """ some helper methods that don't fit in elsewhere """
+import hashlib
+import io
 import json
 from timeit import default_timer as timer
 import time
@@ -6,7 +8,12 @@ import re
 import os
 import traceback
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from functools import lru_cache
+import multiprocessing
+from multiprocessing import resource_tracker
 from urllib.request import urlretrieve
 import xml.etree.ElementTree # airframe parsing
 import shutil
@@ -19,8 +26,17 @@ from scipy.interpolate import interp1d
 from config_tables import *
 from config import get_log_filepath, get_airframes_filename, get_airframes_url, \
                    get_parameters_filename, get_parameters_url, \
-                   get_log_cache_size, debug_print_timing, \
-                   get_releases_filename
+                   get_log_cache_max_bytes, debug_print_timing, \
+                   get_releases_filename, get_ulog_cache_filepath, use_ulog_disk_cache, \
+                   get_ulog_disk_cache_max_bytes, \
+                   get_ulog_shared_cache_filepath, get_ulog_shared_cache_max_bytes, \
+                   get_streaming_threshold_bytes, get_streaming_max_samples, \
+                   get_parallel_decode_workers, get_kml_filepath, get_overview_img_filepath
+from ulog_cache import ULogDiskCache, ULogMemoryCache
+from ulog_index import DerivedData, LazyData, LazyULog
+from minmax_pyramid import MinMaxPyramid
+from log_storage import get_log_file_size
+from file_storage import resolve_filename
 
 from Crypto.Cipher import ChaCha20
 from Crypto.PublicKey import RSA
@@ -74,7 +90,15 @@ def get_log_filename(log_id):
     """
     if _check_log_id_is_filename():
         return log_id
-    return os.path.join(get_log_filepath(), log_id + '.ulg')
+    return resolve_filename(get_log_filepath(), log_id, '.ulg')
+
+def get_kml_filename(log_id):
+    """ return the (cached) KML file name of a log """
+    return resolve_filename(get_kml_filepath(), log_id.replace('/', '.'), '.kml')
+
+def get_overview_img_filename(log_id):
+    """ return the overview image file name of a log """
+    return resolve_filename(get_overview_img_filepath(), log_id, '.png')
 
 
 __last_failed_downloads = {} # dict with key=file name and a timestamp of last failed download
@@ -290,36 +314,228 @@ class ULogException(Exception):
     """
     pass
 
-@lru_cache(maxsize=get_log_cache_size())
+class _SingleFlight:
+    """
+    Deduplicate concurrent calls for the same key: the first caller executes
+    the function, all others wait for it and share its result (or exception).
+    """
+
+    class _Call:
+        """ an in-progress call """
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key: call key, value: _Call
+
+    def do(self, key, func, *args):
+        """ call func(*args), unless a call for key is already in progress
+        :return: result of func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_owner = call is None
+            if is_owner:
+                call = self._Call()
+                self._calls[key] = call
+
+        if not is_owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+__ulog_single_flight = _SingleFlight()
+__ulog_memory_cache = ULogMemoryCache(get_log_cache_max_bytes())
+__ulog_disk_cache = ULogDiskCache(get_ulog_cache_filepath(),
+                                  get_ulog_disk_cache_max_bytes()) \
+    if use_ulog_disk_cache() else None
+__ulog_shared_cache = ULogDiskCache(get_ulog_shared_cache_filepath(),
+                                    get_ulog_shared_cache_max_bytes()) \
+    if get_ulog_shared_cache_filepath() is not None else None
+
+def _get_ulog_cache_key(file_name):
+    """ get the key for the persistent ulog cache: the log id for uploaded
+    logs, a hash of the path otherwise (e.g. when running locally) """
+    file_dir, base_name = os.path.split(os.path.realpath(file_name))
+    log_dir = os.path.realpath(get_log_filepath())
+    # uploaded logs are in the log directory or in one of its shards
+    if base_name.endswith('.ulg') and \
+            os.path.commonpath([file_dir, log_dir]) == log_dir:
+        return base_name[:-4]
+    return 'local-'+hashlib.sha1(file_dir.encode('utf-8')).hexdigest()[:16]+'-'+base_name
+
 def load_ulog_file(file_name):
-    """ load an ULog file
+    """ load an ULog file (cached)
     :return: ULog object
     """
     # The reason to put this method into helper is that the main module gets
     # (re)loaded on each page request. Thus the caching would not work there.
+    ulog = __ulog_memory_cache.get(file_name)
+    if ulog is None:
+        # concurrent requests for the same file wait for a single load
+        ulog = __ulog_single_flight.do(file_name, _load_ulog_file_to_cache, file_name)
+    return ulog
+
+def _load_ulog_file_to_cache(file_name):
+    """ load an ULog file and add it to the in-memory cache """
+    # another load might have completed since the cache lookup
+    ulog = __ulog_memory_cache.get(file_name, update_stats=False)
+    if ulog is None:
+        ulog = _load_ulog_file(file_name)
+        __ulog_memory_cache.put(file_name, ulog)
+    return ulog
+
+def _load_ulog_file(file_name):
+    """ load an ULog file from the shared or persistent cache or index it.
+    Topics are decoded when they are accessed the first time.
+    :return: LazyULog object
+    """
+    try:
+        max_samples = _get_ulog_max_samples(file_name)
+    except FileNotFoundError:
+        print("Error: file %s not found" % file_name)
+        raise
+
+    cache_key = _get_ulog_cache_key(file_name)
+    if __ulog_shared_cache is None:
+        ulog = _load_ulog_file_from_disk(file_name, cache_key, max_samples)
+    else:
+        ulog = __ulog_shared_cache.load(cache_key, file_name, max_samples)
+        if ulog is None:
+            # another worker process might be loading the same log: wait for it
+            with __ulog_shared_cache.lock(cache_key):
+                ulog = __ulog_shared_cache.load(cache_key, file_name, max_samples)
+                if ulog is None:
+                    ulog = _load_ulog_file_from_disk(file_name, cache_key, max_samples)
+                    __ulog_shared_cache.store(cache_key, file_name, ulog)
+                    # use the shared copy, so that this process does not keep its own
+                    shared_ulog = __ulog_shared_cache.load(cache_key, file_name, max_samples)
+                    if shared_ulog is not None:
+                        ulog = shared_ulog
+
+    ulog.cache_key = cache_key
+    ulog.decode_callback = lambda dataset: _on_topic_decoded(file_name, cache_key, dataset)
+    _add_compatibility_views(ulog)
+    return ulog
+
+# COMPATIBILITY: renamed topic fields, key: topic name, value: list of (old, new)
+__ULOG_RENAMED_FIELDS = {
+    'system_power': [
+        ('voltage5V_v', 'voltage5v_v'),     # old (prior to PX4/Firmware:213aa93)
+        ('voltage3V3_v', 'sensors3v3[0]'),  # old (prior to PX4/Firmware:213aa93)
+        ('voltage3v3_v', 'sensors3v3[0]'),
+        ],
+    'tecs_status': [
+        ('airspeed_sp', 'true_airspeed_sp'), # old (prior to PX4-Autopilot/pull/16585)
+        ],
+    }
+
+# topics with arrays of samples, for which a virtual topic with the individual
+# samples (named topic_name+'_virtual') is added
+__ULOG_FIFO_TOPICS = ['sensor_accel_fifo', 'sensor_gyro_fifo']
+
+def _add_compatibility_views(ulog):
+    """ apply the field renames for older logs and add the virtual topics to a
+    freshly loaded log, so that plotting code can treat the (cached and shared)
+    ULog object as read-only. Virtual topics are computed on first access.
+    """
+    #pylint: disable=protected-access
+    for dataset in list(ulog.data_list):
+        for old_name, new_name in __ULOG_RENAMED_FIELDS.get(dataset.name, []):
+            dataset.rename_field(old_name, new_name)
+        if dataset.name in __ULOG_FIFO_TOPICS:
+            field_data = [ULog._FieldData(field_name, type_str) for field_name, type_str in
+                          [('timestamp', 'uint64_t'), ('timestamp_sample', 'uint64_t'),
+                           ('x', 'double'), ('y', 'double'), ('z', 'double')]]
+            ulog.data_list.append(DerivedData(
+                dataset.name+'_virtual', dataset.multi_id, dataset.msg_id, field_data, 0,
+                lambda dataset=dataset: _get_virtual_fifo_topic_data(dataset.data)))
+
+def _get_virtual_fifo_topic_data(data):
+    """ expand the FIFO samples arrays of a topic into individual samples
+    (fields timestamp, timestamp_sample, x, y, z)
+    :param data: topic data of a FIFO topic
+    :return: dict of field name: numpy array
+    """
+    t = data['timestamp_sample']
+    dt = data['dt']
+    scale = data['scale']
+    samples = data['samples'].astype(np.int64)
+    total_samples = np.sum(samples)
+    # index of the message and of the sample within the message
+    msg_index = np.repeat(np.arange(len(samples)), samples)
+    sample_index = np.arange(total_samples) - np.repeat(np.cumsum(samples) - samples, samples)
+
+    t_new = t[msg_index] - (samples[msg_index] - sample_index - 1) * dt[msg_index]
+    virtual_data = {'timestamp': t_new.astype(t.dtype)}
+    virtual_data['timestamp_sample'] = virtual_data['timestamp']
+    max_samples = np.amax(samples, initial=0)
+    for axis in ['x', 'y', 'z']:
+        axis_data = np.stack([data[axis+'['+str(s)+']'] for s in range(max_samples)]) \
+            if max_samples > 0 else np.zeros((0, len(samples)))
+        virtual_data[axis] = (axis_data[sample_index, msg_index] *
+                              scale[msg_index]).astype(np.float64)
+    return virtual_data
+
+def is_ulog_file_decoded(file_name):
+    """ check whether all topics of a log are already decoded in the in-memory
+    cache or in one of the persistent caches (i.e. the cache is warm) """
+    ulog = __ulog_memory_cache.get(file_name, update_stats=False)
+    if ulog is not None:
+        return all(dataset.is_decoded for dataset in ulog.data_list
+                   if isinstance(dataset, LazyData))
+    try:
+        max_samples = _get_ulog_max_samples(file_name)
+    except FileNotFoundError:
+        return False
+    cache_key = _get_ulog_cache_key(file_name)
+    return any(cache is not None and cache.is_decoded(cache_key, file_name, max_samples)
+               for cache in (__ulog_shared_cache, __ulog_disk_cache))
+
+def _get_ulog_max_samples(file_name):
+    """ get the maximum number of samples per topic for a log file: large logs
+    are loaded in streaming mode (decimated while loading)
+    :return: max_samples argument for LazyULog (None for no decimation)
+    """
+    if get_log_file_size(file_name) > get_streaming_threshold_bytes():
+        return get_streaming_max_samples()
+    return None
+
+def _on_topic_decoded(file_name, cache_key, dataset):
+    """ add a topic that got decoded to the caches """
+    for cache in (__ulog_shared_cache, __ulog_disk_cache):
+        if cache is not None:
+            cache.store_topic(cache_key, dataset)
+    # the log grew in memory
+    __ulog_memory_cache.update(file_name)
+
+def _load_ulog_file_from_disk(file_name, cache_key, max_samples):
+    """ load an ULog file from the persistent cache or index it
+    :return: LazyULog object
+    """
+    if __ulog_disk_cache is not None:
+        ulog = __ulog_disk_cache.load(cache_key, file_name, max_samples)
+        if ulog is not None:
+            return ulog
 
-    # load only the messages we really need
-    msg_filter = ['battery_status', 'distance_sensor', 'esc_status',
-                  'estimator_status', 'sensor_combined', 'cpuload',
-                  'vehicle_gps_position', 'vehicle_local_position',
-                  'vehicle_local_position_setpoint',
-                  'vehicle_global_position', 'actuator_controls_0',
-                  'actuator_controls_1', 'actuator_outputs',
-                  'vehicle_angular_velocity', 'vehicle_attitude', 'vehicle_attitude_setpoint',
-                  'vehicle_rates_setpoint', 'rc_channels',
-                  'position_setpoint_triplet', 'vehicle_attitude_groundtruth',
-                  'vehicle_local_position_groundtruth', 'vehicle_visual_odometry',
-                  'vehicle_status', 'airspeed', 'airspeed_validated', 'manual_control_setpoint',
-                  'rate_ctrl_status', 'vehicle_air_data',
-                  'vehicle_magnetometer', 'system_power', 'tecs_status',
-                  'sensor_baro', 'sensor_accel', 'sensor_accel_fifo',
-                  'sensor_gyro_fifo', 'vehicle_angular_acceleration',
-                  'ekf2_timestamps', 'manual_control_switches', 'event',
-                  'vehicle_imu_status', 'actuator_motors', 'actuator_servos',
-                  'vehicle_thrust_setpoint', 'vehicle_torque_setpoint',
-                  'failsafe_flags']
     try:
-        ulog = ULog(file_name, msg_filter, disable_str_exceptions=True)
+        ulog = LazyULog.load(file_name, disable_str_exceptions=True,
+                             max_samples=max_samples)
     except FileNotFoundError:
         print("Error: file %s not found" % file_name)
         raise
@@ -339,8 +555,148 @@ def load_ulog_file(file_name):
 #        if not np.all(non_zero_indices):
 #            d.data = np.compress(non_zero_indices, d.data, axis=0)
 
+    if __ulog_disk_cache is not None:
+        __ulog_disk_cache.store(cache_key, file_name, ulog)
+
     return ulog
 
+# below this number of messages, topics are decoded in the current process
+__PARALLEL_DECODE_MIN_MESSAGES = 200000
+__decode_executor = None
+
+def start_decode_workers():
+    """ start the worker processes for decoding topics in parallel (with
+    decode_ulog_topics()). This must be called before any other thread is
+    started: the workers are forked (the server scripts cannot be imported by
+    spawned processes), and forking a multi-threaded process can copy locks
+    held by other threads into the workers.
+    """
+    global __decode_executor
+    if get_parallel_decode_workers() <= 0 or \
+            'fork' not in multiprocessing.get_all_start_methods():
+        return
+    __decode_executor = ProcessPoolExecutor(
+        max_workers=get_parallel_decode_workers(),
+        mp_context=multiprocessing.get_context('fork'))
+    # the workers must share the resource tracker of the shared memory
+    resource_tracker.ensure_running()
+    # the processes are forked on the first submit
+    __decode_executor.submit(os.getpid).result()
+
+def decode_ulog_topics(ulog, topic_names=None):
+    """ decode the topics of a log loaded with load_ulog_file() in parallel
+    (using worker processes), instead of one after another when accessed.
+    :param topic_names: list of topic names to decode, None for all
+    """
+    global __decode_executor
+    datasets = [dataset for dataset in ulog.data_list
+                if isinstance(dataset, LazyData) and not dataset.is_decoded and
+                (topic_names is None or dataset.name in topic_names)]
+    if sum(len(dataset.offsets) for dataset in datasets) < __PARALLEL_DECODE_MIN_MESSAGES:
+        return # not worth it, topics are decoded when accessed
+    executor = __decode_executor
+    if executor is None:
+        return
+    start_time = timer()
+    try:
+        ulog.decode_parallel(datasets, executor)
+    except BrokenProcessPool:
+        # the process pool cannot be restarted safely once threads are running
+        print('Topic decoding worker process died, disabling parallel decoding')
+        __decode_executor = None
+    except Exception as error:
+        # the remaining topics are decoded when accessed
+        print('Failed to decode topics in parallel:', error)
+    print_timing("Parallel topic decoding", start_time)
+
+def create_ulog_index(file_name):
+    """ create the index file of an ULog file, which makes loading the log and
+    random access to its topics faster. Errors are printed and otherwise ignored.
+    """
+    try:
+        LazyULog(file_name, disable_str_exceptions=True,
+                 max_samples=_get_ulog_max_samples(file_name)).write_index()
+    except Exception as error:
+        print('Failed to index log file', file_name, error)
+
+def load_ulog_range(log_id, topics, t_start=None, t_end=None):
+    """ load the data of some topics within a time range, without decoding the
+    whole topics (e.g. for zoomed views or analysis of a part of the flight)
+    :param topics: list of topic names (all instances are loaded)
+    :param t_start, t_end: time range [us] (log timestamps), None for an open range
+    :return: list of ULog.Data objects
+    """
+    ulog = load_ulog_file(get_log_filename(log_id))
+    return [dataset.get_range(t_start, t_end) for dataset in ulog.data_list
+            if dataset.name in topics]
+
+__derived_data_lock = threading.Lock()
+
+def get_derived_data(ulog, key, func):
+    """ get data derived from a log. It is computed once per ULog object and
+    stored with it, so that all sessions using a cached log share the result
+    (which must therefore not be modified).
+    :param key: unique name of the data (including the arguments of func)
+    :param func: function without arguments that computes the data
+    """
+    #pylint: disable=protected-access
+    with __derived_data_lock:
+        if '_derived_data' not in ulog.__dict__:
+            ulog._derived_data = ({}, threading.RLock())
+        derived_data, lock = ulog._derived_data
+    with lock:
+        if key not in derived_data:
+            derived_data[key] = func()
+        return derived_data[key]
+
+__minmax_pyramid_lock = threading.Lock()
+
+def get_minmax_pyramid(dataset, field_names):
+    """ get the min/max pyramid (for downsampling) of fields of a topic. It is
+    stored with the dataset (like get_derived_data()), and the levels of each
+    field are loaded from or added to the persistent caches.
+    :param field_names: list of numeric field names of the dataset
+    :return: MinMaxPyramid object
+    """
+    #pylint: disable=protected-access
+    with __minmax_pyramid_lock:
+        if '_minmax_pyramid' not in dataset.__dict__:
+            dataset._minmax_pyramid = MinMaxPyramid(len(dataset.data['timestamp']))
+        pyramid = dataset._minmax_pyramid
+    cache_key = None
+    if isinstance(dataset, LazyData) and dataset._ulog is not None:
+        cache_key = getattr(dataset._ulog, 'cache_key', None)
+    caches = [cache for cache in (__ulog_shared_cache, __ulog_disk_cache)
+              if cache is not None and cache_key is not None]
+    with pyramid.lock:
+        for field_name in field_names:
+            if pyramid.has_field(field_name):
+                continue
+            for cache in caches:
+                levels = cache.load_pyramid_field(cache_key, dataset, field_name)
+                if levels is not None:
+                    try:
+                        pyramid.add_field(field_name, levels)
+                        break
+                    except ValueError:
+                        pass # outdated
+            else:
+                levels = MinMaxPyramid.build_field(dataset.data[field_name])
+                pyramid.add_field(field_name, levels)
+                for cache in caches:
+                    cache.store_pyramid_field(cache_key, dataset, field_name, levels)
+    return pyramid
+
+def add_roll_pitch_yaw(ulog):
+    """ add the roll, pitch and yaw fields to the attitude topics (once per log) """
+    get_derived_data(ulog, 'roll_pitch_yaw', PX4ULog(ulog).add_roll_pitch_yaw)
+
+def get_actuator_controls(ulog, use_dynamic_control_alloc, instance=0):
+    """ get the (cached) ActuatorControls object of a log """
+    return get_derived_data(
+        ulog, ('actuator_controls', use_dynamic_control_alloc, instance),
+        lambda: ActuatorControls(ulog, use_dynamic_control_alloc, instance))
+
 class ActuatorControls:
     """
         Compatibility for actuator control topics
@@ -490,21 +846,93 @@ def get_flight_mode_changes(ulog):
     :return: list of (timestamp, int mode) tuples, the last is the last log
     timestamp and mode = -1.
     """
+    def _get_flight_mode_changes():
+        try:
+            cur_dataset = ulog.get_dataset('vehicle_status')
+            flight_mode_changes = cur_dataset.list_value_changes('nav_state')
+            flight_mode_changes.append((ulog.last_timestamp, -1))
+        except (KeyError, IndexError):
+            flight_mode_changes = []
+        return flight_mode_changes
+    return get_derived_data(ulog, 'flight_mode_changes', _get_flight_mode_changes)
+
+def get_vtol_states(ulog):
+    """
+    get the VTOL state changes & vehicle type
+    :return: tuple of (is_vtol, is_vtol_tailsitter, vtol_states), with
+    vtol_states a list of (timestamp, int state) tuples (states: 1=transition,
+    2=FW, 3=MC), the last is the last log timestamp and state = -1.
+    vtol_states is None for non-VTOL's.
+    """
+    return get_derived_data(ulog, 'vtol_states', lambda: _get_vtol_states(ulog))
+
+def _get_vtol_states(ulog):
+    vtol_states = None
+    is_vtol = False
+    is_vtol_tailsitter = False
     try:
         cur_dataset = ulog.get_dataset('vehicle_status')
-        flight_mode_changes = cur_dataset.list_value_changes('nav_state')
-        flight_mode_changes.append((ulog.last_timestamp, -1))
-    except (KeyError, IndexError) as error:
-        flight_mode_changes = []
-    return flight_mode_changes
+        if np.amax(cur_dataset.data['is_vtol']) == 1:
+            is_vtol = True
+            # check if is tailsitter
+            is_vtol_tailsitter = ('is_vtol_tailsitter' in cur_dataset.data and
+                                  np.amax(cur_dataset.data['is_vtol_tailsitter']) == 1)
+            # find mode after transitions (states: 1=transition, 2=FW, 3=MC)
+            if 'vehicle_type' in cur_dataset.data:
+                vehicle_type_field = 'vehicle_type'
+                vtol_state_mapping = {2: 2, 1: 3}
+                vehicle_type = cur_dataset.data['vehicle_type']
+                in_transition_mode = cur_dataset.data['in_transition_mode']
+                vtol_states = []
+                for i in range(len(vehicle_type)):
+                    # a VTOL can change state also w/o in_transition_mode set
+                    # (e.g. in Manual mode)
+                    if i == 0 or in_transition_mode[i-1] != in_transition_mode[i] or \
+                        vehicle_type[i-1] != vehicle_type[i]:
+                        vtol_states.append((cur_dataset.data['timestamp'][i],
+                                            in_transition_mode[i]))
+
+            else: # COMPATIBILITY: old logs (https://github.com/PX4/Firmware/pull/11918)
+                vtol_states = cur_dataset.list_value_changes('in_transition_mode')
+                vehicle_type_field = 'is_rotary_wing'
+                vtol_state_mapping = {0: 2, 1: 3}
+            for i in range(len(vtol_states)):
+                if vtol_states[i][1] == 0:
+                    t = vtol_states[i][0]
+                    idx = np.argmax(cur_dataset.data['timestamp'] >= t) + 1
+                    vtol_states[i] = (t, vtol_state_mapping[
+                        cur_dataset.data[vehicle_type_field][idx]])
+            vtol_states.append((ulog.last_timestamp, -1))
+    except (KeyError, IndexError):
+        vtol_states = None
+    return (is_vtol, is_vtol_tailsitter, vtol_states)
 
 def print_cache_info():
     """ print information about the ulog cache """
-    print(load_ulog_file.cache_info())
-
-def clear_ulog_cache():
-    """ clear/invalidate the ulog cache """
-    load_ulog_file.cache_clear()
+    cache_info = __ulog_memory_cache.info()
+    print('ulog cache: hits={:}, misses={:}, evictions={:}, entries={:}, '
+          'resident={:.1f} MB (max {:.1f} MB)'.format(
+              cache_info.hits, cache_info.misses, cache_info.evictions,
+              cache_info.num_entries, cache_info.resident_bytes / 1024**2,
+              cache_info.max_bytes / 1024**2))
+
+def clear_ulog_cache(log_id=None):
+    """ clear/invalidate the ulog cache.
+    :param log_id: if set, also remove the persistent cache entries of this log
+    """
+    __ulog_memory_cache.clear()
+    if log_id is not None:
+        if __ulog_disk_cache is not None:
+            __ulog_disk_cache.invalidate(log_id)
+        if __ulog_shared_cache is not None:
+            __ulog_shared_cache.invalidate(log_id)
+
+def copy_ulog_cache(log_id, new_log_id):
+    """ reuse the persistent cache entries of a log for another log with the
+    same content (the log files must be hard links of each other) """
+    for cache in (__ulog_shared_cache, __ulog_disk_cache):
+        if cache is not None:
+            cache.copy(log_id, new_log_id)
 
 def validate_error_ids(err_ids):
     """
@@ -517,8 +945,13 @@ def validate_error_ids(err_ids):
 
     return True
 
-def decrypt_ulge_payload(payload: bytes, private_key_path: str) -> bytes:
-    """Decrypt an uploaded .ulge file payload and return decrypted .ulg bytes."""
+def _get_ulge_cipher(file_handle, private_key_path):
+    """Read the header of an uploaded .ulge file and decrypt its key.
+
+    :param file_handle: file object positioned at the beginning of the file
+    :return: ChaCha20 cipher object for the encrypted data (which starts at the
+             current position of file_handle)
+    """
 
     if not os.path.exists(private_key_path):
         raise FileNotFoundError(f"Private key not found at {private_key_path}")
@@ -526,19 +959,19 @@ def decrypt_ulge_payload(payload: bytes, private_key_path: str) -> bytes:
     magic = b"ULogEnc"
     header_size = 22
 
-    if payload[:7] != magic:
+    header = file_handle.read(header_size)
+    if header[:7] != magic:
         raise ValueError("Invalid header magic")
-    if payload[7] != 1:
+    if header[7] != 1:
         raise ValueError("Unsupported header version")
-    if payload[16] != 4:
+    if header[16] != 4:
         raise ValueError("Unsupported key algorithm")
 
-    key_size = payload[19] << 8 | payload[18]
-    nonce_size = payload[21] << 8 | payload[20]
+    key_size = header[19] << 8 | header[18]
+    nonce_size = header[21] << 8 | header[20]
 
-    cipher_text = payload[header_size:header_size + key_size]
-    nonce = payload[header_size + key_size:header_size + key_size + nonce_size]
-    encrypted_data = payload[header_size + key_size + nonce_size:]
+    cipher_text = file_handle.read(key_size)
+    nonce = file_handle.read(nonce_size)
 
     with open(private_key_path, 'rb') as f:
         rsa_key = RSA.import_key(f.read())
@@ -548,5 +981,50 @@ def decrypt_ulge_payload(payload: bytes, private_key_path: str) -> bytes:
         except ValueError as e:
             raise ValueError("Decryption failed: possibly incorrect private key or corrupt file.") from e
 
-    cipher = ChaCha20.new(key=sym_key, nonce=nonce)
-    return cipher.decrypt(encrypted_data)
+    return ChaCha20.new(key=sym_key, nonce=nonce)
+
+def decrypt_ulge_payload(payload: bytes, private_key_path: str) -> bytes:
+    """Decrypt an uploaded .ulge file payload and return decrypted .ulg bytes."""
+
+    payload_file = io.BytesIO(payload)
+    cipher = _get_ulge_cipher(payload_file, private_key_path)
+    return cipher.decrypt(memoryview(payload)[payload_file.tell():])
+
+def decrypt_ulge_file(file_name: str, output_file_name: str, private_key_path: str,
+                      block_size: int = 1024 * 1024) -> str:
+    """Decrypt an uploaded .ulge file into a .ulg file, block by block, so that
+    the memory usage does not depend on the file size. The output file is
+    removed on errors.
+
+    :raise ValueError: if the file cannot be decrypted or the decrypted data
+                       is not a ULog file (checked with the first block)
+    :return: SHA-256 of the decrypted data (hex string)
+    """
+
+    digest = hashlib.sha256()
+    buffer = bytearray(block_size)
+    try:
+        with open(file_name, 'rb') as input_file, \
+                open(output_file_name, 'wb') as output_file:
+            cipher = _get_ulge_cipher(input_file, private_key_path)
+            is_first_block = True
+            while True:
+                num_bytes = input_file.readinto(buffer)
+                if num_bytes == 0:
+                    break
+                with memoryview(buffer)[:num_bytes] as block:
+                    # decrypt in place
+                    cipher.decrypt(block, output=block)
+                    if is_first_block and \
+                            block[:len(ULog.HEADER_BYTES)] != ULog.HEADER_BYTES:
+                        raise ValueError("Decrypted file is not a valid ULog")
+                    is_first_block = False
+                    output_file.write(block)
+                    digest.update(block)
+            if is_first_block:
+                raise ValueError("Decrypted file is not a valid ULog")
+    except BaseException:
+        if os.path.exists(output_file_name):
+            os.unlink(output_file_name)
+        raise
+    return digest.hexdigest()
@@ -0,0 +1,285 @@
+""" Persistent queue of background jobs (e.g. the processing of uploaded logs).
+
+Jobs are stored in the Jobs table of the database, so they survive a restart
+and can be run by the worker threads of any server process. A job has a type
+(a function registered with register_job_type()), the log id it belongs to,
+keyword arguments (JSON encoded) and a priority (higher runs first). Failed
+jobs are retried with exponential backoff.
+"""
+
+from collections import namedtuple
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from timeit import default_timer as timer
+
+from config import get_db_filename, get_job_workers
+from helper import print_timing
+
+#pylint: disable=global-statement,invalid-name
+
+# job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# job priorities
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+PRIORITY_BULK = -20 # bulk ingests (after all single uploads)
+
+# delay before the first retry of a failed job [s] (doubled for every retry)
+__RETRY_DELAY = 10
+# interval in which the workers check for new jobs (from other processes) and
+# retries [s]
+__POLL_INTERVAL = 1
+# finished jobs are removed after this time [s]
+__MAX_FINISHED_JOB_AGE = 7 * 24 * 3600
+
+Job = namedtuple('Job', ['id', 'log_id', 'type', 'args', 'attempts'])
+
+__job_types = {} # key: job type, value: (function, max attempts)
+__workers = []
+__lock = threading.Lock()
+__jobs_changed = threading.Condition(__lock)
+__num_notifications = 0
+__last_prune_time = 0
+
+
+def register_job_type(job_type, func, max_attempts=3):
+    """ register a job type
+    :param func: function that executes the job: func(log_id, **args). It
+                 signals a failure with an exception.
+    :param max_attempts: number of runs before a job is marked as failed
+    """
+    __job_types[job_type] = (func, max_attempts)
+
+def enqueue_job(log_id, job_type, args=None, priority=PRIORITY_NORMAL,
+                unique=False, cur=None):
+    """ add a job to the queue
+    :param args: dict of keyword arguments for the job function (must be JSON
+                 serializable)
+    :param unique: if True, do not add the job if a job of the same type for
+                   the log is queued or running already
+    :param cur: DB cursor: if given, the job is added within the transaction of
+                the caller, who has to commit and then call notify_job_workers()
+    :return: job id or None (if unique and the job exists)
+    """
+    need_closing = False
+    if cur is None:
+        con = sqlite3.connect(get_db_filename())
+        cur = con.cursor()
+        need_closing = True
+
+    job_id = None
+    if unique:
+        cur.execute('select Id from Jobs where LogId = ? and Type = ? and State in (?, ?)',
+                    [log_id, job_type, JOB_QUEUED, JOB_RUNNING])
+    if not unique or cur.fetchone() is None:
+        now = time.time()
+        cur.execute(
+            'insert into Jobs (LogId, Type, Args, Priority, State, Attempts, '
+            'NotBefore, Created, Updated, Worker, Error) values '
+            '(?, ?, ?, ?, ?, 0, ?, ?, ?, 0, ?)',
+            [log_id, job_type, json.dumps(args or {}), priority, JOB_QUEUED,
+             now, now, now, ''])
+        job_id = cur.lastrowid
+
+    if need_closing:
+        con.commit()
+        cur.close()
+        con.close()
+        notify_job_workers()
+    return job_id
+
+def notify_job_workers():
+    """ wake up the workers of this process (after new jobs got committed) """
+    global __num_notifications
+    with __jobs_changed:
+        __num_notifications += 1
+        __jobs_changed.notify_all()
+
+def get_jobs(log_id):
+    """ get all jobs of a log
+    :return: list of dicts (in the order they were added)
+    """
+    con = sqlite3.connect(get_db_filename())
+    cur = con.cursor()
+    cur.execute('select Type, State, Attempts, Created, Updated, Error '
+                'from Jobs where LogId = ? order by Id', [log_id])
+    db_tuples = cur.fetchall()
+    cur.close()
+    con.close()
+    return [{'type': db_tuple[0], 'state': db_tuple[1], 'attempts': db_tuple[2],
+             'created': db_tuple[3], 'updated': db_tuple[4], 'error': db_tuple[5]}
+            for db_tuple in db_tuples]
+
+def get_job_state(log_id, job_type):
+    """ get the state of the latest job of a type for a log
+    :return: one of JOB_* or None if there is no such job
+    """
+    con = sqlite3.connect(get_db_filename())
+    cur = con.cursor()
+    try:
+        cur.execute('select State from Jobs where LogId = ? and Type = ? '
+                    'order by Id desc limit 1', [log_id, job_type])
+        db_tuple = cur.fetchone()
+    except sqlite3.OperationalError:
+        db_tuple = None # no Jobs table (e.g. when running locally)
+    cur.close()
+    con.close()
+    if db_tuple is None:
+        return None
+    return db_tuple[0]
+
+def delete_jobs(log_id):
+    """ remove the queued and finished jobs of a log (e.g. when the log is
+    deleted). Running jobs are not interrupted. """
+    con = sqlite3.connect(get_db_filename())
+    with con:
+        con.execute('delete from Jobs where LogId = ? and State != ?',
+                    [log_id, JOB_RUNNING])
+    con.close()
+
+def start_job_workers():
+    """ start the worker threads of this process. This must be called after
+    forking (threads do not survive a fork). """
+    with __lock:
+        if len(__workers) > 0:
+            return
+        try:
+            _requeue_orphaned_jobs()
+        except sqlite3.Error as error:
+            print('Failed to requeue orphaned jobs', error)
+        for i in range(get_job_workers()):
+            worker = threading.Thread(target=_worker, name='job-worker-'+str(i),
+                                      daemon=True)
+            worker.start()
+            __workers.append(worker)
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _requeue_orphaned_jobs():
+    """ requeue the jobs that were running in a process that does not exist
+    anymore (e.g. after a crash or restart) """
+    con = sqlite3.connect(get_db_filename())
+    with con:
+        cur = con.cursor()
+        cur.execute('select distinct Worker from Jobs where State = ?', [JOB_RUNNING])
+        for db_tuple in cur.fetchall():
+            pid = db_tuple[0]
+            # the pid can be reused by this process after a restart
+            if pid == os.getpid() or not _is_process_alive(pid):
+                print('Requeuing jobs of process', pid)
+                cur.execute('update Jobs set State = ?, Updated = ? '
+                            'where State = ? and Worker = ?',
+                            [JOB_QUEUED, time.time(), JOB_RUNNING, pid])
+        cur.close()
+    con.close()
+
+def _claim_job():
+    """ get the next job to run and mark it as running
+    :return: Job or None if there is no job to run
+    """
+    con = sqlite3.connect(get_db_filename(), timeout=30)
+    try:
+        cur = con.cursor()
+        now = time.time()
+        # lock the DB for writing, so that no other process claims the same job
+        cur.execute('begin immediate')
+        cur.execute('select Id, LogId, Type, Args, Attempts from Jobs '
+                    'where State = ? and NotBefore <= ? '
+                    'order by Priority desc, Id limit 1', [JOB_QUEUED, now])
+        db_tuple = cur.fetchone()
+        if db_tuple is None:
+            con.rollback()
+            return None
+        cur.execute('update Jobs set State = ?, Attempts = ?, Updated = ?, Worker = ? '
+                    'where Id = ?',
+                    [JOB_RUNNING, db_tuple[4] + 1, now, os.getpid(), db_tuple[0]])
+        con.commit()
+        return Job(db_tuple[0], db_tuple[1], db_tuple[2], json.loads(db_tuple[3]),
+                   db_tuple[4] + 1)
+    finally:
+        con.close()
+
+def _finish_job(job, state, error=''):
+    """ store the result of a job run """
+    now = time.time()
+    con = sqlite3.connect(get_db_filename(), timeout=30)
+    with con:
+        if state == JOB_QUEUED: # retry
+            retry_time = now + __RETRY_DELAY * 2**(job.attempts - 1)
+            con.execute('update Jobs set State = ?, NotBefore = ?, Updated = ?, '
+                        'Error = ? where Id = ?',
+                        [state, retry_time, now, error, job.id])
+        else:
+            # the arguments are not needed anymore (and may contain personal
+            # data, such as an email address)
+            con.execute('update Jobs set State = ?, Args = ?, Updated = ?, '
+                        'Error = ? where Id = ?',
+                        [state, '{}', now, error, job.id])
+    con.close()
+
+def _run_job(job):
+    """ execute a job and store the result """
+    start_time = timer()
+    state = JOB_DONE
+    error = ''
+    if job.type not in __job_types:
+        state = JOB_FAILED
+        error = 'Unknown job type'
+    else:
+        func, max_attempts = __job_types[job.type]
+        try:
+            func(job.log_id, **job.args)
+        except Exception as exc:
+            print('Job', job.type, 'of log', job.log_id, 'failed (attempt',
+                  str(job.attempts)+'/'+str(max_attempts)+')')
+            traceback.print_exception(*sys.exc_info())
+            state = JOB_QUEUED if job.attempts < max_attempts else JOB_FAILED
+            error = str(exc)
+    _finish_job(job, state, error)
+    notify_job_workers()
+    print_timing('Job '+job.type+' of log '+job.log_id, start_time)
+
+def _prune_jobs():
+    """ remove old finished jobs """
+    con = sqlite3.connect(get_db_filename(), timeout=30)
+    with con:
+        con.execute('delete from Jobs where State in (?, ?) and Updated < ?',
+                    [JOB_DONE, JOB_FAILED, time.time() - __MAX_FINISHED_JOB_AGE])
+    con.close()
+
+def _worker():
+    """ worker thread: run jobs until the process exits """
+    global __last_prune_time
+    while True:
+        with __lock:
+            num_notifications = __num_notifications
+        try:
+            job = _claim_job()
+            if job is not None:
+                _run_job(job)
+                continue
+            if time.time() > __last_prune_time + 3600:
+                __last_prune_time = time.time()
+                _prune_jobs()
+        except sqlite3.Error as error:
+            print('Job queue error', error)
+        with __jobs_changed:
+            __jobs_changed.wait_for(lambda: __num_notifications != num_notifications,
+                                    __POLL_INTERVAL)
@@ -0,0 +1,232 @@
+""" Storage of log files, optionally compressed.
+
+Compressed logs use the zstd seekable format: the data is split into
+independently compressed zstd frames, followed by a skippable frame with a seek
+table (compressed and decompressed size of each frame). This allows reading any
+part of a log by only decompressing the frames containing it. A compressed log
+keeps its file name, it is detected by its content, so all code that reads logs
+must use open_log_file() instead of open().
+"""
+
+from collections import OrderedDict
+import io
+import os
+import struct
+import threading
+import uuid
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZSTD_FRAME_MAGIC = b'\x28\xb5\x2f\xfd'
+SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+# footer of the seek table: number of frames, descriptor, seekable magic
+SEEK_TABLE_FOOTER = struct.Struct('<IBI')
+
+# uncompressed size of a frame: the minimum amount of data to decompress for a
+# random access
+FRAME_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 3
+
+# maximum size of the decompressed frames kept in memory (per process)
+FRAME_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def is_compressed_log_file(file_name):
+    """ check whether a log file is stored compressed """
+    with open(file_name, 'rb') as file_handle:
+        # an empty log only consists of the seek table
+        return file_handle.read(len(ZSTD_FRAME_MAGIC)) in \
+            (ZSTD_FRAME_MAGIC, struct.pack('<I', SKIPPABLE_FRAME_MAGIC))
+
+def open_log_file(file_name):
+    """ open a (possibly compressed) log file for binary reading
+    :return: seekable file object with the uncompressed log data
+    """
+    if is_compressed_log_file(file_name):
+        return SeekableZstdFile(file_name)
+    return open(file_name, 'rb')
+
+def get_log_file_size(file_name):
+    """ get the uncompressed size of a log file in bytes """
+    if is_compressed_log_file(file_name):
+        with SeekableZstdFile(file_name) as file_handle:
+            return file_handle.size
+    return os.path.getsize(file_name)
+
+def compress_log_file(file_name, frame_size=FRAME_SIZE, level=COMPRESSION_LEVEL):
+    """ compress a log file in place (no-op if it is compressed already).
+    Note that this changes the modification time, so that caches and the index
+    of the log are invalidated.
+    :return: True if the file got compressed
+    """
+    if is_compressed_log_file(file_name):
+        return False
+    if zstandard is None:
+        raise ImportError('Compressing log files requires the zstandard module')
+
+    # write to a temporary file, then move it (to avoid races)
+    temp_file_name = file_name+'.'+str(uuid.uuid4())
+    try:
+        compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+        frame_sizes = []
+        with open(file_name, 'rb') as input_file, open(temp_file_name, 'wb') as output_file:
+            while True:
+                data = input_file.read(frame_size)
+                if not data:
+                    break
+                frame = compressor.compress(data)
+                output_file.write(frame)
+                frame_sizes.append((len(frame), len(data)))
+            output_file.write(_build_seek_table(frame_sizes))
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_file_name):
+            os.unlink(temp_file_name)
+        raise
+    return True
+
+def _build_seek_table(frame_sizes):
+    """ get the seek table skippable frame
+    :param frame_sizes: list of (compressed size, decompressed size) tuples
+    """
+    entries = b''.join(struct.pack('<II', compressed_size, decompressed_size)
+                       for compressed_size, decompressed_size in frame_sizes)
+    footer = SEEK_TABLE_FOOTER.pack(len(frame_sizes), 0, SEEKABLE_MAGIC)
+    return struct.pack('<II', SKIPPABLE_FRAME_MAGIC, len(entries) + len(footer)) + \
+        entries + footer
+
+
+class _FrameCache:
+    """ LRU cache of decompressed frames, shared by all open files, so that
+    reading all topics of a log (each one spread over the whole file) does not
+    decompress the same frames again for every topic """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._num_bytes = 0
+        self._frames = OrderedDict() # key: (file id, frame index), value: bytes
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ get a frame, None if not cached """
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame):
+        """ add a frame """
+        with self._lock:
+            if key in self._frames:
+                return
+            self._frames[key] = frame
+            self._num_bytes += len(frame)
+            while self._num_bytes > self._max_bytes and len(self._frames) > 1:
+                _, evicted_frame = self._frames.popitem(last=False)
+                self._num_bytes -= len(evicted_frame)
+
+_frame_cache = _FrameCache(FRAME_CACHE_MAX_BYTES)
+
+
+class SeekableZstdFile(io.RawIOBase):
+    """ Read-only file object for a file in the zstd seekable format """
+
+    def __init__(self, file_name):
+        super().__init__()
+        if zstandard is None:
+            raise ImportError('Reading compressed log files requires the zstandard module')
+        self._file = open(file_name, 'rb') #pylint: disable=consider-using-with
+        try:
+            self._read_seek_table()
+        except:
+            self._file.close()
+            raise
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._position = 0
+        # a rewritten file gets a new inode or modification time
+        stat = os.fstat(self._file.fileno())
+        self._file_id = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+    def _read_seek_table(self):
+        self._file.seek(-SEEK_TABLE_FOOTER.size, os.SEEK_END)
+        num_frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(
+            self._file.read(SEEK_TABLE_FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            raise ValueError('Not a seekable zstd file: '+self._file.name)
+        entry_size = 12 if descriptor & 0x80 else 8 # with checksums
+        self._file.seek(-SEEK_TABLE_FOOTER.size - num_frames * entry_size, os.SEEK_END)
+        entries = np.frombuffer(self._file.read(num_frames * entry_size),
+                                dtype=np.uint32).reshape(num_frames, entry_size // 4)
+        # start offsets of the frames (with an additional entry for the end)
+        self._compressed_offsets = np.zeros(num_frames + 1, dtype=np.int64)
+        self._decompressed_offsets = np.zeros(num_frames + 1, dtype=np.int64)
+        np.cumsum(entries[:, 0], out=self._compressed_offsets[1:])
+        np.cumsum(entries[:, 1], out=self._decompressed_offsets[1:])
+
+    @property
+    def name(self):
+        """ file name """
+        return self._file.name
+
+    @property
+    def size(self):
+        """ uncompressed size in bytes """
+        return int(self._decompressed_offsets[-1])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position '+str(offset))
+        self._position = offset
+        return self._position
+
+    def _get_frame(self, frame_index):
+        """ get the decompressed data of a frame """
+        frame = _frame_cache.get((self._file_id, frame_index))
+        if frame is None:
+            self._file.seek(self._compressed_offsets[frame_index])
+            compressed_size = self._compressed_offsets[frame_index + 1] - \
+                self._compressed_offsets[frame_index]
+            frame = self._decompressor.decompress(self._file.read(compressed_size))
+            _frame_cache.put((self._file_id, frame_index), frame)
+        return frame
+
+    def readinto(self, buffer):
+        buffer = memoryview(buffer).cast('B')
+        num_read = 0
+        while num_read < len(buffer) and self._position < self.size:
+            frame_index = int(np.searchsorted(self._decompressed_offsets,
+                                              self._position, side='right')) - 1
+            frame = self._get_frame(frame_index)
+            frame_offset = self._position - int(self._decompressed_offsets[frame_index])
+            num_bytes = min(len(frame) - frame_offset, len(buffer) - num_read)
+            buffer[num_read:num_read + num_bytes] = \
+                frame[frame_offset:frame_offset + num_bytes]
+            num_read += num_bytes
+            self._position += num_bytes
+        return num_read
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
@@ -19,6 +19,7 @@ from db_entry import *
 from configured_plots import generate_plots
 from pid_analysis_plots import get_pid_analysis_plots
 from statistics_plots import StatisticsPlots
+from warmup import has_warm_cache
 
 #pylint: disable=invalid-name, redefined-outer-name
 
@@ -107,7 +108,7 @@ else:
 
         ulog = load_ulog_file(ulog_file_name)
         px4_ulog = PX4ULog(ulog)
-        px4_ulog.add_roll_pitch_yaw()
+        add_roll_pitch_yaw(ulog)
 
     except ULogException:
         error_message = ('A parsing error occured when trying to read the file - '
@@ -227,6 +228,12 @@ else:
             link_to_pid_analysis_page = '?plots=pid_analysis&log='+log_id
 
             try:
+                # the plots need most of the topics. If the log was just uploaded,
+                # the warm-up job might be decoding them already: the topics
+                # it did not decode yet are decoded here (not waiting for the
+                # job, which would block all sessions of this process).
+                if log_id == '' or not has_warm_cache(log_id):
+                    decode_ulog_topics(ulog)
                 plots = generate_plots(ulog, px4_ulog, db_data, vehicle_data,
                                        link_to_3d_page, link_to_pid_analysis_page)
 
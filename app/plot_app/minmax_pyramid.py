@@ -0,0 +1,160 @@
+""" Multi-resolution min/max pyramid for downsampling time series """
+
+import threading
+
+import numpy as np
+
+
+class MinMaxPyramid:
+    """ Min/max pyramid of the fields of a topic: selects the samples to plot
+    for any index range in O(number of pixels) instead of O(number of samples).
+
+    Level l splits the samples into blocks of MIN_BLOCK_SIZE * 2**l samples
+    and stores per block the index of the minimum and maximum sample (NaN's
+    are ignored unless the whole block is NaN), and for fields with NaN's also
+    the index of the first NaN (-1 if none). The levels of a field are stored
+    in one array of shape (number of blocks of all levels, 2 or 3).
+    """
+
+    MIN_BLOCK_SIZE = 8
+
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        # must be held when adding fields
+        self.lock = threading.Lock()
+        self._fields = {} # key: field name, value: levels array
+        self._level_offsets = self._get_level_offsets(num_samples)
+
+    @classmethod
+    def _get_level_offsets(cls, num_samples):
+        """ get the start of each level in the levels array of a field (and
+        the total number of blocks as last element) """
+        offsets = [0]
+        num_blocks = -(-num_samples // cls.MIN_BLOCK_SIZE)
+        while True:
+            offsets.append(offsets[-1] + num_blocks)
+            if num_blocks <= 1:
+                return offsets
+            num_blocks = (num_blocks + 1) // 2
+
+    @classmethod
+    def build(cls, data, num_samples):
+        """ create a pyramid of all numeric fields
+        :param data: dict of field name: numpy array
+        """
+        pyramid = cls(num_samples)
+        for field_name, values in data.items():
+            if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+                pyramid.add_field(field_name, cls.build_field(values))
+        return pyramid
+
+    @classmethod
+    def build_field(cls, values):
+        """ compute the levels array of a field (see add_field()) """
+        num_samples = len(values)
+        index_dtype = np.int32 if num_samples < 2**31 else np.int64
+        nan_mask = None
+        if values.dtype.kind == 'f':
+            nan_mask = np.isnan(values)
+            if nan_mask.any():
+                min_values = np.where(nan_mask, np.inf, values)
+                max_values = np.where(nan_mask, -np.inf, values)
+            else:
+                nan_mask = None
+                min_values = max_values = values
+        elif values.dtype.kind == 'b':
+            min_values = max_values = values.view(np.uint8)
+        else:
+            min_values = max_values = values
+        num_columns = 2 if nan_mask is None else 3
+        levels = np.empty((cls._get_level_offsets(num_samples)[-1], num_columns),
+                          dtype=index_dtype)
+        if num_samples == 0:
+            return levels
+
+        # first level: pad with the last sample (which is never selected
+        # instead of an earlier one, as argmin/argmax return the first match)
+        num_blocks = -(-num_samples // cls.MIN_BLOCK_SIZE)
+        padding = num_blocks * cls.MIN_BLOCK_SIZE - num_samples
+        block_starts = np.arange(num_blocks, dtype=index_dtype) * cls.MIN_BLOCK_SIZE
+        def get_blocks(block_values):
+            return np.concatenate((block_values, np.repeat(block_values[-1:], padding))) \
+                .reshape(num_blocks, cls.MIN_BLOCK_SIZE)
+        cur_levels = [np.argmin(get_blocks(min_values), axis=1) + block_starts,
+                      np.argmax(get_blocks(max_values), axis=1) + block_starts]
+        if nan_mask is not None:
+            nan_blocks = get_blocks(nan_mask)
+            cur_levels.append(np.where(nan_blocks.any(axis=1),
+                                       np.argmax(nan_blocks, axis=1) + block_starts, -1))
+
+        offset = 0
+        while True:
+            for i, cur_level in enumerate(cur_levels):
+                levels[offset:offset+len(cur_level), i] = cur_level
+            offset += len(cur_levels[0])
+            if len(cur_levels[0]) <= 1:
+                return levels
+            # next level: merge pairs of blocks
+            if len(cur_levels[0]) % 2 == 1:
+                cur_levels = [np.append(cur_level, cur_level[-1]) for cur_level in cur_levels]
+            first = [cur_level[0::2] for cur_level in cur_levels]
+            second = [cur_level[1::2] for cur_level in cur_levels]
+            cur_levels = [
+                np.where(min_values[second[0]] < min_values[first[0]], second[0], first[0]),
+                np.where(max_values[second[1]] > max_values[first[1]], second[1], first[1])]
+            if nan_mask is not None:
+                cur_levels.append(np.where(first[2] >= 0, first[2], second[2]))
+
+    def add_field(self, field_name, levels):
+        """ add a field
+        :param levels: levels array (see build_field())
+        """
+        if len(levels) != self._level_offsets[-1]:
+            raise ValueError('Invalid number of blocks')
+        self._fields[field_name] = levels
+
+    def has_field(self, field_name):
+        """ check whether the pyramid contains a field """
+        return field_name in self._fields
+
+    def get_indices(self, field_names, start, end, num_buckets):
+        """ get the samples to plot for an index range: the minimum, maximum and
+        first NaN sample of every field per block of the coarsest level with at
+        least num_buckets blocks in the range (plus the first and last sample
+        and the start of every block). The partial blocks at the edges of the
+        range are covered by blocks of the finer levels.
+        :param start, end: index range [start, end)
+        :param num_buckets: e.g. the number of pixels
+        :return: sorted sample indices
+        """
+        num_samples = end - start
+        if num_samples < num_buckets * self.MIN_BLOCK_SIZE:
+            return np.arange(start, end)
+        level = int(np.log2(num_samples / (num_buckets * self.MIN_BLOCK_SIZE)))
+        level = min(level, len(self._level_offsets) - 2)
+        indices = [np.array([start, end - 1])]
+        self._add_indices(indices, field_names, start, end, level)
+        indices = np.unique(np.concatenate(indices))
+        return indices[indices >= 0] # -1: no NaN in the block
+
+    def _add_indices(self, indices, field_names, start, end, level):
+        """ add the samples of the blocks of a level that are within [start, end)
+        to the list indices, and recursively those of the finer levels for the
+        rest of the range """
+        if start >= end:
+            return
+        if level < 0:
+            indices.append(np.arange(start, end))
+            return
+        block_size = self.MIN_BLOCK_SIZE * 2**level
+        first_block = -(-start // block_size)
+        end_block = end // block_size
+        if first_block >= end_block:
+            self._add_indices(indices, field_names, start, end, level - 1)
+            return
+        offset = self._level_offsets[level]
+        indices.append(np.arange(first_block, end_block) * block_size)
+        for field_name in field_names:
+            indices.append(self._fields[field_name][offset+first_block:offset+end_block].ravel())
+        self._add_indices(indices, field_names, start, first_block * block_size, level - 1)
+        self._add_indices(indices, field_names, end_block * block_size, end, level - 1)
@@ -3,16 +3,22 @@ Module for generating overview map
 """
 
 import os
+import threading
 #pylint: disable=ungrouped-imports
 import matplotlib
 matplotlib.use('Agg')
 import smopy
 import matplotlib.pyplot as plt
 
-from config import get_log_filepath, get_overview_img_filepath
-from helper import load_ulog_file, get_lat_lon_alt_deg
+from helper import load_ulog_file, get_lat_lon_alt_deg, get_log_filename, \
+    get_overview_img_filename
+from file_storage import make_parent_dirs
 
 MAXTILES = 16
+
+# pyplot is not thread-safe (images are also generated by the warm-up threads)
+__pyplot_lock = threading.Lock()
+
 def get_zoom(input_box, z=18):
     """
     Return acceptable zoom - we take this function from Map to get lover zoom
@@ -27,14 +33,13 @@ def get_zoom(input_box, z=18):
 def generate_overview_img_from_id(log_id):
     ''' This function will load file and save overview from/into configured directories
         '''
-    ulog_file = os.path.join(get_log_filepath(), log_id+'.ulg')
-    ulog = load_ulog_file(ulog_file)
+    ulog = load_ulog_file(get_log_filename(log_id))
     generate_overview_img(ulog, log_id)
 
 def generate_overview_img(ulog, log_id):
     ''' This funciton will generate overwie for loaded ULog data
         '''
-    output_filename = os.path.join(get_overview_img_filepath(), log_id+'.png')
+    output_filename = get_overview_img_filename(log_id)
 
     if os.path.exists(output_filename):
         return
@@ -55,15 +60,17 @@ def generate_overview_img(ulog, log_id):
         z = max(get_zoom((min_lat, min_lon, max_lat, max_lon)) - 2, 0)
 
         render_map = smopy.Map((min_lat, min_lon, max_lat, max_lon), z=z)
-        fig, axes = plt.subplots(nrows=1, ncols=1)
-        render_map.show_mpl(figsize=(8, 6), ax=axes)
+        make_parent_dirs(output_filename)
+        with __pyplot_lock:
+            fig, axes = plt.subplots(nrows=1, ncols=1)
+            render_map.show_mpl(figsize=(8, 6), ax=axes)
 
-        x, y = render_map.to_pixels(lat, lon)
-        axes.plot(x, y, 'r')
+            x, y = render_map.to_pixels(lat, lon)
+            axes.plot(x, y, 'r')
 
-        axes.set_axis_off()
-        plt.savefig(output_filename, bbox_inches='tight')
-        plt.close(fig)
+            axes.set_axis_off()
+            plt.savefig(output_filename, bbox_inches='tight')
+            plt.close(fig)
 
         print('Saving overview file '+ output_filename)
 
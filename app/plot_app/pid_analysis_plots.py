@@ -5,7 +5,7 @@ from bokeh.layouts import column
 from scipy.interpolate import interp1d
 
 from config import plot_width, plot_config, colors3
-from helper import get_flight_mode_changes, ActuatorControls
+from helper import get_flight_mode_changes, get_actuator_controls
 from pid_analysis import Trace, plot_pid_response
 from plotting import *
 from plotted_tables import get_heading_html
@@ -59,7 +59,7 @@ The analysis may take a while...
         rate_field_names = ['rollspeed', 'pitchspeed', 'yawspeed']
     dynamic_control_alloc = any(elem.name in ('actuator_motors', 'actuator_servos')
                                 for elem in data)
-    actuator_controls_0 = ActuatorControls(ulog, dynamic_control_alloc, 0)
+    actuator_controls_0 = get_actuator_controls(ulog, dynamic_control_alloc, 0)
 
     # required PID response data
     pid_analysis_error = False
@@ -1,6 +1,6 @@
 """ methods an classes used for plotting (wrappers around bokeh plots) """
-import copy
 
+from bokeh.io import curdoc
 from bokeh.plotting import figure
 #pylint: disable=line-too-long, arguments-differ, unused-import
 from bokeh.models import (
@@ -21,7 +21,8 @@ import scipy.signal
 import pyfftw
 
 from config import debug_verbose_output
-from downsampling import DynamicDownsample
+from downsampling import get_downsample_registry, narrow_plot_data, narrow_array, \
+    is_payload_narrowing_enabled
 from helper import (
     map_projection, WGS84_to_mercator, flight_modes_table, vtol_modes_table, get_lat_lon_alt_deg
     )
@@ -56,40 +57,15 @@ def plot_dropouts(p, dropouts, min_value, show_hover_tooltips=False):
         p.add_tools(HoverTool(tooltips=[('dropout', '@duration ms')],
                               renderers=[quad]))
 
-def add_virtual_fifo_topic_data(ulog, topic_name, instance=0):
-    """ adds a virtual topic by expanding the FIFO samples array into individual
-        samples, so it can be used for normal plotting.
-        new topic name: topic_name+'_virtual'
-        :return: True if topic data was added
+def has_virtual_fifo_topic_data(ulog, topic_name, instance=0):
+    """ check whether a log has the virtual topic of a FIFO topic, which contains
+        the FIFO samples array expanded into individual samples, so it can be
+        used for normal plotting. Virtual topics are added when loading the log.
+        topic name: topic_name+'_virtual'
+        :return: True if topic data exists
     """
     try:
-        cur_dataset = copy.deepcopy(ulog.get_dataset(topic_name, instance))
-        cur_dataset.name = topic_name+'_virtual'
-        t = cur_dataset.data['timestamp_sample']
-        dt = cur_dataset.data['dt']
-        samples = cur_dataset.data['samples']
-        scale = cur_dataset.data['scale']
-        total_samples = 0
-        for i in range(len(t)):
-            total_samples += samples[i]
-        t_new = np.zeros(total_samples, t.dtype)
-        xyz_new = [np.zeros(total_samples, np.float64) for i in range(3)]
-        sample = 0
-        # TODO: this could be faster...
-        for i, _ in enumerate(t):
-            for s in range(samples[i]):
-                t_new[sample+s] = t[i]-(samples[i]-s-1)*dt[i]
-                for j, axis in enumerate(['x', 'y', 'z']):
-                    data_point = cur_dataset.data[axis+'['+str(s)+']'][i] * scale[i]
-                    xyz_new[j][sample+s] = data_point
-            sample += samples[i]
-        cur_dataset.data['timestamp'] = t_new
-        cur_dataset.data['timestamp_sample'] = t_new
-        cur_dataset.data['x'] = xyz_new[0]
-        cur_dataset.data['y'] = xyz_new[1]
-        cur_dataset.data['z'] = xyz_new[2]
-        ulog.data_list.append(cur_dataset)
-        return True
+        return 'x' in ulog.get_dataset(topic_name+'_virtual', instance).data
     except (KeyError, IndexError, ValueError) as error:
         # log does not contain the value we are looking for
         if debug_verbose_output():
@@ -512,7 +488,7 @@ class DataPlot:
 
 
     def add_graph(self, field_names, colors, legends, use_downsample=True,
-                  mark_nan=False, use_step_lines=False):
+                  mark_nan=False, use_step_lines=False, downsample_method=None):
         """ add 1 or more lines to a graph
 
         field_names can be a list of fields from the data set, or a list of
@@ -521,6 +497,8 @@ class DataPlot:
         :param mark_nan: if True, add an indicator to the plot when one of the graphs is NaN
         :param use_step_lines: if True, render step lines (after each point)
         instead of rendering a straight line to the next point
+        :param downsample_method: one of downsampling.DOWNSAMPLE_METHODS (if
+        None, the configured method is used)
         """
         if self._had_error: return
         try:
@@ -562,11 +540,12 @@ class DataPlot:
             if use_downsample:
                 # we directly pass the data_set, downsample and then create the
                 # ColumnDataSource object, which is much faster than
-                # first creating ColumnDataSource, and then downsample
-                downsample = DynamicDownsample(p, data_set, 'timestamp')
-                data_source = downsample.data_source
+                # first creating ColumnDataSource, and then downsample.
+                # The downsampling is shared with the other graphs of the topic.
+                data_source = get_downsample_registry(curdoc()).get_data_source(
+                    p, data_set, 'timestamp', downsample_method, self._cur_dataset)
             else:
-                data_source = ColumnDataSource(data=data_set)
+                data_source = ColumnDataSource(data=narrow_plot_data(data_set, 'timestamp'))
 
             for field_name, color, legend in zip(field_names_expanded, colors, legends):
                 if use_step_lines:
@@ -593,7 +572,7 @@ class DataPlot:
             data_set = {}
             data_set['timestamp'] = self._cur_dataset.data['timestamp']
             field_names_expanded = self._expand_field_names(field_names, data_set)
-            data_source = ColumnDataSource(data=data_set)
+            data_source = ColumnDataSource(data=narrow_plot_data(data_set, 'timestamp'))
 
             for field_name, color, legend in zip(field_names_expanded, colors, legends):
                 p.circle(x='timestamp', y=field_name, source=data_source,
@@ -885,6 +864,8 @@ class DataPlotSpec(DataPlot):
                 step_size = int(len(time) / max_num_data_points)
                 time = time[::step_size]
                 image[0] = image[0][:, ::step_size]
+            if is_payload_narrowing_enabled():
+                image[0] = narrow_array(image[0])
 
             color_mapper = LinearColorMapper(palette="Viridis256", low=np.amin(image), high=np.amax(image))
 
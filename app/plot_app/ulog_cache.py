@@ -0,0 +1,510 @@
+""" Caches for parsed ULog files """
+
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import os
+import pickle
+import shutil
+import sys
+import threading
+import uuid
+
+import numpy as np
+
+from file_storage import get_sharded_filename
+from ulog_index import DerivedData, LazyData, LazyULog
+
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
+
+#pylint: disable=protected-access
+
+
+def get_ulog_nbytes(ulog):
+    """ get the memory footprint of the topic data of an ULog object in bytes
+    (for a LazyULog, only the decoded topics and the message offsets) """
+    nbytes = 0
+    for dataset in ulog.data_list:
+        if isinstance(dataset, LazyData):
+            nbytes += dataset.offsets.nbytes
+        if isinstance(dataset, (LazyData, DerivedData)) and not dataset.is_decoded:
+            continue
+        nbytes += sum(value.nbytes for value in dataset.data.values())
+    return nbytes
+
+
+ULogCacheInfo = namedtuple('ULogCacheInfo',
+                           ['hits', 'misses', 'evictions', 'num_entries',
+                            'resident_bytes', 'max_bytes'])
+
+class ULogMemoryCache:
+    """ In-memory LRU cache of ULog objects.
+
+    The cache is limited by the total size of the topic data of the cached logs
+    instead of the number of logs (updated whenever a log is added, and by
+    update() when a topic of a cached log got decoded). The most recently used
+    log is always kept, even if it exceeds the budget on its own.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: maximum total size of the cached topic data
+        """
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict() # key: file name, value: (ULog, nbytes)
+        self._resident_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, update_stats=True):
+        """ get a cached ULog object (and mark it as recently used)
+        :param update_stats: if False, do not count this as hit or miss
+        :return: ULog object or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if update_stats:
+                    self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if update_stats:
+                self._hits += 1
+            return entry[0]
+
+    def put(self, key, ulog):
+        """ add an ULog object and evict the least recently used ones if the
+        budget is exceeded """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (ulog, 0)
+            # topics of cached logs might have been decoded in the meantime
+            self._resident_bytes = 0
+            for entry_key, (entry_ulog, _) in self._entries.items():
+                nbytes = get_ulog_nbytes(entry_ulog)
+                self._entries[entry_key] = (entry_ulog, nbytes)
+                self._resident_bytes += nbytes
+            self._evict()
+
+    def update(self, key):
+        """ re-measure the size of a cached log (after more of its topics got
+        decoded), mark it as recently used and evict the least recently used
+        logs if the budget is exceeded """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            ulog, old_nbytes = entry
+            nbytes = get_ulog_nbytes(ulog)
+            self._entries[key] = (ulog, nbytes)
+            self._entries.move_to_end(key)
+            self._resident_bytes += nbytes - old_nbytes
+            self._evict()
+
+    def _evict(self):
+        """ evict the least recently used logs while the budget is exceeded
+        (the lock must be held) """
+        while self._resident_bytes > self._max_bytes and len(self._entries) > 1:
+            _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+            self._resident_bytes -= evicted_nbytes
+            self._evictions += 1
+
+    def clear(self):
+        """ remove all entries """
+        with self._lock:
+            self._entries.clear()
+            self._resident_bytes = 0
+
+    def info(self):
+        """ get cache statistics
+        :return: ULogCacheInfo
+        """
+        with self._lock:
+            return ULogCacheInfo(self._hits, self._misses, self._evictions,
+                                 len(self._entries), self._resident_bytes,
+                                 self._max_bytes)
+
+
+class ULogDiskCache:
+    """ Persistent on-disk cache of LazyULog objects.
+
+    The cache stores the index of a log (everything except the topic data, plus
+    the file offsets of the messages of each topic). The data of a topic is
+    added when it gets decoded, with every field stored as a separate .npy file,
+    which is memory-mapped when loading. So a cached log is available in a few
+    milliseconds and only the accessed data is read from disk.
+    The layout is (with <entry> = <path>/ab/cd/<key>, sharded like the stored
+    files, see file_storage.py):
+        <entry>/meta.pickle
+        <entry>/<topic name>.<multi id>/offsets.npy
+        <entry>/<topic name>.<multi id>/sparse_timestamps.npy
+        <entry>/<topic name>.<multi id>/data/fields.pickle
+        <entry>/<topic name>.<multi id>/data/<field index>.npy
+        <entry>/<topic name>.<multi id>/pyramid/<field name>.npy
+    (pyramid: see minmax_pyramid.py, added per field when computed)
+
+    An entry is invalidated when the size or modification time of the log file
+    changes.
+
+    If the directory is on a tmpfs (e.g. /dev/shm), the cache can be shared
+    between worker processes: mapped arrays are backed by the same memory pages,
+    so a log parsed by one process is used by all others without copying.
+    In that case max_bytes should be set to limit the used memory.
+    """
+
+    FORMAT_VERSION = 4
+
+    def __init__(self, path, max_bytes=None):
+        """
+        :param path: cache directory (created if it does not exist)
+        :param max_bytes: if set, remove the least recently used entries when
+                          the total size exceeds this limit
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        # size of the cache at the last pruning plus the data added since by
+        # this process (None: unknown)
+        self._estimated_bytes = None
+
+    @property
+    def path(self):
+        """ get the cache directory """
+        return self._path
+
+    @staticmethod
+    def _file_stamp(file_name):
+        """ get the (size, mtime) tuple used to detect changed log files """
+        stat = os.stat(file_name)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _entry_path(self, key):
+        return get_sharded_filename(self._path, key, '')
+
+    @staticmethod
+    def _topic_dir_name(dataset):
+        return dataset.name+'.'+str(dataset.multi_id)
+
+    def load(self, key, file_name, max_samples=None):
+        """ load a LazyULog object from the cache.
+
+        :param key: cache key of the log (e.g. the log id)
+        :param file_name: log file the entry was created from
+        :param max_samples: decimation of the log (see LazyULog)
+        :return: LazyULog object or None if not cached or outdated
+        """
+        entry_path = self._entry_path(key)
+        meta_file_name = os.path.join(entry_path, 'meta.pickle')
+        if not os.path.exists(meta_file_name):
+            return None
+        try:
+            with open(meta_file_name, 'rb') as meta_file:
+                meta = pickle.load(meta_file)
+            if meta['version'] != self.FORMAT_VERSION or \
+                    meta['file_stamp'] != self._file_stamp(file_name) or \
+                    meta['ulog']['_max_samples'] != max_samples:
+                print('Removing outdated ulog cache entry', entry_path)
+                shutil.rmtree(entry_path, ignore_errors=True)
+                return None
+            if self._max_bytes is not None:
+                os.utime(entry_path) # mark as recently used
+
+            ulog = LazyULog.from_state(file_name, meta['ulog'])
+            for topic in meta['topics']:
+                topic_path = os.path.join(entry_path, topic['dir_name'])
+                offsets = np.load(os.path.join(topic_path, 'offsets.npy'), mmap_mode='r')
+                sparse_timestamps = np.load(os.path.join(topic_path, 'sparse_timestamps.npy'))
+                ulog._data_list.append(LazyData(
+                    ulog, topic['name'], topic['multi_id'], topic['msg_id'],
+                    topic['field_data'], topic['timestamp_idx'], topic['dtype'],
+                    offsets, sparse_timestamps,
+                    self._load_topic_data(os.path.join(topic_path, 'data'))))
+            return ulog
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            print('Failed to load ulog cache entry', entry_path, error)
+            shutil.rmtree(entry_path, ignore_errors=True)
+            return None
+
+    def is_decoded(self, key, file_name, max_samples=None):
+        """ check whether the cache contains an up-to-date entry for a log with
+        the data of all topics (i.e. loading the log needs no decoding) """
+        entry_path = self._entry_path(key)
+        try:
+            with open(os.path.join(entry_path, 'meta.pickle'), 'rb') as meta_file:
+                meta = pickle.load(meta_file)
+            if meta['version'] != self.FORMAT_VERSION or \
+                    meta['file_stamp'] != self._file_stamp(file_name) or \
+                    meta['ulog']['_max_samples'] != max_samples:
+                return False
+        except (OSError, pickle.UnpicklingError, KeyError):
+            return False
+        return all(os.path.exists(os.path.join(entry_path, topic['dir_name'],
+                                               'data', 'fields.pickle'))
+                   for topic in meta['topics'])
+
+    @staticmethod
+    def _load_topic_data(data_path):
+        """ load the data of a topic if it is cached
+        :return: dict of field name: numpy array or None
+        """
+        try:
+            with open(os.path.join(data_path, 'fields.pickle'), 'rb') as fields_file:
+                field_names = pickle.load(fields_file)
+        except FileNotFoundError:
+            return None
+        # copy-on-write mapping: writes stay private to this process
+        return {field_name: np.load(os.path.join(data_path, str(i)+'.npy'), mmap_mode='c')
+                for i, field_name in enumerate(field_names)}
+
+    @staticmethod
+    def _save_topic_data(data_path, dataset):
+        os.makedirs(data_path)
+        field_names = list(dataset.data.keys())
+        for i, field_name in enumerate(field_names):
+            np.save(os.path.join(data_path, str(i)+'.npy'),
+                    dataset.data[field_name], allow_pickle=False)
+        with open(os.path.join(data_path, 'fields.pickle'), 'wb') as fields_file:
+            pickle.dump(field_names, fields_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def store(self, key, file_name, ulog):
+        """ store a LazyULog object (with the already decoded topics) in the cache.
+        Errors are printed and otherwise ignored.
+        """
+        entry_path = self._entry_path(key)
+        # write into a temporary directory, then move to avoid races
+        temp_path = entry_path+'.'+str(uuid.uuid4())
+        try:
+            os.makedirs(temp_path)
+            meta = {
+                'version': self.FORMAT_VERSION,
+                'file_stamp': self._file_stamp(file_name),
+                'ulog': ulog.get_state(),
+                'topics': [],
+                }
+            for dataset in ulog.data_list:
+                if not isinstance(dataset, LazyData):
+                    continue # virtual topics are created when loading
+                dir_name = self._topic_dir_name(dataset)
+                topic_path = os.path.join(temp_path, dir_name)
+                os.makedirs(topic_path)
+                np.save(os.path.join(topic_path, 'offsets.npy'), dataset.offsets,
+                        allow_pickle=False)
+                np.save(os.path.join(topic_path, 'sparse_timestamps.npy'),
+                        dataset.sparse_timestamps, allow_pickle=False)
+                if dataset.is_decoded:
+                    self._save_topic_data(os.path.join(topic_path, 'data'), dataset)
+                meta['topics'].append({
+                    'name': dataset.name,
+                    'multi_id': dataset.multi_id,
+                    'msg_id': dataset.msg_id,
+                    'field_data': dataset.field_data,
+                    'timestamp_idx': dataset.timestamp_idx,
+                    'dtype': dataset.dtype,
+                    'dir_name': dir_name,
+                    })
+            # the meta file is written last: it marks the entry as complete
+            with open(os.path.join(temp_path, 'meta.pickle'), 'wb') as meta_file:
+                pickle.dump(meta, meta_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+            if os.path.exists(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            os.rename(temp_path, entry_path)
+        except Exception:
+            print('Failed to store ulog cache entry', entry_path,
+                  sys.exc_info()[0], sys.exc_info()[1])
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return
+
+        if self._max_bytes is not None:
+            self._prune(keep=entry_path)
+
+    def store_topic(self, key, dataset):
+        """ add the data of a decoded topic to an existing cache entry.
+        Errors are printed and otherwise ignored.
+        """
+        topic_path = os.path.join(self._entry_path(key), self._topic_dir_name(dataset))
+        data_path = os.path.join(topic_path, 'data')
+        if not os.path.isdir(topic_path) or os.path.exists(data_path):
+            return # not cached or already stored
+        temp_path = data_path+'.'+str(uuid.uuid4())
+        try:
+            self._save_topic_data(temp_path, dataset)
+            os.rename(temp_path, data_path)
+        except Exception:
+            # can happen if another process stored it concurrently
+            shutil.rmtree(temp_path, ignore_errors=True)
+            if not os.path.exists(data_path):
+                print('Failed to store ulog cache topic', data_path,
+                      sys.exc_info()[0], sys.exc_info()[1])
+            return
+
+        self._add_stored_bytes(key, sum(value.nbytes for value in dataset.data.values()))
+
+    def load_pyramid_field(self, key, dataset, field_name):
+        """ load the min/max pyramid levels of a field of a topic
+        :return: numpy array (memory-mapped) or None if not cached
+        """
+        file_name = os.path.join(self._entry_path(key), self._topic_dir_name(dataset),
+                                 'pyramid', field_name+'.npy')
+        try:
+            return np.load(file_name, mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            print('Failed to load ulog cache pyramid', file_name, error)
+            return None
+
+    def store_pyramid_field(self, key, dataset, field_name, levels):
+        """ add the min/max pyramid levels of a field of a topic to an existing
+        cache entry. Errors are printed and otherwise ignored.
+        """
+        topic_path = os.path.join(self._entry_path(key), self._topic_dir_name(dataset))
+        if not os.path.isdir(topic_path):
+            return # not cached
+        pyramid_path = os.path.join(topic_path, 'pyramid')
+        file_name = os.path.join(pyramid_path, field_name+'.npy')
+        temp_file_name = file_name+'.'+str(uuid.uuid4())+'.tmp'
+        try:
+            os.makedirs(pyramid_path, exist_ok=True)
+            with open(temp_file_name, 'wb') as pyramid_file:
+                np.save(pyramid_file, levels, allow_pickle=False)
+            os.rename(temp_file_name, file_name)
+        except Exception:
+            print('Failed to store ulog cache pyramid', file_name,
+                  sys.exc_info()[0], sys.exc_info()[1])
+            if os.path.exists(temp_file_name):
+                os.unlink(temp_file_name)
+            return
+
+        self._add_stored_bytes(key, levels.nbytes)
+
+    def _add_stored_bytes(self, key, nbytes):
+        """ account for data added to an existing entry. The cache is only
+        pruned (which needs to scan all entries) when the estimated size
+        exceeds max_bytes. """
+        if self._max_bytes is None:
+            return
+        if self._estimated_bytes is not None:
+            self._estimated_bytes += nbytes
+            if self._estimated_bytes <= self._max_bytes:
+                return
+        self._prune(keep=self._entry_path(key))
+
+    def _get_entry_paths(self):
+        """ get the directories of all entries, including the ones in the
+        previous flat layout (<path>/<key>), which are not loaded anymore and
+        get removed by pruning """
+        entry_paths = []
+        try:
+            for name in os.listdir(self._path):
+                path = os.path.join(self._path, name)
+                if not os.path.isdir(path):
+                    continue
+                if len(name) != 2: # not a shard directory
+                    entry_paths.append(path)
+                    continue
+                for shard_name in os.listdir(path):
+                    shard_path = os.path.join(path, shard_name)
+                    entry_paths.extend(os.path.join(shard_path, key)
+                                       for key in os.listdir(shard_path)
+                                       if not key.endswith('.lock'))
+        except (FileNotFoundError, NotADirectoryError):
+            pass # concurrently removed by another process
+        return entry_paths
+
+    def _prune(self, keep):
+        """ remove least recently used entries until the cache size is within
+        max_bytes (the entry keep is never removed) """
+        entries = [] # (mtime, size, path)
+        total_bytes = 0
+        for entry_path in self._get_entry_paths():
+            try:
+                size = 0
+                for dir_path, _, file_names in os.walk(entry_path):
+                    for file_name in file_names:
+                        size += os.path.getsize(os.path.join(dir_path, file_name))
+                entries.append((os.path.getmtime(entry_path), size, entry_path))
+                total_bytes += size
+            except FileNotFoundError:
+                pass # concurrently removed by another process
+
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_bytes <= self._max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            # processes that still have the files mapped keep them until unmapped
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_bytes -= size
+        self._estimated_bytes = total_bytes
+
+    @contextmanager
+    def lock(self, key):
+        """ context manager for an exclusive lock of a log across processes, so
+        that a log is only parsed by one process at a time. The lock file
+        (<entry>.lock) is removed when the lock is released. """
+        if fcntl is None:
+            yield
+            return
+        lock_file_name = self._entry_path(key)+'.lock'
+        lock_file = None
+        try:
+            while True:
+                os.makedirs(os.path.dirname(lock_file_name), exist_ok=True)
+                lock_file = open(lock_file_name, 'ab') #pylint: disable=consider-using-with
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # the previous holder might have removed the file meanwhile
+                    if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_file_name)):
+                        break
+                except FileNotFoundError:
+                    pass
+                lock_file.close()
+        except OSError as error:
+            # e.g. the cache directory is not writable: continue without locking
+            print('Failed to lock ulog cache entry', lock_file_name, error)
+            if lock_file is not None:
+                lock_file.close()
+                lock_file = None
+        try:
+            yield
+        finally:
+            if lock_file is not None:
+                # remove it before unlocking: waiting processes then open a new file
+                try:
+                    os.unlink(lock_file_name)
+                except OSError:
+                    pass
+                lock_file.close()
+
+    def invalidate(self, key):
+        """ remove all cache entries of a log """
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def copy(self, key, new_key):
+        """ use the cache entry of a log also for another log with the same file
+        (e.g. a duplicate upload). Files are never modified once written, so
+        they are hard-linked instead of copied. Errors are printed and
+        otherwise ignored.
+        """
+        entry_path = self._entry_path(key)
+        new_entry_path = self._entry_path(new_key)
+        if not os.path.exists(os.path.join(entry_path, 'meta.pickle')) or \
+                os.path.exists(new_entry_path):
+            return
+        temp_path = new_entry_path+'.'+str(uuid.uuid4())
+        try:
+            # skip data that is concurrently being stored (data.<uuid>, *.tmp)
+            shutil.copytree(entry_path, temp_path, copy_function=os.link,
+                            ignore=shutil.ignore_patterns('data.*', '*.tmp'))
+            os.rename(temp_path, new_entry_path)
+        except Exception:
+            print('Failed to copy ulog cache entry', entry_path,
+                  sys.exc_info()[0], sys.exc_info()[1])
+            shutil.rmtree(temp_path, ignore_errors=True)
@@ -0,0 +1,637 @@
+""" Lazy loading of ULog files: topic data is only decoded when accessed """
+
+from array import array
+from multiprocessing import shared_memory
+import os
+import pickle
+import struct
+import sys
+import threading
+import uuid
+
+import numpy as np
+from pyulog import ULog
+
+from log_storage import open_log_file
+
+#pylint: disable=protected-access
+
+
+class LazyULog(ULog):
+    """
+    ULog object that only indexes the data section of a log file when loading.
+
+    For every topic the file offsets of its data messages are recorded, and the
+    topic data is decoded from the file the first time the data of a dataset is
+    accessed. Everything else (info, parameters, logged messages, dropouts, ...)
+    is loaded like with ULog.
+    """
+
+    # file offset and size of the blocks read while scanning or decoding
+    READ_BLOCK_SIZE = 1024 * 1024
+    # messages further apart than this are read individually when decoding
+    MAX_READ_GAP = 64 * 1024
+    # the timestamp of every n-th message of a topic is stored in the index
+    SPARSE_TIMESTAMP_INTERVAL = 256
+
+    INDEX_FORMAT_VERSION = 1
+
+    def __init__(self, file_name, disable_str_exceptions=True, max_samples=None):
+        """
+        :param file_name: log file name (must not change while the object is used)
+        :param max_samples: if set, topics with more messages are decimated while
+                            indexing, to between max_samples and 2*max_samples
+                            messages. This bounds the memory for very large logs.
+        """
+        super().__init__(None, disable_str_exceptions=disable_str_exceptions)
+        self._init_lazy(file_name)
+        self._max_samples = max_samples
+        with open_log_file(file_name) as file_handle:
+            self._file_handle = file_handle
+            self._read_file_header()
+            self._last_timestamp = self._start_timestamp
+            self._read_file_definitions()
+            data_offset = file_handle.tell()
+            del self._file_handle
+
+            subscriptions = {} # key: msg_id, value: _TopicIndex
+            if self.has_data_appended and len(self._appended_offsets) > 0:
+                for offset in self._appended_offsets:
+                    self._scan_file_data(file_handle, data_offset, subscriptions,
+                                         read_until=offset)
+                    data_offset = offset
+            self._scan_file_data(file_handle, data_offset, subscriptions)
+
+        for msg_id, topic_index in subscriptions.items():
+            msg_add_logged = topic_index.msg_add_logged
+            if len(topic_index.offsets) > 0: # only add if we have data
+                self._data_list.append(LazyData(
+                    self, msg_add_logged.message_name, msg_add_logged.multi_id,
+                    msg_id, msg_add_logged.field_data, msg_add_logged.timestamp_idx,
+                    msg_add_logged.dtype, np.frombuffer(topic_index.offsets, dtype=np.int64),
+                    np.frombuffer(topic_index.sparse_timestamps, dtype=np.uint64)))
+        self._data_list.sort(key=lambda ds: (ds.name, ds.multi_id))
+
+    @classmethod
+    def load(cls, file_name, disable_str_exceptions=True, max_samples=None):
+        """ load a log file using its index file if it exists and is up to date,
+        otherwise index the log file
+        :param max_samples: see __init__()
+        :return: LazyULog object
+        """
+        ulog = cls.load_index(file_name, max_samples)
+        if ulog is None:
+            ulog = cls(file_name, disable_str_exceptions, max_samples)
+        return ulog
+
+    @classmethod
+    def load_index(cls, file_name, max_samples=None):
+        """ load a log from its index file (see write_index())
+        :param max_samples: the index is only used if it got created with the
+                            same max_samples
+        :return: LazyULog object or None if there is no valid index file
+        """
+        index_file_name = get_index_filename(file_name)
+        try:
+            with open(index_file_name, 'rb') as index_file:
+                index = pickle.load(index_file)
+            if index['version'] != cls.INDEX_FORMAT_VERSION or \
+                    index['file_stamp'] != _get_file_stamp(file_name) or \
+                    index['ulog'].get('_max_samples') != max_samples:
+                return None
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            print('Failed to load ulog index', index_file_name, error)
+            return None
+
+        ulog = cls.from_state(file_name, index['ulog'])
+        for topic in index['topics']:
+            ulog._data_list.append(LazyData(
+                ulog, topic['name'], topic['multi_id'], topic['msg_id'],
+                topic['field_data'], topic['timestamp_idx'], topic['dtype'],
+                topic['offsets'], topic['sparse_timestamps']))
+        return ulog
+
+    def write_index(self):
+        """ write the index (everything except the topic data) to a file next to
+        the log file, so that the log does not need to be scanned when loading.
+        Errors are printed and otherwise ignored.
+        """
+        index_file_name = get_index_filename(self._file_name)
+        temp_file_name = index_file_name+'.'+str(uuid.uuid4())
+        index = {
+            'version': self.INDEX_FORMAT_VERSION,
+            'file_stamp': _get_file_stamp(self._file_name),
+            'ulog': self.get_state(),
+            'topics': [{
+                'name': dataset.name,
+                'multi_id': dataset.multi_id,
+                'msg_id': dataset.msg_id,
+                'field_data': dataset.field_data,
+                'timestamp_idx': dataset.timestamp_idx,
+                'dtype': dataset.dtype,
+                'offsets': np.asarray(dataset.offsets),
+                'sparse_timestamps': np.asarray(dataset.sparse_timestamps),
+                } for dataset in self._data_list if isinstance(dataset, LazyData)],
+            }
+        try:
+            with open(temp_file_name, 'wb') as index_file:
+                pickle.dump(index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file_name, index_file_name)
+        except Exception:
+            print('Failed to write ulog index', index_file_name,
+                  sys.exc_info()[0], sys.exc_info()[1])
+            if os.path.exists(temp_file_name):
+                os.unlink(temp_file_name)
+
+    @classmethod
+    def from_state(cls, file_name, state):
+        """ create an object from the state of another object (without data
+        list), e.g. loaded from a cache
+        :param state: dict of attributes, see get_state()
+        """
+        ulog = cls.__new__(cls)
+        ulog.__dict__.update(state)
+        ulog._init_lazy(file_name)
+        ulog._data_list = []
+        return ulog
+
+    def get_state(self):
+        """ get the attributes required to recreate this object, except for the
+        data list """
+        return {key: value for key, value in self.__dict__.items()
+                if key not in ('_data_list', '_file_name', '_decode_lock',
+                               'decode_callback', '_derived_data')}
+
+    def _init_lazy(self, file_name):
+        self._file_name = file_name
+        self._decode_lock = threading.Lock()
+        # called as decode_callback(dataset) after a dataset got decoded
+        self.decode_callback = None
+
+    @property
+    def file_name(self):
+        """ get the log file name """
+        return self._file_name
+
+    @property
+    def max_samples(self):
+        """ get the maximum number of samples per topic (None if not decimated),
+        see __init__() """
+        return self._max_samples
+
+    def decode(self, dataset):
+        """ decode the data of a LazyData object from the log file
+        :return: dict of field name: numpy array
+        """
+        with self._decode_lock:
+            if dataset.is_decoded:
+                return dataset.data
+
+            values = self._read_messages(dataset.offsets, dataset.dtype)
+            dataset.data = {name: values[name] for name in values.dtype.names}
+
+        if self.decode_callback is not None:
+            self.decode_callback(dataset)
+        return dataset.data
+
+    def _read_messages(self, offsets, dtype):
+        """ read messages from the log file
+        :param offsets: sorted numpy array of message file offsets
+        :return: numpy structured array
+        """
+        values = np.empty(len(offsets), dtype=dtype)
+        read_messages(self._file_name, offsets, values)
+        return values
+
+    def decode_parallel(self, datasets, executor, run_size=256*1024):
+        """ decode multiple LazyData objects using a process pool.
+        The messages of each topic are split into runs, which are decoded by the
+        worker processes directly into shared memory.
+        :param executor: concurrent.futures.ProcessPoolExecutor
+        :param run_size: maximum number of messages per run
+        """
+        jobs = [] # list of (dataset, SharedMemory, list of futures)
+        try:
+            for dataset in datasets:
+                if dataset.is_decoded:
+                    continue
+                offsets = np.asarray(dataset.offsets)
+                shm = shared_memory.SharedMemory(
+                    create=True, size=max(len(offsets) * dataset.dtype.itemsize, 1))
+                futures = [executor.submit(read_messages_to_shared_memory, self._file_name,
+                                           offsets[i:i+run_size], dataset.dtype,
+                                           shm.name, i)
+                           for i in range(0, len(offsets), run_size)]
+                jobs.append((dataset, shm, futures))
+
+            for dataset, shm, futures in jobs:
+                for future in futures:
+                    future.result()
+                # copy out of the shared memory, so that it can be released
+                values = np.ndarray(len(dataset.offsets), dtype=dataset.dtype,
+                                    buffer=shm.buf).copy()
+                with self._decode_lock:
+                    if dataset.is_decoded:
+                        continue
+                    dataset.data = {name: values[name] for name in values.dtype.names}
+                if self.decode_callback is not None:
+                    self.decode_callback(dataset)
+        finally:
+            for _, shm, _ in jobs:
+                shm.close()
+                shm.unlink()
+
+    def decode_range(self, dataset, t_start, t_end):
+        """ decode the data of a LazyData object within a time range, without
+        decoding the whole topic
+        :param t_start, t_end: time range [us], None for an open range
+        :return: dict of field name: numpy array
+        """
+        # use the sparse timestamps to find the messages to read
+        interval = self.SPARSE_TIMESTAMP_INTERVAL
+        sparse_timestamps = dataset.sparse_timestamps
+        first_index = 0
+        last_index = len(dataset.offsets)
+        if t_start is not None:
+            first_index = max(np.searchsorted(sparse_timestamps, t_start, side='right') - 1,
+                              0) * interval
+        if t_end is not None:
+            last_index = min(np.searchsorted(sparse_timestamps, t_end, side='right') *
+                             interval, last_index)
+        values = self._read_messages(dataset.offsets[first_index:last_index], dataset.dtype)
+        return _get_time_range({name: values[name] for name in values.dtype.names},
+                               t_start, t_end)
+
+    def _scan_file_data(self, file_handle, offset, subscriptions, read_until=None):
+        """
+        index the file data section: like ULog._read_file_data(), but instead of
+        copying the data messages, store their file offsets.
+        :param read_until: an optional file offset: if set, scan only up to
+                           this offset (smaller than)
+        """
+        if read_until is None:
+            read_until = 1 << 50 # make it larger than any possible log file
+
+        header = self._MessageHeader()
+        unpack_header = struct.Struct('<HB').unpack_from
+        unpack_ushort = struct.Struct('<H').unpack_from
+        unpack_uint64 = struct.Struct('<Q').unpack_from
+        sparse_interval = self.SPARSE_TIMESTAMP_INTERVAL
+        max_offsets = None
+        if self._max_samples is not None:
+            max_offsets = 2 * max(self._max_samples, 1)
+
+        file_handle.seek(offset)
+        buf = b''
+        buf_offset = offset # file offset of buf[0]
+        pos = 0 # current position within buf
+        at_eof = False
+        while True:
+            if len(buf) - pos < 3 + 0xffff and not at_eof:
+                # make sure the next message is completely in the buffer
+                new_data = file_handle.read(self.READ_BLOCK_SIZE)
+                at_eof = len(new_data) == 0
+                buf_offset += pos
+                buf = buf[pos:] + new_data
+                pos = 0
+            if len(buf) - pos < 3:
+                break
+            msg_size, msg_type = unpack_header(buf, pos)
+            msg_end = pos + 3 + msg_size
+            if msg_end > len(buf):
+                break # less data than expected. File is most likely cut
+            if buf_offset + msg_end > read_until:
+                break
+
+            if msg_type == self.MSG_TYPE_DATA and msg_size >= 2:
+                msg_id, = unpack_ushort(buf, pos + 3)
+                topic_index = subscriptions.get(msg_id)
+                if topic_index is not None:
+                    msg_add_logged = topic_index.msg_add_logged
+                    data_size = msg_size - 2
+                    if data_size < msg_add_logged.dtype.itemsize or \
+                            data_size > msg_add_logged.max_data_size:
+                        self._file_corrupt = True # corrupt data: skip
+                    else:
+                        timestamp, = unpack_uint64(
+                            buf, pos + 5 + msg_add_logged.timestamp_offset)
+                        if topic_index.num_messages % topic_index.stride == 0:
+                            offsets = topic_index.offsets
+                            if len(offsets) % sparse_interval == 0:
+                                topic_index.sparse_timestamps.append(timestamp)
+                            offsets.append(buf_offset + pos + 5)
+                            if max_offsets is not None and len(offsets) >= max_offsets:
+                                topic_index.decimate()
+                        topic_index.num_messages += 1
+                        if timestamp > self._last_timestamp:
+                            self._last_timestamp = timestamp
+                else:
+                    if not msg_id in self._filtered_message_ids and \
+                            not msg_id in self._missing_message_ids:
+                        self._missing_message_ids.add(msg_id)
+                        print('Warning: no subscription found for message id {:}. Continuing,'
+                              ' but file is most likely corrupt'.format(msg_id))
+                    self._file_corrupt = True
+                pos = msg_end
+                continue
+
+            header.initialize(buf[pos:pos+3])
+            data = buf[pos+3:msg_end]
+            try:
+                if msg_type == self.MSG_TYPE_ADD_LOGGED_MSG:
+                    msg_add_logged = self._MessageAddLogged(data, header,
+                                                            self._message_formats)
+                    subscriptions[msg_add_logged.msg_id] = _TopicIndex(msg_add_logged)
+                elif msg_type == self.MSG_TYPE_INFO:
+                    msg_info = self._MessageInfo(data, header)
+                    self._msg_info_dict[msg_info.key] = msg_info.value
+                    self._msg_info_dict_types[msg_info.key] = msg_info.type
+                elif msg_type == self.MSG_TYPE_INFO_MULTIPLE:
+                    msg_info = self._MessageInfo(data, header, is_info_multiple=True)
+                    self._add_message_info_multiple(msg_info)
+                elif msg_type == self.MSG_TYPE_PARAMETER:
+                    msg_info = self._MessageInfo(data, header)
+                    self._changed_parameters.append((self._last_timestamp,
+                                                     msg_info.key, msg_info.value))
+                elif msg_type == self.MSG_TYPE_PARAMETER_DEFAULT:
+                    msg_param = self._MessageParameterDefault(data, header)
+                    self._add_parameter_default(msg_param)
+                elif msg_type == self.MSG_TYPE_LOGGING:
+                    self._logged_messages.append(self.MessageLogging(data, header))
+                elif msg_type == self.MSG_TYPE_LOGGING_TAGGED:
+                    msg_log_tagged = self.MessageLoggingTagged(data, header)
+                    self._logged_messages_tagged.setdefault(
+                        msg_log_tagged.tag, []).append(msg_log_tagged)
+                elif msg_type == self.MSG_TYPE_DROPOUT:
+                    self._dropouts.append(self.MessageDropout(data, header,
+                                                              self._last_timestamp))
+                elif msg_type == self.MSG_TYPE_SYNC:
+                    self._sync_seq_cnt += 1
+                elif self._check_packet_corruption(header):
+                    # advance only by a single byte instead of skipping the
+                    # message and try to recover with the sync sequence
+                    next_offset = buf_offset + pos + 1
+                    if self._has_sync:
+                        sync_offset = self._find_sync_offset(file_handle, next_offset)
+                        if sync_offset is None:
+                            self._has_sync = False
+                        else:
+                            next_offset = sync_offset
+                    file_handle.seek(next_offset)
+                    buf = b''
+                    buf_offset = next_offset
+                    pos = 0
+                    at_eof = False
+                    continue
+                else:
+                    # unknown message type: look for a sync sequence in the payload
+                    sync_pos = buf.find(self.SYNC_BYTES, pos + 3, msg_end)
+                    if self._has_sync and sync_pos >= 0:
+                        msg_end = sync_pos + len(self.SYNC_BYTES)
+                        self._file_corrupt = True
+            except IndexError:
+                if not self._file_corrupt:
+                    print("File corruption detected while reading file data!")
+                    self._file_corrupt = True
+            pos = msg_end
+
+    def _find_sync_offset(self, file_handle, offset):
+        """ search the file for the sync sequence, starting at offset
+        :return: file offset after the sync sequence or None if not found
+        """
+        file_handle.seek(offset)
+        chunk_offset = offset
+        chunk = file_handle.read(self.READ_BLOCK_SIZE)
+        while len(chunk) >= len(self.SYNC_BYTES):
+            sync_pos = chunk.find(self.SYNC_BYTES)
+            if sync_pos >= 0:
+                self._file_corrupt = True
+                return chunk_offset + sync_pos + len(self.SYNC_BYTES)
+            # keep the end of the chunk to handle the boundary condition
+            keep = len(self.SYNC_BYTES) - 1
+            chunk_offset += len(chunk) - keep
+            chunk = chunk[-keep:] + file_handle.read(self.READ_BLOCK_SIZE)
+            if len(chunk) == keep:
+                break
+        return None
+
+
+class _TopicIndex:
+    """ index of a topic while scanning a log file """
+    __slots__ = ['msg_add_logged', 'offsets', 'sparse_timestamps', 'num_messages', 'stride']
+
+    def __init__(self, msg_add_logged):
+        self.msg_add_logged = msg_add_logged
+        self.offsets = array('q') # file offsets of every stride-th message
+        self.sparse_timestamps = array('Q') # timestamps of offsets[::SPARSE_TIMESTAMP_INTERVAL]
+        self.num_messages = 0
+        self.stride = 1
+
+    def decimate(self):
+        """ drop every second message """
+        self.offsets = self.offsets[::2]
+        self.sparse_timestamps = self.sparse_timestamps[::2]
+        self.stride *= 2
+
+
+def read_messages(file_name, offsets, values):
+    """ read messages from a log file
+    :param offsets: sorted numpy array of message file offsets
+    :param values: numpy structured array where the messages are stored
+    """
+    item_size = values.dtype.itemsize
+    values_bytes = values.view(np.uint8).reshape(-1, item_size)
+    field_offsets = np.arange(item_size)
+    gap_indexes = np.flatnonzero(np.diff(offsets) > LazyULog.MAX_READ_GAP) + 1
+
+    with open_log_file(file_name) as file_handle:
+        i = 0
+        while i < len(offsets):
+            # read consecutive messages at once, up to a maximum block size
+            start = int(offsets[i])
+            end_index = np.searchsorted(offsets, start + LazyULog.READ_BLOCK_SIZE -
+                                        item_size, side='right')
+            gap_index = np.searchsorted(gap_indexes, i, side='right')
+            if gap_index < len(gap_indexes):
+                end_index = min(end_index, gap_indexes[gap_index])
+            end_index = max(end_index, i + 1)
+            end = int(offsets[end_index - 1]) + item_size
+            file_handle.seek(start)
+            block = np.frombuffer(file_handle.read(end - start), dtype=np.uint8)
+            values_bytes[i:end_index] = block[
+                (offsets[i:end_index] - start)[:, np.newaxis] + field_offsets]
+            i = end_index
+
+def read_messages_to_shared_memory(file_name, offsets, dtype, shared_memory_name,
+                                   first_index):
+    """ read messages from a log file into shared memory (executed in a worker
+    process, see LazyULog.decode_parallel())
+    :param shared_memory_name: name of the shared memory with the structured
+                               array of all messages of the topic
+    :param first_index: index of the first message within the array
+    """
+    shm = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        values = np.ndarray(len(offsets), dtype=dtype, buffer=shm.buf,
+                            offset=first_index * dtype.itemsize)
+        read_messages(file_name, offsets, values)
+        del values
+    finally:
+        shm.close()
+
+def get_index_filename(file_name):
+    """ get the file name of the index file of a log file """
+    return file_name+'.index'
+
+def _get_time_range(data, t_start, t_end):
+    """ get the part of topic data within a time range
+    :param data: dict of field name: numpy array
+    """
+    mask = np.ones(len(data['timestamp']), dtype=bool)
+    if t_start is not None:
+        mask &= data['timestamp'] >= t_start
+    if t_end is not None:
+        mask &= data['timestamp'] <= t_end
+    return {name: values[mask] for name, values in data.items()}
+
+def _rename_dtype_field(dtype, old_name, new_name):
+    """ get a copy of a structured dtype with a field renamed """
+    names = [new_name if name == old_name else name for name in dtype.names]
+    return np.dtype({'names': names,
+                     'formats': [dtype.fields[name][0] for name in dtype.names],
+                     'offsets': [dtype.fields[name][1] for name in dtype.names],
+                     'itemsize': dtype.itemsize})
+
+def _get_file_stamp(file_name):
+    """ get the (size, mtime) tuple used to detect changed log files """
+    stat = os.stat(file_name)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class LazyData(ULog.Data):
+    """ ULog.Data with data that is decoded on first access """
+
+    #pylint: disable=super-init-not-called,too-many-arguments
+    def __init__(self, ulog, name, multi_id, msg_id, field_data, timestamp_idx,
+                 dtype, offsets, sparse_timestamps, data=None):
+        """
+        :param ulog: LazyULog object used for decoding
+        :param dtype: numpy dtype of a message
+        :param offsets: numpy array with the file offsets of the messages
+        :param sparse_timestamps: numpy array with the timestamps of every
+                                  LazyULog.SPARSE_TIMESTAMP_INTERVAL-th message
+        :param data: already decoded data, or None
+        """
+        self.name = name
+        self.multi_id = multi_id
+        self.msg_id = msg_id
+        self.field_data = field_data
+        self.timestamp_idx = timestamp_idx
+        self.dtype = dtype
+        self.offsets = offsets
+        self.sparse_timestamps = sparse_timestamps
+        self._ulog = ulog
+        self._data = data
+
+    @property
+    def is_decoded(self):
+        """ check whether the data is already decoded """
+        return self._data is not None
+
+    @property
+    def data(self):
+        """ get the topic data as dict of field name: numpy array """
+        if self._data is None:
+            return self._ulog.decode(self)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def rename_field(self, old_name, new_name):
+        """ rename a field (e.g. for compatibility with older logs). Has no
+        effect if the topic has no field old_name. Must be called before the
+        dataset is shared with other threads.
+        """
+        if old_name in self.dtype.names:
+            self.dtype = _rename_dtype_field(self.dtype, old_name, new_name)
+        if self._data is not None and old_name in self._data:
+            self._data[new_name] = self._data.pop(old_name)
+
+    def get_range(self, t_start, t_end):
+        """ get a copy of this dataset that only contains the data within a
+        time range
+        :param t_start, t_end: time range [us], None for an open range
+        :return: LazyData object
+        """
+        if self.is_decoded:
+            data = _get_time_range(self._data, t_start, t_end)
+        else:
+            data = self._ulog.decode_range(self, t_start, t_end)
+        return LazyData(None, self.name, self.multi_id, self.msg_id,
+                        self.field_data, self.timestamp_idx, self.dtype,
+                        None, None, data)
+
+    def __getstate__(self):
+        # make sure copies (copy.deepcopy, pickle) do not depend on the ulog
+        state = self.__dict__.copy()
+        state['_data'] = self.data
+        state['_ulog'] = None
+        return state
+
+
+class DerivedData(ULog.Data):
+    """ ULog.Data of a virtual topic that is computed from other topics on
+    first access """
+
+    #pylint: disable=super-init-not-called,too-many-arguments
+    def __init__(self, name, multi_id, msg_id, field_data, timestamp_idx, compute):
+        """
+        :param compute: function without arguments that returns the topic data
+                        as dict of field name: numpy array
+        """
+        self.name = name
+        self.multi_id = multi_id
+        self.msg_id = msg_id
+        self.field_data = field_data
+        self.timestamp_idx = timestamp_idx
+        self._compute = compute
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_decoded(self):
+        """ check whether the data is already computed """
+        return self._data is not None
+
+    @property
+    def data(self):
+        """ get the topic data as dict of field name: numpy array """
+        with self._lock:
+            if self._data is None:
+                self._data = self._compute()
+            return self._data
+
+    def get_range(self, t_start, t_end):
+        """ get a copy of this dataset that only contains the data within a
+        time range
+        :param t_start, t_end: time range [us], None for an open range
+        :return: LazyData object
+        """
+        return LazyData(None, self.name, self.multi_id, self.msg_id,
+                        self.field_data, self.timestamp_idx, None,
+                        None, None, _get_time_range(self.data, t_start, t_end))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = self.data
+        state['_compute'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
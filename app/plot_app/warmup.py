@@ -0,0 +1,74 @@
+""" Background warm-up of the caches for newly uploaded logs (run as a job of
+the job queue) """
+
+from helper import load_ulog_file, get_log_filename, decode_ulog_topics, \
+    add_roll_pitch_yaw, get_flight_mode_changes, get_vtol_states, \
+    is_ulog_file_decoded, get_minmax_pyramid
+from job_queue import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, \
+    PRIORITY_LOW, register_job_type, enqueue_job, get_job_state
+
+# warm-up job states
+WARMUP_QUEUED = JOB_QUEUED
+WARMUP_RUNNING = JOB_RUNNING
+WARMUP_DONE = JOB_DONE
+WARMUP_FAILED = JOB_FAILED
+
+WARMUP_JOB_TYPE = 'warmup'
+
+__steps = {} # key: step name, value: function(log_id)
+
+
+def register_warmup_step(name, func):
+    """ register an additional step of warm-up jobs
+    :param func: function that is called with the log id, after the caches are
+                 warm (e.g. to generate DB entries)
+    """
+    __steps[name] = func
+
+def start_warmup_job(log_id, steps=(), cur=None, priority=PRIORITY_LOW):
+    """ warm up the caches of a log in the background: decode all topics
+    (stored in the persistent cache) and compute the derived data.
+    :param steps: names of additional steps (see register_warmup_step())
+    :param cur: DB cursor (see job_queue.enqueue_job())
+    :return: False if a job for the log exists already
+    """
+    return enqueue_job(log_id, WARMUP_JOB_TYPE, {'steps': list(steps)},
+                       priority=priority, unique=True, cur=cur) is not None
+
+def get_warmup_state(log_id):
+    """ get the state of the warm-up job of a log
+    :return: one of WARMUP_* or None if there is no job
+    """
+    return get_job_state(log_id, WARMUP_JOB_TYPE)
+
+def has_warm_cache(log_id):
+    """ check whether the caches of a log are warm (all topics decoded), either
+    by a warm-up job or a previous page request (also by another process) """
+    state = get_warmup_state(log_id)
+    if state == WARMUP_DONE:
+        return True
+    if state in (WARMUP_QUEUED, WARMUP_RUNNING):
+        return False
+    return is_ulog_file_decoded(get_log_filename(log_id))
+
+__MINMAX_PYRAMID_MIN_SAMPLES = 5000
+
+def _run_warmup_job(log_id, steps):
+    """ execute a warm-up job """
+    ulog = load_ulog_file(get_log_filename(log_id))
+    decode_ulog_topics(ulog)
+    for dataset in ulog.data_list:
+        dataset.data # pylint: disable=pointless-statement
+    add_roll_pitch_yaw(ulog)
+    get_flight_mode_changes(ulog)
+    get_vtol_states(ulog)
+    for dataset in ulog.data_list:
+        # smaller topics are not downsampled
+        if len(dataset.data['timestamp']) > __MINMAX_PYRAMID_MIN_SAMPLES:
+            get_minmax_pyramid(dataset, [
+                field_name for field_name, values in dataset.data.items()
+                if field_name != 'timestamp' and values.dtype.kind in 'biuf'])
+    for step in steps:
+        __steps[step](log_id)
+
+register_job_type(WARMUP_JOB_TYPE, _run_warmup_job, max_attempts=2)
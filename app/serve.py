@@ -17,16 +17,20 @@ from bokeh.application.handlers import DirectoryHandler
 
 # this is needed for the following imports
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
-from tornado.web import StaticFileHandler
 from tornado.web import RedirectHandler
 from tornado_handlers.download import DownloadHandler
 from tornado_handlers.upload import UploadHandler
+from tornado_handlers.bulk_upload import BulkUploadHandler
+from tornado_handlers.resumable_upload import ResumableUploadHandler, \
+    expire_partial_uploads
 from tornado_handlers.browse import BrowseHandler, BrowseDataRetrievalHandler
 from tornado_handlers.edit_entry import EditEntryHandler
 from tornado_handlers.db_info_json import DBInfoHandler
+from tornado_handlers.job_status import JobStatusHandler
 from tornado_handlers.three_d import ThreeDHandler
 from tornado_handlers.radio_controller import RadioControllerHandler
 from tornado_handlers.error_labels import UpdateErrorLabelHandler
+from tornado_handlers.common import ShardedStaticFileHandler
 try:
     from tornado_handlers.llm_agent import LLMAnalysisHandler, LLMChatHandler, LLMStatusHandler
     llm_available = True
@@ -42,7 +46,10 @@ except Exception as e:
         pass
 
 from helper import set_log_id_is_filename, print_cache_info #pylint: disable=C0411
+from helper import start_decode_workers #pylint: disable=C0411
 from config import debug_print_timing, get_overview_img_filepath #pylint: disable=C0411
+from job_queue import start_job_workers #pylint: disable=C0411
+from downsampling import print_zoom_stats #pylint: disable=C0411
 
 #pylint: disable=invalid-name
 
@@ -127,6 +134,8 @@ set_log_id_is_filename(show_ulog_file)
 # additional request handlers
 extra_patterns = [
     (r'/upload', UploadHandler),
+    (r'/bulk_upload', BulkUploadHandler),
+    (r'/upload_resumable/?([0-9a-f]*)', ResumableUploadHandler),
     (r'/browse', BrowseHandler),
     (r'/browse_data_retrieval', BrowseDataRetrievalHandler),
     (r'/3d', ThreeDHandler),
@@ -135,9 +144,10 @@ extra_patterns = [
     (r'/?', UploadHandler), #root should point to upload
     (r'/download', DownloadHandler),
     (r'/dbinfo', DBInfoHandler),
+    (r'/job_status', JobStatusHandler),
     (r'/error_label', UpdateErrorLabelHandler),
     (r"/stats", RedirectHandler, {"url": "/plot_app?stats=1"}),
-    (r'/overview_img/(.*)', StaticFileHandler, {'path': get_overview_img_filepath()}),
+    (r'/overview_img/(.*)', ShardedStaticFileHandler, {'path': get_overview_img_filepath()}),
 ]
 
 # LLM Agent API endpoints (only if available)
@@ -165,6 +175,20 @@ while server is None:
         else:
             raise
 
+# fork the topic decoding processes (in every worker process), before the
+# background job threads are started
+start_decode_workers()
+
+if not show_ulog_file:
+    # run the background jobs (in every worker process)
+    server.io_loop.add_callback(start_job_workers)
+
+    def expire_uploads():
+        """ remove expired incomplete uploads once per hour """
+        expire_partial_uploads()
+        server.io_loop.call_later(60*60, expire_uploads)
+    server.io_loop.add_callback(expire_uploads)
+
 if args.show:
     # we have to defer opening in browser until we start up the server
     def show_callback():
@@ -183,8 +207,9 @@ if args.show:
 
 if debug_print_timing():
     def print_statistics():
-        """ print ulog cache info once per hour """
+        """ print ulog cache and zoom info once per hour """
         print_cache_info()
+        print_zoom_stats()
         server.io_loop.call_later(60*60, print_statistics)
     server.io_loop.call_later(60, print_statistics)
 
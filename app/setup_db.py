@@ -9,7 +9,8 @@ import os
 # this is needed for the following imports
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
 from plot_app.config import get_db_filename, get_log_filepath, \
-    get_cache_filepath, get_kml_filepath, get_overview_img_filepath
+    get_cache_filepath, get_kml_filepath, get_overview_img_filepath, \
+    get_ulog_cache_filepath, get_upload_filepath
 
 log_dir = get_log_filepath()
 if not os.path.exists(log_dir):
@@ -31,6 +32,16 @@ if not os.path.exists(cur_dir):
     print('creating overview image directory '+cur_dir)
     os.makedirs(cur_dir)
 
+cur_dir = get_ulog_cache_filepath()
+if not os.path.exists(cur_dir):
+    print('creating ulog cache directory '+cur_dir)
+    os.makedirs(cur_dir)
+
+cur_dir = get_upload_filepath()
+if not os.path.exists(cur_dir):
+    print('creating upload directory '+cur_dir)
+    os.makedirs(cur_dir)
+
 print('creating DB at '+get_db_filename())
 con = lite.connect(get_db_filename())
 with con:
@@ -59,6 +70,7 @@ with con:
                 "ErrorLabels TEXT, " # the type of error (if any) that occurred during flight
                 "Public INT, " # if 1 this log can be publicly listed
                 "Token TEXT, " # Security token (currently used to delete the entry)
+                "Sha256 TEXT, " # SHA-256 of the log file content (to detect duplicates)
                 "CONSTRAINT Id_PK PRIMARY KEY (Id))")
     else:
         # try to upgrade
@@ -90,6 +102,11 @@ with con:
         if not 'Token' in column_names:
             print('Adding column Token')
             cur.execute("ALTER TABLE Logs ADD COLUMN Token TEXT DEFAULT ''")
+        if not 'Sha256' in column_names:
+            print('Adding column Sha256')
+            cur.execute("ALTER TABLE Logs ADD COLUMN Sha256 TEXT DEFAULT ''")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS Logs_Sha256 ON Logs(Sha256)")
 
 
     # LogsGenerated table (information from the log file, for faster access)
@@ -144,5 +161,28 @@ with con:
                 "FlightTime INTEGER, " # latest flight time in seconds
                 "CONSTRAINT UUID_PK PRIMARY KEY (UUID))")
 
+
+    # Jobs table (background jobs, see plot_app/job_queue.py)
+    cur.execute("PRAGMA table_info('Jobs')")
+    columns = cur.fetchall()
+
+    if len(columns) == 0:
+        cur.execute("CREATE TABLE Jobs("
+                "Id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "LogId TEXT, " # log id the job belongs to
+                "Type TEXT, " # job type (registered function)
+                "Args TEXT, " # JSON encoded keyword arguments (cleared when finished)
+                "Priority INT, " # higher priority jobs run first
+                "State TEXT, " # 'queued', 'running', 'done' or 'failed'
+                "Attempts INT, " # number of started runs
+                "NotBefore REAL, " # earliest start time (for retries)
+                "Created REAL, " # creation time (seconds since epoch)
+                "Updated REAL, " # time of the last state change
+                "Worker INT, " # process id of the worker running it
+                "Error TEXT)") # error message of the last failed run
+
+    cur.execute("CREATE INDEX IF NOT EXISTS Jobs_Queue ON Jobs(State, Priority, Id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS Jobs_LogId ON Jobs(LogId)")
+
 con.close()
 
@@ -0,0 +1,7 @@
+""" pytest configuration: make the app modules importable """
+import os
+import sys
+
+_app_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.append(_app_dir)
+sys.path.append(os.path.join(_app_dir, 'plot_app'))
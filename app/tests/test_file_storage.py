@@ -0,0 +1,60 @@
+""" Tests for the deduplicated log file storage (file_storage.py) """
+import os
+
+import pytest
+
+from file_storage import compress_stored_log_file, store_log_file
+from log_storage import is_compressed_log_file, open_log_file
+
+#pylint: disable=missing-function-docstring
+
+LOG_DATA = b'ULog\x01\x12\x35\x01' + bytes(range(256)) * 100
+
+
+@pytest.fixture(name='log_path')
+def fixture_log_path(tmp_path):
+    return str(tmp_path)
+
+
+def _store(log_path, name):
+    file_name = os.path.join(log_path, name)
+    with open(file_name, 'wb') as file_handle:
+        file_handle.write(LOG_DATA)
+    return file_name, store_log_file(log_path, file_name)
+
+
+def _read(file_name):
+    with open_log_file(file_name) as file_handle:
+        return file_handle.read()
+
+
+def test_compress_stored_duplicates(log_path):
+    file_name, is_duplicate = _store(log_path, 'a.ulg')
+    assert not is_duplicate
+    duplicate_file_name, is_duplicate = _store(log_path, 'b.ulg')
+    assert is_duplicate
+    assert os.path.samefile(file_name, duplicate_file_name)
+
+    assert compress_stored_log_file(log_path, file_name)
+    assert is_compressed_log_file(file_name)
+    assert _read(file_name) == LOG_DATA
+    # the identical log is relinked when it is processed
+    assert not is_compressed_log_file(duplicate_file_name)
+    assert compress_stored_log_file(log_path, duplicate_file_name)
+    assert os.path.samefile(file_name, duplicate_file_name)
+    assert _read(duplicate_file_name) == LOG_DATA
+
+    # a new identical log gets the compressed file
+    new_file_name, is_duplicate = _store(log_path, 'c.ulg')
+    assert is_duplicate
+    assert is_compressed_log_file(new_file_name)
+    assert not compress_stored_log_file(log_path, new_file_name)
+
+
+def test_compress_file_not_in_content_store(log_path):
+    file_name = os.path.join(log_path, 'a.ulg')
+    with open(file_name, 'wb') as file_handle:
+        file_handle.write(LOG_DATA)
+
+    assert compress_stored_log_file(log_path, file_name)
+    assert _read(file_name) == LOG_DATA
@@ -0,0 +1,85 @@
+""" Tests for the compressed log storage (log_storage.py) """
+import io
+import os
+
+import numpy as np
+import pytest
+
+from log_storage import SeekableZstdFile, compress_log_file, get_log_file_size, \
+    is_compressed_log_file, open_log_file
+
+#pylint: disable=missing-function-docstring
+
+FRAME_SIZE = 1000
+
+
+@pytest.fixture(name='log_data')
+def fixture_log_data():
+    # compressible, but different in every frame
+    rng = np.random.default_rng(0)
+    return bytes(rng.integers(0, 16, size=FRAME_SIZE * 5 + 123, dtype=np.uint8))
+
+
+def _write(tmp_path, name, data):
+    file_name = str(tmp_path / name)
+    with open(file_name, 'wb') as file_handle:
+        file_handle.write(data)
+    return file_name
+
+
+def test_raw_file_is_opened_directly(tmp_path, log_data):
+    file_name = _write(tmp_path, 'raw.ulg', log_data)
+
+    assert not is_compressed_log_file(file_name)
+    assert get_log_file_size(file_name) == len(log_data)
+    with open_log_file(file_name) as file_handle:
+        assert not isinstance(file_handle, SeekableZstdFile)
+        assert file_handle.read() == log_data
+
+
+def test_compress_round_trip(tmp_path, log_data):
+    file_name = _write(tmp_path, 'log.ulg', log_data)
+
+    assert compress_log_file(file_name, frame_size=FRAME_SIZE)
+    assert is_compressed_log_file(file_name)
+    assert os.path.getsize(file_name) < len(log_data)
+    # already compressed
+    assert not compress_log_file(file_name, frame_size=FRAME_SIZE)
+    assert get_log_file_size(file_name) == len(log_data)
+    with open_log_file(file_name) as file_handle:
+        assert isinstance(file_handle, SeekableZstdFile)
+        assert file_handle.read() == log_data
+
+
+def test_seek_and_read_across_frames(tmp_path, log_data):
+    file_name = _write(tmp_path, 'log.ulg', log_data)
+    compress_log_file(file_name, frame_size=FRAME_SIZE)
+    rng = np.random.default_rng(1)
+
+    with open_log_file(file_name) as file_handle:
+        # reads ending exactly at, starting at and spanning frame boundaries
+        offsets = [0, FRAME_SIZE - 1, FRAME_SIZE, 2 * FRAME_SIZE - 10, len(log_data) - 5] + \
+            list(rng.integers(0, len(log_data), size=50))
+        for offset in offsets:
+            num_bytes = int(rng.integers(1, 3 * FRAME_SIZE))
+            assert file_handle.seek(int(offset)) == offset
+            assert file_handle.read(num_bytes) == log_data[offset:offset + num_bytes]
+            assert file_handle.tell() == min(offset + num_bytes, len(log_data))
+
+        file_handle.seek(-10, io.SEEK_END)
+        assert file_handle.read() == log_data[-10:]
+        assert file_handle.read(10) == b''
+        file_handle.seek(FRAME_SIZE)
+        file_handle.seek(5, io.SEEK_CUR)
+        assert file_handle.read(FRAME_SIZE) == log_data[FRAME_SIZE + 5:2 * FRAME_SIZE + 5]
+        with pytest.raises(ValueError):
+            file_handle.seek(-1)
+
+
+def test_empty_file(tmp_path):
+    file_name = _write(tmp_path, 'empty.ulg', b'')
+    assert compress_log_file(file_name, frame_size=FRAME_SIZE)
+    assert is_compressed_log_file(file_name)
+    assert get_log_file_size(file_name) == 0
+    with open_log_file(file_name) as file_handle:
+        assert file_handle.read() == b''
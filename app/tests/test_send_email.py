@@ -0,0 +1,135 @@
+""" Tests for the email sender thread (tornado_handlers.send_email) """
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tornado_handlers import send_email
+
+#pylint: disable=missing-function-docstring, unused-argument
+
+NUM_THREADS = 10
+
+
+class _FakeSMTP:
+    """ stand-in for smtplib.SMTP_SSL that records the connections and emails """
+
+    lock = threading.Lock()
+    connections = []
+    sent = [] # (connection, destination)
+    # number of the next sendmail() calls that fail with a lost connection
+    num_disconnects = 0
+    num_noops = 0
+    # if set, sendmail() waits until this function returns True
+    wait_until = None
+
+    def __init__(self, host, timeout):
+        self.logged_in = False
+        with self.lock:
+            self.connections.append(self)
+
+    def set_debuglevel(self, level):
+        pass
+
+    def login(self, user, password):
+        self.logged_in = True
+
+    def noop(self):
+        with self.lock:
+            _FakeSMTP.num_noops += 1
+        return (250, b'OK')
+
+    def sendmail(self, sender, destination, msg):
+        assert self.logged_in
+        while _FakeSMTP.wait_until is not None and not _FakeSMTP.wait_until():
+            time.sleep(0.001)
+        with self.lock:
+            if _FakeSMTP.num_disconnects > 0:
+                _FakeSMTP.num_disconnects -= 1
+                raise smtplib.SMTPServerDisconnected('connection lost')
+        if 'refused@example.com' in destination:
+            raise smtplib.SMTPRecipientsRefused({'refused@example.com': (550, b'unknown')})
+        with self.lock:
+            self.sent.append((self, destination))
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(name='fake_smtp')
+def fixture_fake_smtp(monkeypatch):
+    monkeypatch.setattr(send_email, 'SMTP', _FakeSMTP)
+    monkeypatch.setattr(send_email, '__RETRY_DELAY', 0)
+    # use a new sender thread, without the connection of a previous test
+    monkeypatch.setattr(send_email, '__queue', queue.Queue())
+    monkeypatch.setattr(send_email, '__sender_thread', None)
+    monkeypatch.setattr(_FakeSMTP, 'connections', [])
+    monkeypatch.setattr(_FakeSMTP, 'sent', [])
+    monkeypatch.setattr(_FakeSMTP, 'num_disconnects', 0)
+    monkeypatch.setattr(_FakeSMTP, 'num_noops', 0)
+    monkeypatch.setattr(_FakeSMTP, 'wait_until', None)
+    return _FakeSMTP
+
+
+def _send_concurrently(num_emails):
+    """ send num_emails emails from as many threads at the same time """
+    barrier = threading.Barrier(num_emails)
+
+    def send(i):
+        barrier.wait()
+        #pylint: disable=protected-access
+        return send_email._send_email(['user{:}@example.com'.format(i)], 'subject', 'content')
+
+    with ThreadPoolExecutor(max_workers=num_emails) as executor:
+        return list(executor.map(send, range(num_emails)))
+
+
+def test_emails_share_one_connection(fake_smtp):
+    results = _send_concurrently(NUM_THREADS)
+
+    assert all(results)
+    assert len(fake_smtp.connections) == 1
+    assert sorted(destination[0] for _, destination in fake_smtp.sent) == \
+        sorted('user{:}@example.com'.format(i) for i in range(NUM_THREADS))
+
+
+def test_queued_emails_are_sent_in_one_batch(fake_smtp):
+    # the first email is sent only when all the others are queued
+    #pylint: disable=protected-access
+    fake_smtp.wait_until = lambda: send_email.__queue.qsize() == NUM_THREADS - 1
+
+    results = _send_concurrently(NUM_THREADS)
+
+    assert all(results)
+    assert len(fake_smtp.connections) == 1
+    assert len(fake_smtp.sent) == NUM_THREADS
+    # the connection is checked once for the batch of the remaining emails
+    assert fake_smtp.num_noops == 1
+
+
+def test_lost_connection_reconnects(fake_smtp):
+    fake_smtp.num_disconnects = 1
+
+    results = _send_concurrently(NUM_THREADS)
+
+    assert all(results)
+    assert len(fake_smtp.connections) == 2
+    assert len(fake_smtp.sent) == NUM_THREADS
+    # all emails after the reconnect use the new connection
+    assert all(connection is fake_smtp.connections[1] for connection, _ in fake_smtp.sent)
+
+
+def test_refused_email_is_not_retried(fake_smtp):
+    #pylint: disable=protected-access
+    assert not send_email._send_email(['refused@example.com'], 'subject', 'content')
+    assert len(fake_smtp.connections) == 1
+    assert not fake_smtp.sent
+    # the connection is still usable
+    assert send_email._send_email(['user@example.com'], 'subject', 'content')
+    assert len(fake_smtp.connections) == 1
@@ -0,0 +1,52 @@
+""" Tests for the ULog caches (ulog_cache.py) """
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from ulog_cache import ULogDiskCache, ULogMemoryCache
+
+#pylint: disable=missing-function-docstring
+
+
+def test_lock_removes_lock_file(tmp_path):
+    cache = ULogDiskCache(str(tmp_path))
+    with cache.lock('0123abcd'):
+        assert os.path.exists(os.path.join(str(tmp_path), '01', '23', '0123abcd.lock'))
+    assert not os.path.exists(os.path.join(str(tmp_path), '01', '23', '0123abcd.lock'))
+
+
+def test_lock_without_writable_cache_dir(tmp_path):
+    # the cache directory cannot be created (its parent is a file)
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_bytes(b'')
+    cache = ULogDiskCache(str(not_a_dir / 'cache'))
+    entered = False
+    with cache.lock('0123abcd'):
+        entered = True
+    assert entered
+
+
+def _make_ulog(nbytes):
+    dataset = SimpleNamespace(data={'x': np.zeros(nbytes, dtype=np.uint8)})
+    return SimpleNamespace(data_list=[dataset])
+
+
+def test_memory_cache_update_evicts_grown_logs():
+    cache = ULogMemoryCache(1000)
+    ulog_a = _make_ulog(400)
+    cache.put('a', ulog_a)
+    cache.put('b', _make_ulog(400))
+    assert cache.info().resident_bytes == 800
+
+    # a topic of 'a' got decoded after it was added
+    ulog_a.data_list.append(SimpleNamespace(data={'y': np.zeros(500, dtype=np.uint8)}))
+    cache.update('a')
+    info = cache.info()
+    assert info.resident_bytes == 900
+    assert info.evictions == 1
+    assert cache.get('a') is ulog_a
+    assert cache.get('b') is None
+
+    cache.update('b') # not cached: ignored
+    assert cache.info().num_entries == 1
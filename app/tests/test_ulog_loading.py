@@ -0,0 +1,73 @@
+""" Tests for the deduplicated loading of ULog files (helper.load_ulog_file) """
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import helper
+
+#pylint: disable=missing-function-docstring
+
+NUM_THREADS = 8
+
+
+class _CountingLoader:
+    """ stand-in for helper._load_ulog_file that counts the parses """
+
+    def __init__(self, error=None):
+        self.num_calls = 0
+        self._lock = threading.Lock()
+        self._error = error
+
+    def __call__(self, file_name):
+        with self._lock:
+            self.num_calls += 1
+        # keep the load in progress while the other threads arrive
+        time.sleep(0.2)
+        if self._error is not None:
+            raise self._error
+        return SimpleNamespace(file_name=file_name, data_list=[])
+
+
+def _load_concurrently(file_name):
+    """ call load_ulog_file from NUM_THREADS threads at the same time """
+    barrier = threading.Barrier(NUM_THREADS)
+
+    def load():
+        barrier.wait()
+        return helper.load_ulog_file(file_name)
+
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+        futures = [executor.submit(load) for _ in range(NUM_THREADS)]
+        return [future.exception() or future.result() for future in futures]
+
+
+def test_concurrent_loads_parse_once(monkeypatch, tmp_path):
+    loader = _CountingLoader()
+    monkeypatch.setattr(helper, '_load_ulog_file', loader)
+    file_name = str(tmp_path / 'concurrent.ulg')
+
+    results = _load_concurrently(file_name)
+
+    assert loader.num_calls == 1
+    assert all(result is results[0] for result in results)
+    # later calls are served from the memory cache
+    assert helper.load_ulog_file(file_name) is results[0]
+    assert loader.num_calls == 1
+
+
+def test_concurrent_loads_share_error(monkeypatch, tmp_path):
+    loader = _CountingLoader(error=FileNotFoundError('missing'))
+    monkeypatch.setattr(helper, '_load_ulog_file', loader)
+    file_name = str(tmp_path / 'missing.ulg')
+
+    results = _load_concurrently(file_name)
+
+    assert loader.num_calls == 1
+    assert all(isinstance(result, FileNotFoundError) for result in results)
+    # a failed load is not cached
+    with pytest.raises(FileNotFoundError):
+        helper.load_ulog_file(file_name)
+    assert loader.num_calls == 2
@@ -12,9 +12,10 @@ import tornado.web
 
 # this is needed for the following imports
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
-from config import get_db_filename, get_overview_img_filepath
+from config import get_db_filename
 from db_entry import DBData, DBDataGenerated
-from helper import flight_modes_table, get_airframe_data, html_long_word_force_break
+from helper import flight_modes_table, get_airframe_data, html_long_word_force_break, \
+    get_overview_img_filename
 
 #pylint: disable=relative-beyond-top-level,too-many-statements
 from .common import get_jinja_env, get_generated_db_data_from_log
@@ -76,7 +77,7 @@ class BrowseDataRetrievalHandler(tornado.web.RequestHandler):
         # pylint: disable=invalid-name
         Columns = collections.namedtuple("Columns", "columns search_only_columns")
 
-        def get_columns_from_tuple(db_tuple, counter, all_overview_imgs):
+        def get_columns_from_tuple(db_tuple, counter):
             """ load the columns (list of strings) from a db_tuple
             """
 
@@ -164,8 +165,7 @@ class BrowseDataRetrievalHandler(tornado.web.RequestHandler):
                 search_only_columns.append(db_data.vehicle_uuid)
 
             image_col = '<div class="no_map_overview"> Not rendered / No GPS </div>'
-            overview_image_filename = log_id+'.png'
-            if overview_image_filename in all_overview_imgs:
+            if os.path.exists(get_overview_img_filename(log_id)):
                 image_col = '<img class="map_overview" src="/overview_img/'
                 image_col += log_id+'.png" alt="Overview Image Load Failed" height=50/>'
 
@@ -194,14 +194,13 @@ class BrowseDataRetrievalHandler(tornado.web.RequestHandler):
             data_length = len(db_tuples)
 
         filtered_counter = 0
-        all_overview_imgs = set(os.listdir(get_overview_img_filepath()))
         if search_str == '':
             # speed-up the request by iterating only over the requested items
             counter = data_start
             for i in range(data_start, min(data_start + data_length, len(db_tuples))):
                 counter += 1
 
-                columns = get_columns_from_tuple(db_tuples[i], counter, all_overview_imgs)
+                columns = get_columns_from_tuple(db_tuples[i], counter)
                 if columns is None:
                     continue
 
@@ -212,7 +211,7 @@ class BrowseDataRetrievalHandler(tornado.web.RequestHandler):
             for db_tuple in db_tuples:
                 counter += 1
 
-                columns = get_columns_from_tuple(db_tuple, counter, all_overview_imgs)
+                columns = get_columns_from_tuple(db_tuple, counter)
                 if columns is None:
                     continue
 
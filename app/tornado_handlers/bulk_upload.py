@@ -0,0 +1,324 @@
+"""
+Tornado handler for bulk uploads: many logs in one request (e.g. from a fleet
+pipeline), as multiple files of a multipart request and/or as tar/zip archives
+"""
+from __future__ import print_function
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import binascii
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tarfile
+import tempfile
+from timeit import default_timer as timer
+import zipfile
+import tornado.web
+from tornado.ioloop import IOLoop
+
+from pyulog import ULog
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
+from config import get_db_filename, get_http_protocol, get_domain_name
+from job_queue import PRIORITY_BULK, enqueue_job, notify_job_workers
+
+#pylint: disable=relative-beyond-top-level
+from .common import CustomHTTPError, copy_generated_db_data, TornadoRequestHandlerBase
+from .multipart_streamer import MultiPartStreamer
+from .upload import PROCESS_UPLOAD_JOB_TYPE, generate_unique_log_filename, \
+    store_uploaded_log_file
+
+#pylint: disable=attribute-defined-outside-init,unused-argument
+
+
+# number of logs that are added to the DB in one transaction
+BATCH_SIZE = 100
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+# a log file to ingest (sha256 is None if it is not known yet)
+LogFile = namedtuple('LogFile', ['name', 'file_name', 'sha256'])
+
+
+def _copy_file(input_file, output_file_name):
+    """ copy a file object to a new file
+    :return: SHA-256 of the data
+    """
+    digest = hashlib.sha256()
+    with open(output_file_name, 'wb') as output_file:
+        while True:
+            data = input_file.read(1024 * 1024)
+            if not data:
+                break
+            output_file.write(data)
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def extract_log_files(archive_file_name, archive_name, output_dir):
+    """
+    Extract the log files (.ulg) of a tar or zip archive, one by one
+    :param archive_name: name of the archive (to report the file names)
+    :param output_dir: directory for the extracted files
+    :return: list of LogFile
+    """
+    log_files = []
+    def add_file(name, input_file):
+        file_name = os.path.join(output_dir, str(len(log_files))+'.ulg')
+        sha256 = _copy_file(input_file, file_name)
+        log_files.append(LogFile(archive_name+'/'+name, file_name, sha256))
+
+    if zipfile.is_zipfile(archive_file_name):
+        with zipfile.ZipFile(archive_file_name) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith('.ulg'):
+                    with archive.open(info) as input_file:
+                        add_file(info.filename, input_file)
+    else:
+        # streaming mode: the members are read sequentially
+        with tarfile.open(archive_file_name, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith('.ulg'):
+                    with archive.extractfile(member) as input_file:
+                        add_file(member.name, input_file)
+    return log_files
+
+
+def _get_file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file_handle:
+        while True:
+            data = file_handle.read(1024 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _store_log_file(log_file, keep_files):
+    """
+    Validate a log file and move it into the log storage
+    :param keep_files: copy instead of move the file
+    :return: dict with the result (see ingest_log_files)
+    """
+    result = {'name': log_file.name}
+    try:
+        with open(log_file.file_name, 'rb') as file_handle:
+            if file_handle.read(len(ULog.HEADER_BYTES)) != ULog.HEADER_BYTES:
+                result.update(status='invalid', error='Invalid File')
+                return result
+        # check the header and definitions section
+        ULog(log_file.file_name, parse_header_only=True)
+    except Exception as e:
+        result.update(status='invalid', error='Invalid File: '+str(e))
+        return result
+
+    try:
+        sha256 = log_file.sha256
+        if sha256 is None:
+            sha256 = _get_file_sha256(log_file.file_name)
+        log_id, new_file_name = generate_unique_log_filename()
+        if keep_files:
+            shutil.copyfile(log_file.file_name, new_file_name)
+        else:
+            shutil.move(log_file.file_name, new_file_name)
+        duplicate_log_id = store_uploaded_log_file(log_id, new_file_name, sha256)
+    except Exception as e:
+        print('Failed to store', log_file.name, e)
+        result.update(status='error', error=str(e))
+        return result
+
+    result.update(status='ok' if duplicate_log_id is None else 'duplicate',
+                  log_id=log_id, sha256=sha256, duplicate_log_id=duplicate_log_id,
+                  size=os.path.getsize(new_file_name))
+    return result
+
+
+def _add_db_entries(results, source, description, allow_for_analysis):
+    """
+    Add the Logs entries and the processing jobs of stored logs in one
+    transaction
+    :param results: results of _store_log_file() (updated with the urls)
+    """
+    con = sqlite3.connect(get_db_filename())
+    cur = con.cursor()
+    now = datetime.datetime.now()
+    for result in results:
+        result['token'] = str(binascii.hexlify(os.urandom(16)), 'ascii')
+        url = '/plot_app?log='+result['log_id']
+        result['url'] = get_http_protocol()+'://'+get_domain_name()+url
+        result['delete_url'] = get_http_protocol()+'://'+get_domain_name()+ \
+            '/edit_entry?action=delete&log='+result['log_id']+'&token='+result['token']
+    cur.executemany(
+        'insert into Logs (Id, Title, Description, '
+        'OriginalFilename, Date, AllowForAnalysis, Obfuscated, '
+        'Source, Email, WindSpeed, Rating, Feedback, Type, '
+        'videoUrl, ErrorLabels, Public, Token, Sha256) values '
+        '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [[result['log_id'], '', description, os.path.basename(result['name']),
+          now, allow_for_analysis, 0, source, '', -1, '', '', 'personal',
+          '', '', 0, result['token'], result['sha256']] for result in results])
+
+    # processing jobs: they start the warm-up jobs when they are done, which
+    # are added after all processing jobs of the batch (same priority)
+    for result in results:
+        steps = None
+        if source != 'CI':
+            steps = ['generate_db_data']
+            if result['duplicate_log_id'] is not None and \
+                    copy_generated_db_data(result['duplicate_log_id'], result['log_id'], cur):
+                steps = []
+        enqueue_job(result['log_id'], PROCESS_UPLOAD_JOB_TYPE,
+                    {'vehicle_name': '', 'update_vehicle': source != 'CI',
+                     'sha256': result['sha256'], 'warmup_steps': steps,
+                     'warmup_priority': PRIORITY_BULK},
+                    priority=PRIORITY_BULK, cur=cur)
+
+    con.commit()
+    cur.close()
+    con.close()
+    notify_job_workers()
+
+
+def ingest_log_files(log_files, source='bulk', description='', allow_for_analysis=0,
+                     keep_files=False, num_workers=None):
+    """
+    Add many logs at once: the files are validated and stored in parallel, the
+    DB entries are added in batched transactions and the processing jobs are
+    queued with a lower priority than single uploads.
+    :param log_files: list of LogFile
+    :param keep_files: copy the files instead of moving them
+    :param num_workers: number of threads for validating and storing the files
+    :return: tuple (list of dicts with the result per file, dict with
+             statistics). The status of a file is one of 'ok', 'duplicate'
+             (stored, but an identical log exists already), 'invalid' or
+             'error'.
+    """
+    start_time = timer()
+    results = []
+    stored_results = []
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as executor:
+        for result in executor.map(lambda log_file: _store_log_file(log_file, keep_files),
+                                   log_files):
+            results.append(result)
+            if 'log_id' in result:
+                stored_results.append(result)
+                if len(stored_results) >= BATCH_SIZE:
+                    _add_db_entries(stored_results, source, description, allow_for_analysis)
+                    stored_results = []
+    if len(stored_results) > 0:
+        _add_db_entries(stored_results, source, description, allow_for_analysis)
+
+    duration = timer() - start_time
+    total_bytes = sum(result.get('size', 0) for result in results)
+    stats = {
+        'num_files': len(results),
+        'num_stored': sum(1 for result in results if 'log_id' in result),
+        'num_duplicates': sum(1 for result in results if result['status'] == 'duplicate'),
+        'num_failed': sum(1 for result in results if 'log_id' not in result),
+        'total_bytes': total_bytes,
+        'duration_s': duration,
+        'throughput_mb_s': total_bytes / 1024**2 / duration if duration > 0 else 0,
+        }
+    return results, stats
+
+
+@tornado.web.stream_request_body
+class BulkUploadHandler(TornadoRequestHandlerBase):
+    """ Bulk upload Tornado request handler: accepts any number of log files
+    (.ulg) and tar/zip archives with log files in a multipart POST request, and
+    returns the result per file as JSON """
+
+    def initialize(self):
+        """ initialize the instance """
+        self.multipart_streamer = None
+
+    def prepare(self):
+        """ called before a new request """
+        if self.request.method.upper() == 'POST':
+            if 'expected_size' in self.request.arguments:
+                self.request.connection.set_max_body_size(
+                    int(self.get_argument('expected_size')))
+            try:
+                total = int(self.request.headers.get("Content-Length", "0"))
+            except KeyError:
+                total = 0
+            self.multipart_streamer = MultiPartStreamer(total)
+
+    def data_received(self, chunk):
+        """ called whenever new data is received """
+        if self.multipart_streamer:
+            self.multipart_streamer.data_received(chunk)
+
+    async def post(self, *args, **kwargs):
+        """ POST request callback """
+        if not self.multipart_streamer:
+            raise CustomHTTPError(400)
+        io_loop = IOLoop.current()
+        try:
+            self.multipart_streamer.data_complete()
+            form_data = self.multipart_streamer.get_values(
+                ['description', 'source', 'allowForAnalysis'])
+            description = ''
+            if 'description' in form_data:
+                description = tornado.escape.xhtml_escape(
+                    form_data['description'].decode("utf-8"))
+            source = 'bulk'
+            if 'source' in form_data:
+                source = form_data['source'].decode("utf-8")
+            allow_for_analysis = 0
+            if 'allowForAnalysis' in form_data:
+                if form_data['allowForAnalysis'].decode("utf-8") == 'true':
+                    allow_for_analysis = 1
+
+            file_parts = [part for part in self.multipart_streamer.parts
+                          if part.is_file()]
+            with tempfile.TemporaryDirectory() as temp_dir:
+                log_files = []
+                archive_results = []
+                for i, part in enumerate(file_parts):
+                    name = part.get_filename()
+                    part.f_out.close()
+                    if not name.lower().endswith(ARCHIVE_SUFFIXES):
+                        log_files.append(LogFile(name, part.f_out.name, part.get_sha256()))
+                        continue
+                    archive_dir = os.path.join(temp_dir, str(i))
+                    os.makedirs(archive_dir)
+                    try:
+                        log_files.extend(await io_loop.run_in_executor(
+                            None, extract_log_files, part.f_out.name, name, archive_dir))
+                    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+                        archive_results.append({'name': name, 'status': 'invalid',
+                                                'error': 'Invalid archive: '+str(e)})
+
+                results, stats = await io_loop.run_in_executor(
+                    None, lambda: ingest_log_files(log_files, source, description,
+                                                   allow_for_analysis))
+            results.extend(archive_results)
+            stats['num_files'] += len(archive_results)
+            stats['num_failed'] += len(archive_results)
+
+            print('Bulk upload: {:} logs stored, {:} failed, {:.1f} MB/s'.format(
+                stats['num_stored'], stats['num_failed'], stats['throughput_mb_s']))
+            self.set_header('Content-Type', 'application/json')
+            self.write(json.dumps(dict(stats, results=results)))
+
+        except CustomHTTPError:
+            raise
+
+        except Exception as e:
+            print('Error when handling bulk upload', sys.exc_info()[0],
+                  sys.exc_info()[1])
+            raise CustomHTTPError(500) from e
+
+        finally:
+            for part in self.multipart_streamer.parts:
+                # the files of the stored logs got moved
+                if part.is_file() and not os.path.exists(part.f_out.name):
+                    part.is_moved = True
+            self.multipart_streamer.release_parts()
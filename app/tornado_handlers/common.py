@@ -14,6 +14,7 @@ import tornado.web
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
 from db_entry import DBDataGenerated
 from config import get_db_filename
+from file_storage import resolve_filename
 
 #pylint: disable=abstract-method
 
@@ -25,6 +26,15 @@ def get_jinja_env():
     return _ENV
 
 
+class ShardedStaticFileHandler(tornado.web.StaticFileHandler):
+    """ StaticFileHandler for files in the sharded storage layout (see
+    file_storage.py): the URL only contains the file name (<id><suffix>) """
+
+    def parse_url_path(self, url_path):
+        file_id, suffix = os.path.splitext(url_path)
+        return os.path.relpath(resolve_filename(self.root, file_id, suffix), self.root)
+
+
 class CustomHTTPError(tornado.web.HTTPError):
     """ simple class for HTTP exceptions with a custom error message """
     def __init__(self, status_code, error_message=None):
@@ -96,6 +106,29 @@ def generate_db_data_from_log_file(log_id, db_connection=None):
     return db_data_gen
 
 
+def copy_generated_db_data(log_id, new_log_id, cur):
+    """
+    Copy the LogsGenerated entry of a log to another log with the same content
+    (instead of generating it from the log file)
+    :param cur: db cursor
+    :return: True if the entry existed and got copied
+    """
+    try:
+        cur.execute(
+            'insert into LogsGenerated (Id, Duration, '
+            'Mavtype, Estimator, AutostartId, Hardware, '
+            'Software, NumLoggedErrors, NumLoggedWarnings, '
+            'FlightModes, SoftwareVersion, UUID, FlightModeDurations, StartTime) '
+            'select ?, Duration, '
+            'Mavtype, Estimator, AutostartId, Hardware, '
+            'Software, NumLoggedErrors, NumLoggedWarnings, '
+            'FlightModes, SoftwareVersion, UUID, FlightModeDurations, StartTime '
+            'from LogsGenerated where Id = ?', [new_log_id, log_id])
+    except sqlite3.IntegrityError:
+        return True # exists already
+    return cur.rowcount > 0
+
+
 def get_generated_db_data_from_log(log_id, con, cur):
     """
     try to get the additional data from the DB (or generate it if it does not
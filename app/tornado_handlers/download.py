@@ -16,9 +16,11 @@ from pyulog.ulog2kml import convert_ulog2kml
 # this is needed for the following imports
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
 from helper import get_log_filename, validate_log_id, \
-    flight_modes_table, load_ulog_file, get_default_parameters
+    flight_modes_table, load_ulog_file, get_default_parameters, get_kml_filename
 
-from config import get_db_filename, get_kml_filepath
+from config import get_db_filename
+from log_storage import open_log_file
+from file_storage import make_parent_dirs
 
 #pylint: disable=relative-beyond-top-level
 from .common import CustomHTTPError, TornadoRequestHandlerBase
@@ -89,8 +91,7 @@ class DownloadHandler(TornadoRequestHandlerBase):
                 self.write('\n')
 
         elif download_type == '2': # download the kml file
-            kml_path = get_kml_filepath()
-            kml_file_name = os.path.join(kml_path, log_id.replace('/', '.')+'.kml')
+            kml_file_name = get_kml_filename(log_id)
 
             # check if chached file exists
             if not os.path.exists(kml_file_name):
@@ -115,8 +116,10 @@ class DownloadHandler(TornadoRequestHandlerBase):
                 style = {'line_width': 2}
                 # create in random temporary file, then move it (to avoid races)
                 try:
+                    make_parent_dirs(kml_file_name)
                     temp_file_name = kml_file_name+'.'+str(uuid.uuid4())
-                    convert_ulog2kml(log_file_name, temp_file_name,
+                    # (the ULog object closes the file)
+                    convert_ulog2kml(open_log_file(log_file_name), temp_file_name,
                                      'vehicle_global_position', kml_colors,
                                      style=style,
                                      camera_trigger_topic_name='camera_capture')
@@ -224,7 +227,7 @@ class DownloadHandler(TornadoRequestHandlerBase):
             self.set_header("Content-Description", "File Transfer")
             self.set_header('Content-Disposition', 'attachment; filename={}'.format(
                 os.path.basename(log_file_name)))
-            with open(log_file_name, 'rb') as log_file:
+            with open_log_file(log_file_name) as log_file:
                 while True:
                     data = log_file.read(4096)
                     if not data:
@@ -10,8 +10,12 @@ import tornado.web
 
 # this is needed for the following imports
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
-from config import get_db_filename, get_kml_filepath, get_overview_img_filepath
-from helper import clear_ulog_cache, get_log_filename
+from config import get_db_filename, get_log_filepath
+from helper import clear_ulog_cache, get_log_filename, get_kml_filename, \
+    get_overview_img_filename
+from file_storage import remove_log_file
+from job_queue import JOB_RUNNING
+from ulog_index import get_index_filename
 
 #pylint: disable=relative-beyond-top-level
 from .common import get_jinja_env
@@ -73,7 +77,7 @@ Click <a href="{delete_url}">here</a> to confirm and delete the log {log_id}.
         """
         con = sqlite3.connect(get_db_filename(), detect_types=sqlite3.PARSE_DECLTYPES)
         cur = con.cursor()
-        cur.execute('select Token from Logs where Id = ?', (log_id,))
+        cur.execute('select Token, Sha256 from Logs where Id = ?', (log_id,))
         db_tuple = cur.fetchone()
         if db_tuple is None:
             return False
@@ -81,26 +85,31 @@ Click <a href="{delete_url}">here</a> to confirm and delete the log {log_id}.
             return False
 
         # kml file
-        kml_path = get_kml_filepath()
-        kml_file_name = os.path.join(kml_path, log_id.replace('/', '.')+'.kml')
+        kml_file_name = get_kml_filename(log_id)
         if os.path.exists(kml_file_name):
             os.unlink(kml_file_name)
 
         #preview image
-        preview_image_filename = os.path.join(get_overview_img_filepath(), log_id+'.png')
+        preview_image_filename = get_overview_img_filename(log_id)
         if os.path.exists(preview_image_filename):
             os.unlink(preview_image_filename)
 
         log_file_name = get_log_filename(log_id)
         print('deleting log entry {} and file {}'.format(log_id, log_file_name))
-        os.unlink(log_file_name)
+        remove_log_file(get_log_filepath(), log_file_name, db_tuple[1])
+        index_file_name = get_index_filename(log_file_name)
+        if os.path.exists(index_file_name):
+            os.unlink(index_file_name)
         cur.execute("DELETE FROM LogsGenerated WHERE Id = ?", (log_id,))
         cur.execute("DELETE FROM Logs WHERE Id = ?", (log_id,))
+        # pending background jobs (running ones fail on the missing file)
+        cur.execute("DELETE FROM Jobs WHERE LogId = ? AND State != ?",
+                    (log_id, JOB_RUNNING))
         con.commit()
         cur.close()
         con.close()
 
         # need to clear the cache as well
-        clear_ulog_cache()
+        clear_ulog_cache(log_id)
 
         return True
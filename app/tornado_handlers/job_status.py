@@ -0,0 +1,45 @@
+"""
+Tornado handler for the processing state of an uploaded log (JSON)
+"""
+from __future__ import print_function
+import json
+import os
+import sys
+import tornado.web
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
+from helper import validate_log_id
+from job_queue import get_jobs, JOB_QUEUED, JOB_RUNNING, JOB_FAILED, JOB_DONE
+
+#pylint: disable=relative-beyond-top-level
+from .common import CustomHTTPError
+
+#pylint: disable=abstract-method, unused-argument
+
+
+class JobStatusHandler(tornado.web.RequestHandler):
+    """ Get the state of the background jobs of an upload, for polling the
+    upload processing progress """
+
+    def get(self, *args, **kwargs):
+        """ GET request """
+        log_id = self.get_argument('log')
+        if not validate_log_id(log_id):
+            raise CustomHTTPError(400, 'Invalid Parameter')
+
+        jobs = get_jobs(log_id)
+        states = {job['state'] for job in jobs}
+        if len(jobs) == 0:
+            state = None
+        elif JOB_RUNNING in states:
+            state = JOB_RUNNING
+        elif JOB_QUEUED in states:
+            state = JOB_QUEUED
+        elif JOB_FAILED in states:
+            state = JOB_FAILED
+        else:
+            state = JOB_DONE
+
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps({'log_id': log_id, 'state': state, 'jobs': jobs}))
@@ -1,5 +1,6 @@
 
 """Multipart/form-data streamer for tornado 4.3"""
+import hashlib
 import os
 import re
 import tempfile
@@ -40,7 +41,8 @@ class StreamedPart:
     def feed(self, data):
         """Feed data into the stream.
 
-        :param data: Binary string that has arrived from the client."""
+        :param data: Bytes-like object (a memoryview of the receive buffer,
+                     only valid during the call) that has arrived from the client."""
         raise NotImplementedError
 
     def finalize(self):
@@ -128,6 +130,7 @@ class TemporaryFileStreamedPart(StreamedPart):
     """A multi part streamer/part that feeds data into a named temporary file.
 
     This class has an ``f_out`` attribute that is bound to a NamedTemporaryFile.
+    The SHA-256 digest of the data is computed while it is streamed in.
     """
     def __init__(self, streamer, headers, tmp_dir=None):
         """Create a new streamed part that writes part data into a NamedTemporaryFile.
@@ -147,6 +150,7 @@ class TemporaryFileStreamedPart(StreamedPart):
         self.is_moved = False
         self.is_finalized = False
         self.f_out = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        self._sha256 = hashlib.sha256()
 
     def feed(self, data):
         """Feed data into the stream.
@@ -155,6 +159,13 @@ class TemporaryFileStreamedPart(StreamedPart):
 
         This version writes data into a temporary file."""
         self.f_out.write(data)
+        self._sha256.update(data)
+
+    def get_sha256(self):
+        """ return the SHA-256 digest of the data (hex string) """
+        if not self.is_finalized:
+            raise RuntimeError("Cannot get the digest: stream is not finalized yet.")
+        return self._sha256.hexdigest()
 
     def finalize(self):
         try:
@@ -217,6 +228,12 @@ class MultiPartStreamer:
     """Parse a stream of multpart/form-data.
 
     Useful for request handlers decorated with ``tornado.web.stream_request_body``.
+
+    Received data is appended to a bytearray buffer. Part data is passed to the
+    parts as memoryviews of the buffer and then removed from its front (which
+    does not move the remaining data), so each byte is only copied once. Only
+    the tail of the buffer that may contain the beginning of a boundary is kept
+    and searched again when the next chunk arrives.
     """
     SEP = b"\r\n"  # line separator in multipart/form-data
     L_SEP = len(SEP)
@@ -235,30 +252,32 @@ class MultiPartStreamer:
         :param total: Total number of bytes in the stream. This is what the http
                       client sends as the Content-Length header of the whole form.
         """
-        self.buf = b""
+        self.buf = bytearray()
         self.dlen = None
         self.delimiter = None
+        self.boundary = None  # CRLF + delimiter line, without the trailing CRLF
         self.in_data = False
+        self.is_complete = False  # the closing delimiter was received
         self.headers = []
         self.parts = []
         self.total = total
         self.received = 0
         self.part = None
 
-    def _get_raw_header(self, data):
-        """Return raw header data.
+    def _pop_raw_header(self):
+        """Remove the first line from the buffer and return it.
 
         Internal method. Do not call directly.
 
-        :param data: A string containing raw data from the form part
-        :return: A tuple of (header_value, tail) where header_value is the first
-                 line of the form part. If there is no first line yet (e.g. the
-                 whole data is a single line) then header_value will be None.
+        :return: The first line (without line separator) as bytes. If there is
+                 no complete line yet then None.
         """
-        idx = data.find(self.SEP)
-        if idx >= 0:
-            return data[:idx], data[idx + self.L_SEP:]
-        return None, data
+        idx = self.buf.find(self.SEP)
+        if idx < 0:
+            return None
+        header = bytes(self.buf[:idx])
+        del self.buf[:idx + self.L_SEP]
+        return header
 
     def _parse_header(self, header):
         """Parse raw header data.
@@ -300,6 +319,47 @@ class MultiPartStreamer:
         self.part._size += len(data)
         self.part.feed(data)
 
+    def _feed_buffer(self, length):
+        """Internal method that feeds the beginning of the buffer to the current
+        part (without copying) and removes it from the buffer.
+
+        :param length: Number of bytes to feed."""
+        if length > 0:
+            with memoryview(self.buf) as view, view[:length] as data:
+                self._feed_part(data)
+            del self.buf[:length]
+
+    def _feed_data(self):
+        """Internal method that feeds the buffered data to the current part
+        until the next boundary.
+
+        :return: True if the part ended, False if more data is needed."""
+        blen = len(self.boundary)
+        search_start = 0
+        while True:
+            idx = self.buf.find(self.boundary, search_start)
+            if idx < 0:
+                # keep the tail that may be the beginning of a boundary
+                self._feed_buffer(len(self.buf) - blen + 1)
+                return False
+            if len(self.buf) < idx + blen + self.L_SEP:
+                # need the end of the boundary line
+                self._feed_buffer(idx)
+                return False
+            suffix = self.buf[idx + blen:idx + blen + self.L_SEP]
+            if suffix in (self.SEP, b"--"):
+                self._feed_buffer(idx)
+                self._end_part()
+                self.in_data = False
+                if suffix == b"--":
+                    self.is_complete = True
+                    del self.buf[:]  # ignore the epilogue
+                else:
+                    del self.buf[:blen + self.L_SEP]
+                return True
+            # not a boundary
+            search_start = idx + 1
+
     def _end_part(self):
         """Internal method called when receiving the current part has finished.
 
@@ -320,11 +380,14 @@ class MultiPartStreamer:
         """
         self.received += len(chunk)
         self.on_progress(self.received, self.total)
+        if self.is_complete:
+            return
         self.buf += chunk
 
         if not self.delimiter:
-            self.delimiter, self.buf = self._get_raw_header(self.buf)
+            self.delimiter = self._pop_raw_header()
             if self.delimiter:
+                self.boundary = self.SEP + self.delimiter
                 self.delimiter += self.SEP
                 self.dlen = len(self.delimiter)
             elif len(self.buf) > 1000:
@@ -332,47 +395,34 @@ class MultiPartStreamer:
             else:
                 return
 
-        while True:
+        while not self.is_complete:
             if self.in_data:
-                if len(self.buf) > 3 * self.dlen:
-                    idx = self.buf.find(self.SEP + self.delimiter)
-                    if idx >= 0:
-                        self._feed_part(self.buf[:idx])
-                        self._end_part()
-                        self.buf = self.buf[idx + len(self.SEP + self.delimiter):]
-                        self.in_data = False
-                    else:
-                        limit = len(self.buf) - 2 * self.dlen
-                        self._feed_part(self.buf[:limit])
-                        self.buf = self.buf[limit:]
-                        return
+                if not self._feed_data():
+                    return
+            else:
+                header = self._pop_raw_header()
+                if header == b"":
+                    assert self.delimiter
+                    self.in_data = True
+                    self._begin_part(self.headers)
+                    self.headers = []
+                elif header:
+                    self.headers.append(self._parse_header(header))
                 else:
+                    # Header is None, not enough data yet
                     return
-            if not self.in_data:
-                while True:
-                    header, self.buf = self._get_raw_header(self.buf)
-                    if header == b"":
-                        assert self.delimiter
-                        self.in_data = True
-                        self._begin_part(self.headers)
-                        self.headers = []
-                        break
-
-                    if header:
-                        self.headers.append(self._parse_header(header))
-                    else:
-                        # Header is None, not enough data yet
-                        return
 
     def data_complete(self):
         """Call this after the last receive() call, e.g. when all data arrived for the form.
 
         You MUST call this before using the parts."""
         if self.in_data:
-            idx = self.buf.rfind(self.SEP + self.delimiter[:-2])
+            # the closing delimiter is missing or incomplete
+            idx = self.buf.rfind(self.boundary)
             if idx > 0:
-                self._feed_part(self.buf[:idx])
+                self._feed_buffer(idx)
             self._end_part()
+            self.in_data = False
 
     def create_part(self, headers):
         """Called when a new part needs to be created.
@@ -0,0 +1,339 @@
+"""
+Tornado handler for resumable uploads of large logs.
+
+Protocol:
+- POST /upload_resumable?file_name=<name>&size=<bytes>: start an upload.
+  Returns the upload id and the chunk size.
+- PUT /upload_resumable/<id>?offset=<bytes>&sha256=<hex>: upload a chunk (the
+  request body). All chunks have the returned size (except for the last one)
+  and can be sent in any order and repeated.
+- GET /upload_resumable/<id>: status (the offsets of the missing chunks), to
+  resume an interrupted upload.
+- POST /upload_resumable/<id>: finish the upload, with the form fields of a
+  normal upload (see UploadHandler) and optionally the sha256 of the file.
+  The response is the same as for a normal upload.
+- DELETE /upload_resumable/<id>: cancel the upload.
+
+The chunks are written directly to their offset in the data file of the
+upload, so the memory usage does not depend on the file or chunk size.
+Incomplete uploads are removed after a while (see expire_partial_uploads()).
+"""
+
+from __future__ import print_function
+import binascii
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import tornado.web
+from tornado.httputil import parse_body_arguments
+from tornado.ioloop import IOLoop
+
+# this is needed for the following imports
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
+from config import get_upload_filepath, get_resumable_upload_chunk_size, \
+    get_resumable_upload_expiry_s, get_resumable_upload_max_size
+
+#pylint: disable=relative-beyond-top-level
+from .common import CustomHTTPError
+from .upload import UploadHandler
+
+#pylint: disable=attribute-defined-outside-init,unused-argument,arguments-differ
+
+
+# maximum size of the form data when finishing an upload
+MAX_FORM_SIZE = 64 * 1024
+
+
+class PartialUpload:
+    """ An incomplete resumable upload, stored in its own directory: the data
+    file (with the final size, chunks are written to their offset), the upload
+    info and a file per received chunk (containing its SHA-256).
+
+    For finishing the upload, it provides the same interface as
+    multipart_streamer.TemporaryFileStreamedPart (the data file is opened as
+    ``f_out``).
+    """
+
+    def __init__(self, upload_id):
+        """ open an existing upload
+        :raise KeyError: if the upload does not exist
+        """
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        self.upload_id = upload_id
+        self.upload_dir = os.path.join(get_upload_filepath(), upload_id)
+        try:
+            with open(os.path.join(self.upload_dir, 'upload.json'),
+                      encoding='utf-8') as info_file:
+                info = json.load(info_file)
+            self.f_out = open(os.path.join(self.upload_dir, 'data'), 'r+b') #pylint: disable=consider-using-with
+        except FileNotFoundError as e:
+            raise KeyError(upload_id) from e
+        self.file_name = info['file_name']
+        self.size = info['size']
+        self.chunk_size = info['chunk_size']
+        self.num_chunks = (self.size + self.chunk_size - 1) // self.chunk_size
+        self.is_moved = False
+        self._sha256 = None
+
+    @staticmethod
+    def create(file_name, size, chunk_size):
+        """ start a new upload
+        :return: PartialUpload
+        """
+        upload_id = str(binascii.hexlify(os.urandom(16)), 'ascii')
+        upload_dir = os.path.join(get_upload_filepath(), upload_id)
+        os.makedirs(os.path.join(upload_dir, 'chunks'))
+        with open(os.path.join(upload_dir, 'data'), 'wb') as data_file:
+            data_file.truncate(size)
+        # written last: the upload exists once this file exists
+        with open(os.path.join(upload_dir, 'upload.json'), 'w', encoding='utf-8') as info_file:
+            json.dump({'file_name': file_name, 'size': size, 'chunk_size': chunk_size,
+                       'created': time.time()}, info_file)
+        return PartialUpload(upload_id)
+
+    def get_chunk_length(self, offset):
+        """ get the length of the chunk at an offset
+        :raise ValueError: if the offset is not the start of a chunk
+        """
+        if offset < 0 or offset >= self.size or offset % self.chunk_size != 0:
+            raise ValueError('Invalid offset')
+        return min(self.chunk_size, self.size - offset)
+
+    def remove_chunk(self, offset):
+        """ mark the chunk at an offset as not received (before its data gets
+        overwritten) """
+        chunk_file_name = os.path.join(self.upload_dir, 'chunks', str(offset // self.chunk_size))
+        if os.path.exists(chunk_file_name):
+            os.unlink(chunk_file_name)
+
+    def add_chunk(self, offset, sha256):
+        """ mark the chunk at an offset as received (after its data got
+        written) """
+        self.f_out.flush()
+        chunk_file_name = os.path.join(self.upload_dir, 'chunks', str(offset // self.chunk_size))
+        with open(chunk_file_name+'.tmp', 'w', encoding='utf-8') as chunk_file:
+            chunk_file.write(sha256)
+        os.replace(chunk_file_name+'.tmp', chunk_file_name)
+        # for expire_partial_uploads()
+        os.utime(self.upload_dir)
+
+    def get_missing_offsets(self):
+        """ get the offsets of the chunks that are not received yet """
+        received = set()
+        for chunk_file_name in os.listdir(os.path.join(self.upload_dir, 'chunks')):
+            if chunk_file_name.isdigit():
+                received.add(int(chunk_file_name))
+        return [i * self.chunk_size for i in range(self.num_chunks) if i not in received]
+
+    def get_status(self):
+        """ get the upload status as dict """
+        missing_offsets = self.get_missing_offsets()
+        missing_bytes = sum(self.get_chunk_length(offset) for offset in missing_offsets)
+        return {'upload_id': self.upload_id, 'file_name': self.file_name,
+                'size': self.size, 'chunk_size': self.chunk_size,
+                'received_bytes': self.size - missing_bytes,
+                'missing_offsets': missing_offsets}
+
+    def close(self):
+        """ close the data file """
+        self.f_out.close()
+
+    def release(self):
+        """ remove the upload (the data file only if it was not moved) """
+        self.close()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    # TemporaryFileStreamedPart interface
+
+    def get_filename(self):
+        """ get the name of the uploaded file """
+        return self.file_name
+
+    def get_sha256(self):
+        """ return the SHA-256 digest of the data (hex string). This reads the
+        whole file the first time. """
+        if self._sha256 is None:
+            digest = hashlib.sha256()
+            self.f_out.seek(0)
+            while True:
+                data = self.f_out.read(1024 * 1024)
+                if not data:
+                    break
+                digest.update(data)
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    def get_payload_partial(self, num_bytes):
+        """ get the beginning of the data """
+        self.f_out.seek(0)
+        return self.f_out.read(num_bytes)
+
+    def move(self, file_path):
+        """ move the data file to a new location """
+        self.close()
+        shutil.move(self.f_out.name, file_path)
+        self.is_moved = True
+
+
+def expire_partial_uploads():
+    """ remove the incomplete uploads that did not receive any data for a while
+    :return: number of removed uploads
+    """
+    upload_dir = get_upload_filepath()
+    if not os.path.exists(upload_dir):
+        return 0
+    expiry_time = time.time() - get_resumable_upload_expiry_s()
+    num_removed = 0
+    for upload_id in os.listdir(upload_dir):
+        cur_dir = os.path.join(upload_dir, upload_id)
+        try:
+            if os.path.getmtime(cur_dir) < expiry_time:
+                shutil.rmtree(cur_dir)
+                num_removed += 1
+        except FileNotFoundError:
+            pass # removed concurrently (e.g. by another server process)
+    if num_removed > 0:
+        print('Removed', num_removed, 'expired uploads')
+    return num_removed
+
+
+@tornado.web.stream_request_body
+class ResumableUploadHandler(UploadHandler):
+    """ Resumable upload Tornado request handler (see the protocol description
+    above). When finished, the upload is processed like a normal upload. """
+
+    def initialize(self):
+        """ initialize the instance """
+        super().initialize()
+        self.upload = None
+        self.chunk_offset = 0
+        self.chunk_length = 0
+        self.chunk_received = 0
+        self.chunk_sha256 = None
+        self.form_body = bytearray()
+
+    def _open_upload(self, upload_id):
+        try:
+            self.upload = PartialUpload(upload_id)
+        except KeyError as e:
+            raise CustomHTTPError(404, 'Unknown upload') from e
+
+    def prepare(self):
+        """ called before a new request """
+        method = self.request.method.upper()
+        upload_id = self.path_args[0] if self.path_args else ''
+        if method == 'PUT':
+            self._open_upload(upload_id)
+            try:
+                self.chunk_offset = int(self.get_argument('offset'))
+                self.chunk_length = self.upload.get_chunk_length(self.chunk_offset)
+            except ValueError as e:
+                raise CustomHTTPError(400, 'Invalid offset') from e
+            content_length = self.request.headers.get('Content-Length')
+            if content_length is not None and int(content_length) != self.chunk_length:
+                raise CustomHTTPError(400, 'Invalid chunk length')
+            self.request.connection.set_max_body_size(self.chunk_length)
+            # a repeated chunk overwrites the received data: it is only marked
+            # as received again if its checksum matches
+            self.upload.remove_chunk(self.chunk_offset)
+            self.chunk_sha256 = hashlib.sha256()
+            self.upload.f_out.seek(self.chunk_offset)
+        elif method in ('POST', 'DELETE'):
+            self.request.connection.set_max_body_size(MAX_FORM_SIZE)
+
+    def data_received(self, chunk):
+        """ called whenever new data is received """
+        if self.request.method.upper() == 'PUT':
+            # the length is limited by the max body size (see prepare())
+            self.chunk_received += len(chunk)
+            self.upload.f_out.write(chunk)
+            self.chunk_sha256.update(chunk)
+        else:
+            self.form_body += chunk
+
+    def on_finish(self):
+        """ called after the response is sent """
+        if self.upload is not None:
+            self.upload.close()
+
+    def get(self, upload_id=''):
+        """ GET request callback: upload status """
+        self._open_upload(upload_id)
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(self.upload.get_status()))
+
+    def put(self, upload_id=''):
+        """ PUT request callback: a chunk was received """
+        if self.chunk_received != self.chunk_length:
+            raise CustomHTTPError(400, 'Invalid chunk length')
+        sha256 = self.get_argument('sha256', '').lower()
+        if self.chunk_sha256.hexdigest() != sha256:
+            # the chunk is not marked as received (it has to be sent again)
+            raise CustomHTTPError(400, 'Checksum mismatch')
+        self.upload.add_chunk(self.chunk_offset, sha256)
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps({'offset': self.chunk_offset, 'length': self.chunk_length}))
+
+    async def post(self, upload_id=''):
+        """ POST request callback: start or finish an upload """
+        if upload_id == '':
+            try:
+                file_name = self.get_argument('file_name')
+                size = int(self.get_argument('size'))
+            except ValueError as e:
+                raise CustomHTTPError(400, 'Invalid size') from e
+            if size <= 0:
+                raise CustomHTTPError(400, 'Invalid size')
+            if size > get_resumable_upload_max_size():
+                raise CustomHTTPError(413, 'File too large')
+            self.upload = PartialUpload.create(os.path.basename(file_name), size,
+                                               get_resumable_upload_chunk_size())
+            print('Started resumable upload', self.upload.upload_id, 'of', file_name,
+                  '({:.1f} MB)'.format(size / 1024**2))
+            self.set_status(201)
+            self.set_header('Content-Type', 'application/json')
+            self.write(json.dumps(self.upload.get_status()))
+            return
+
+        self._open_upload(upload_id)
+        missing_offsets = self.upload.get_missing_offsets()
+        if len(missing_offsets) > 0:
+            raise CustomHTTPError(400, 'Upload incomplete: {:} chunks missing'.format(
+                len(missing_offsets)))
+
+        arguments = {}
+        parse_body_arguments(self.request.headers.get('Content-Type', ''),
+                             bytes(self.form_body), arguments, {}, self.request.headers)
+        form_data = {'description': b'', 'email': b''}
+        for name, values in arguments.items():
+            form_data[name] = values[0]
+
+        try:
+            # read the whole file in the background
+            sha256 = await IOLoop.current().run_in_executor(None, self.upload.get_sha256)
+            if 'sha256' in form_data and form_data['sha256'].decode('utf-8').lower() != sha256:
+                raise CustomHTTPError(400, 'Checksum mismatch')
+            self.handle_upload(form_data, self.upload)
+            self.upload.release()
+
+        except CustomHTTPError:
+            # the data is invalid: uploading it again does not help
+            self.upload.release()
+            raise
+
+        except Exception as e:
+            # the upload is kept, so that finishing it can be retried
+            print('Error when finishing resumable upload', sys.exc_info()[0],
+                  sys.exc_info()[1])
+            raise CustomHTTPError(500) from e
+
+    def delete(self, upload_id=''):
+        """ DELETE request callback: cancel an upload """
+        self._open_upload(upload_id)
+        self.upload.release()
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps({'upload_id': upload_id}))
@@ -1,8 +1,13 @@
 """ Methods for sending notification emails """
 from __future__ import print_function
 
+from collections import namedtuple
+import queue
+import smtplib
 import sys
 import os
+import threading
+import time
 
 from smtplib import SMTP_SSL as SMTP       # this invokes the secure SMTP protocol
                                            # (port 465, uses SSL)
@@ -14,6 +19,30 @@ from email.mime.text import MIMEText
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plot_app'))
 from config import *
 
+#pylint: disable=global-statement,invalid-name
+
+# emails are sent by a single thread, which keeps the SMTP connection open
+# between messages (instead of connecting and logging in for every email)
+__SMTP_TIMEOUT = 15 # [s]
+# the connection is closed when there was no email for this time [s]
+__MAX_IDLE_TIME = 60
+# maximum number of queued emails sent at once (the connection is only checked
+# before each batch)
+__BATCH_SIZE = 20
+# number of attempts per email, and the delay before the first retry [s]
+# (doubled for every retry). These only cover a lost connection: failed emails
+# are retried by the job queue.
+__MAX_ATTEMPTS = 3
+__RETRY_DELAY = 1
+# maximum time to wait until an email is sent [s]
+__SEND_TIMEOUT = 120
+
+_QueuedEmail = namedtuple('_QueuedEmail', ['destination', 'msg', 'done', 'result'])
+
+__queue = queue.Queue()
+__sender_thread = None
+__lock = threading.Lock()
+
 
 def send_notification_email(email_address, plot_url, delete_url, info):
     """ send a notification email after uploading a plot
@@ -100,26 +129,112 @@ Use the following link to delete the log:
 
 
 def _send_email(destination, subject, content):
-    """ common method for sending an email to one or more destinations """
+    """ common method for sending an email to one or more destinations. The
+    email is sent by the sender thread, this waits until it is sent: it is
+    called from a job worker thread, and the job gets rescheduled if sending
+    fails.
+    :return: True on success
+    """
+    global __sender_thread
 
     # typical values for text_subtype are plain, html, xml
     text_subtype = 'plain'
 
-    try:
-        msg = MIMEText(content, text_subtype)
-        msg['Subject'] = subject
-        sender = email_config['sender']
-        msg['From'] = sender # some SMTP servers will do this automatically
+    msg = MIMEText(content, text_subtype)
+    msg['Subject'] = subject
+    msg['From'] = email_config['sender'] # some SMTP servers will do this automatically
+
+    queued_email = _QueuedEmail(destination, msg.as_string(), threading.Event(), [False])
+    with __lock:
+        if __sender_thread is None:
+            __sender_thread = threading.Thread(target=_sender, name='email-sender',
+                                               daemon=True)
+            __sender_thread.start()
+    __queue.put(queued_email)
+    if not queued_email.done.wait(__SEND_TIMEOUT):
+        print("mail failed; timeout")
+        return False
+    return queued_email.result[0]
+
 
-        conn = SMTP(email_config['smtpserver'], timeout=15)
-        conn.set_debuglevel(False)
+def _connect():
+    """ open and authenticate an SMTP connection """
+    conn = SMTP(email_config['smtpserver'], timeout=__SMTP_TIMEOUT)
+    conn.set_debuglevel(False)
+    try:
         conn.login(email_config['user_name'], email_config['password'])
-        try:
-            conn.sendmail(sender, destination, msg.as_string())
-        finally:
-            conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
+        raise
+    return conn
 
-    except Exception as exc:
-        print("mail failed; {:}".format(str(exc)))
+
+def _disconnect(conn):
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
+
+
+def _is_connected(conn):
+    try:
+        return conn.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
         return False
-    return True
+
+
+def _sender():
+    """ sender thread: send the queued emails in batches over one connection,
+    reconnecting (with backoff) if it got lost """
+    conn = None
+    while True:
+        try:
+            batch = [__queue.get(timeout=__MAX_IDLE_TIME if conn is not None else None)]
+        except queue.Empty:
+            _disconnect(conn)
+            conn = None
+            continue
+        # emails queued in the meantime are sent in the same pass
+        while len(batch) < __BATCH_SIZE:
+            try:
+                batch.append(__queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # the server might have closed the connection since the last batch
+        if conn is not None and not _is_connected(conn):
+            conn.close()
+            conn = None
+
+        for queued_email in batch:
+            conn = _send_queued_email(conn, queued_email)
+            queued_email.done.set()
+
+
+def _send_queued_email(conn, queued_email):
+    """ send an email, reconnecting if the connection got lost. Sets the result
+    of queued_email.
+    :param conn: SMTP connection or None
+    :return: SMTP connection to use for the next email (or None)
+    """
+    for attempt in range(__MAX_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(__RETRY_DELAY * 2**(attempt - 1))
+        try:
+            if conn is None:
+                conn = _connect()
+            conn.sendmail(email_config['sender'], queued_email.destination,
+                         queued_email.msg)
+            queued_email.result[0] = True
+            break
+        except smtplib.SMTPRecipientsRefused as exc:
+            # the message got rejected: retrying does not help
+            print("mail failed; {:}".format(str(exc)))
+            break
+        except Exception as exc:
+            print("mail failed (attempt {:}/{:}); {:}".format(
+                attempt + 1, __MAX_ATTEMPTS, str(exc)))
+            if conn is not None:
+                conn.close()
+                conn = None
+    return conn
@@ -12,7 +12,6 @@ import uuid
 import binascii
 import sqlite3
 import tornado.web
-from tornado.ioloop import IOLoop
 
 from pyulog import ULog
 from pyulog.px4 import PX4ULog
@@ -21,21 +20,34 @@ from pyulog.px4 import PX4ULog
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plot_app'))
 from db_entry import DBVehicleData, DBData
 from config import get_db_filename, get_http_protocol, get_domain_name, \
-    email_notifications_config, get_ulge_private_key_path
+    email_notifications_config, get_ulge_private_key_path, use_log_compression, \
+    get_log_filepath
 from helper import get_total_flight_time, validate_url, get_log_filename, \
-    load_ulog_file, get_airframe_name, ULogException, decrypt_ulge_payload
+    load_ulog_file, get_airframe_name, decrypt_ulge_file, \
+    create_ulog_index, copy_ulog_cache, get_kml_filename, get_overview_img_filename, \
+    clear_ulog_cache
 from overview_generator import generate_overview_img_from_id
+from file_storage import make_parent_dirs, store_log_file, compress_stored_log_file
+from ulog_index import get_index_filename
+from job_queue import PRIORITY_HIGH, PRIORITY_LOW, register_job_type, enqueue_job, \
+    notify_job_workers
+from warmup import start_warmup_job, has_warm_cache, register_warmup_step
 
 
 #pylint: disable=relative-beyond-top-level
 from .common import get_jinja_env, CustomHTTPError, generate_db_data_from_log_file, \
-    TornadoRequestHandlerBase
+    copy_generated_db_data, TornadoRequestHandlerBase
 from .send_email import send_notification_email, send_flightreport_email
 from .multipart_streamer import MultiPartStreamer
 
 
 UPLOAD_TEMPLATE = 'upload.html'
 
+# form fields of an upload (besides the file)
+UPLOAD_FORM_FIELDS = ['description', 'email', 'allowForAnalysis', 'obfuscated',
+                      'source', 'type', 'feedback', 'windSpeed', 'rating',
+                      'videoUrl', 'public', 'vehicleName', 'redirect']
+
 
 #pylint: disable=attribute-defined-outside-init,too-many-statements, unused-argument
 
@@ -77,6 +89,194 @@ def update_vehicle_db_entry(cur, ulog, log_id, vehicle_name):
     return vehicle_data
 
 
+def find_duplicate_log(sha256, file_name):
+    """
+    Find an existing upload with the same content as a new log file
+    :param sha256: SHA-256 of the log content
+    :param file_name: new log file (a hard link to the existing log file)
+    :return: log id or None
+    """
+    con = sqlite3.connect(get_db_filename())
+    cur = con.cursor()
+    cur.execute('select Id from Logs where Sha256 = ?', [sha256])
+    db_tuples = cur.fetchall()
+    cur.close()
+    con.close()
+    for db_tuple in db_tuples:
+        try:
+            if os.path.samefile(get_log_filename(db_tuple[0]), file_name):
+                return db_tuple[0]
+        except OSError:
+            pass # deleted in the meantime
+    return None
+
+
+def reuse_log_files(duplicate_log_id, log_id):
+    """
+    Reuse the files generated for an existing upload with the same content
+    (index, cache entries, overview image and KML file) for a new log
+    """
+    for get_file_name in [lambda i: get_index_filename(get_log_filename(i)),
+                          get_overview_img_filename, get_kml_filename]:
+        file_name = get_file_name(duplicate_log_id)
+        if not os.path.exists(file_name):
+            continue
+        new_file_name = get_file_name(log_id)
+        try:
+            make_parent_dirs(new_file_name)
+            os.link(file_name, new_file_name)
+        except OSError as e:
+            print('Failed to link', file_name, e)
+    copy_ulog_cache(duplicate_log_id, log_id)
+
+
+def generate_unique_log_filename():
+    """
+    Generate a unique log filename that does not exist yet
+    :return: tuple (log id, file name)
+    """
+    while True:
+        log_id = str(uuid.uuid4())
+        new_file_name = get_log_filename(log_id)
+        if not os.path.exists(new_file_name):
+            make_parent_dirs(new_file_name)
+            return log_id, new_file_name
+
+
+def store_uploaded_log_file(log_id, file_name, sha256):
+    """
+    Finish storing the file of a new upload: store identical logs only once
+    (new logs are compressed later by the processing job). If the log is a
+    duplicate, the new entry gets its own id and token, but the parsed data of
+    the existing upload is reused.
+    :param sha256: SHA-256 of the log content
+    :return: log id of the identical upload or None
+    """
+    duplicate_log_id = None
+    try:
+        if store_log_file(get_log_filepath(), file_name, digest=sha256):
+            duplicate_log_id = find_duplicate_log(sha256, file_name)
+    except Exception as e:
+        # keep the file as it is
+        print('Failed to store log file', file_name, e)
+
+    if duplicate_log_id is not None:
+        print('Log file is a duplicate of log', duplicate_log_id)
+        reuse_log_files(duplicate_log_id, log_id)
+    return duplicate_log_id
+
+
+def get_email_info(log_id, info, vehicle_name, use_log):
+    """
+    Complete the information for the notification emails of an upload
+    :param info: dict with the information from the uploader (description, ...)
+    :param vehicle_name: vehicle name from the uploader ('' if not provided)
+    :param use_log: add information from the log file (not for CI uploads)
+    :return: dict
+    """
+    info = dict(info, type='', airframe='', hardware='', uuid='', software='')
+    if use_log:
+        ulog = load_ulog_file(get_log_filename(log_id))
+        if vehicle_name == '' and 'sys_uuid' in ulog.msg_info_dict:
+            con = sqlite3.connect(get_db_filename())
+            cur = con.cursor()
+            cur.execute('select Name from Vehicle where UUID = ?',
+                        [escape(ulog.msg_info_dict['sys_uuid'])])
+            db_tuple = cur.fetchone()
+            if db_tuple is not None:
+                vehicle_name = db_tuple[0]
+            cur.close()
+            con.close()
+
+        px4_ulog = PX4ULog(ulog)
+        info['type'] = px4_ulog.get_mav_type()
+        airframe_name_tuple = get_airframe_name(ulog)
+        if airframe_name_tuple is not None:
+            airframe_name, airframe_id = airframe_name_tuple
+            if len(airframe_name) == 0:
+                info['airframe'] = airframe_id
+            else:
+                info['airframe'] = airframe_name
+        sys_hardware = ''
+        if 'ver_hw' in ulog.msg_info_dict:
+            sys_hardware = escape(ulog.msg_info_dict['ver_hw'])
+            info['hardware'] = sys_hardware
+        if 'sys_uuid' in ulog.msg_info_dict and sys_hardware != 'SITL':
+            info['uuid'] = escape(ulog.msg_info_dict['sys_uuid'])
+        branch_info = ''
+        if 'ver_sw_branch' in ulog.msg_info_dict:
+            branch_info = ' (branch: '+ulog.msg_info_dict['ver_sw_branch']+')'
+        if 'ver_sw' in ulog.msg_info_dict:
+            ver_sw = escape(ulog.msg_info_dict['ver_sw'])
+            info['software'] = ver_sw + branch_info
+
+    if len(vehicle_name) > 0:
+        info['vehicle_name'] = vehicle_name
+    return info
+
+
+# background jobs for processing an upload (see job_queue.py)
+PROCESS_UPLOAD_JOB_TYPE = 'process_upload'
+NOTIFICATION_EMAIL_JOB_TYPE = 'notification_email'
+FLIGHTREPORT_EMAIL_JOB_TYPE = 'flightreport_email'
+
+def process_upload(log_id, vehicle_name, update_vehicle, sha256=None,
+                   warmup_steps=None, warmup_priority=PRIORITY_LOW):
+    """
+    Job: compress and index the log file, update the Vehicle DB entry and
+    start the warm-up job
+    :param sha256: SHA-256 of the log content
+    :param warmup_steps: steps of the warm-up job, None for no warm-up
+    """
+    log_file_name = get_log_filename(log_id)
+    # compressed here instead of during the upload request. The warm-up job
+    # is only started afterwards, because compressing invalidates the caches.
+    if use_log_compression() and \
+            compress_stored_log_file(get_log_filepath(), log_file_name, sha256):
+        clear_ulog_cache(log_id)
+        create_ulog_index(log_file_name)
+    # index the log for fast loading & random access by topic and time
+    if not os.path.exists(get_index_filename(log_file_name)):
+        create_ulog_index(log_file_name)
+
+    if update_vehicle:
+        ulog = load_ulog_file(log_file_name)
+        con = sqlite3.connect(get_db_filename())
+        cur = con.cursor()
+        update_vehicle_db_entry(cur, ulog, log_id, vehicle_name)
+        con.commit()
+        cur.close()
+        con.close()
+    if warmup_steps is not None:
+        start_warmup_job(log_id, warmup_steps, priority=warmup_priority)
+
+def send_upload_notification_email(log_id, email, plot_url, delete_url, info,
+                                   vehicle_name, use_log):
+    """
+    Job: send the notification email to the uploader
+    """
+    info = get_email_info(log_id, info, vehicle_name, use_log)
+    if not send_notification_email(email, plot_url, delete_url, info):
+        raise RuntimeError('Failed to send the notification email')
+
+def send_upload_flightreport_email(log_id, destinations, plot_url, rating_description,
+                                   wind_speed, delete_url, uploader_email, info,
+                                   vehicle_name):
+    """
+    Job: send the email for a public flight report
+    """
+    info = get_email_info(log_id, info, vehicle_name, True)
+    if not send_flightreport_email(destinations, plot_url, rating_description,
+                                   wind_speed, delete_url, uploader_email, info):
+        raise RuntimeError('Failed to send the flight report email')
+
+register_job_type(PROCESS_UPLOAD_JOB_TYPE, process_upload)
+register_job_type(NOTIFICATION_EMAIL_JOB_TYPE, send_upload_notification_email)
+register_job_type(FLIGHTREPORT_EMAIL_JOB_TYPE, send_upload_flightreport_email)
+register_warmup_step('generate_db_data', generate_db_data_from_log_file)
+register_warmup_step('overview_img', generate_overview_img_from_id)
+
+
 @tornado.web.stream_request_body
 class UploadHandler(TornadoRequestHandlerBase):
     """ Upload log file Tornado request handler: handles page requests and POST
@@ -108,235 +308,18 @@ class UploadHandler(TornadoRequestHandlerBase):
         template = get_jinja_env().get_template(UPLOAD_TEMPLATE)
         self.write(template.render())
 
-    def _generate_unique_log_filename(self):
-        """Generate a unique log filename that does not exist yet."""
-        while True:
-            log_id = str(uuid.uuid4())
-            new_file_name = get_log_filename(log_id)
-            if not os.path.exists(new_file_name):
-                return log_id, new_file_name
-
-
     def post(self, *args, **kwargs):
         """ POST request callback """
         if self.multipart_streamer:
             try:
                 self.multipart_streamer.data_complete()
-                form_data = self.multipart_streamer.get_values(
-                    ['description', 'email',
-                     'allowForAnalysis', 'obfuscated', 'source', 'type',
-                     'feedback', 'windSpeed', 'rating', 'videoUrl', 'public',
-                     'vehicleName', 'redirect'])
-                description = escape(form_data['description'].decode("utf-8"))
-                email = form_data['email'].decode("utf-8")
-                upload_type = 'personal'
-                if 'type' in form_data:
-                    upload_type = form_data['type'].decode("utf-8")
-                source = 'webui'
-                title = '' # may be used in future...
-                if 'source' in form_data:
-                    source = form_data['source'].decode("utf-8")
-                obfuscated = 0
-                if 'obfuscated' in form_data:
-                    if form_data['obfuscated'].decode("utf-8") == 'true':
-                        obfuscated = 1
-                allow_for_analysis = 0
-                if 'allowForAnalysis' in form_data:
-                    if form_data['allowForAnalysis'].decode("utf-8") == 'true':
-                        allow_for_analysis = 1
-                feedback = ''
-                if 'feedback' in form_data:
-                    feedback = escape(form_data['feedback'].decode("utf-8"))
-                should_redirect = source != 'QGroundControl'
-                if 'redirect' in form_data:
-                    should_redirect = form_data['redirect'].decode("utf-8") == 'true'
-                wind_speed = -1
-                rating = ''
-                stored_email = ''
-                video_url = ''
-                is_public = 0
-                vehicle_name = ''
-                error_labels = ''
-
-                if upload_type == 'flightreport':
-                    if 'windSpeed' in form_data:
-                        try:
-                            wind_speed = int(escape(form_data['windSpeed'].decode("utf-8")))
-                        except ValueError:
-                            wind_speed = -1
-                    if 'rating' in form_data:
-                        rating = escape(form_data['rating'].decode("utf-8"))
-                        if rating == 'notset': rating = ''
-                    # get video url & check if valid
-                    if 'videoUrl' in form_data:
-                        video_url = escape(form_data['videoUrl'].decode("utf-8"), quote=True)
-                        if not validate_url(video_url):
-                            video_url = ''
-                    if 'vehicleName' in form_data:
-                        vehicle_name = escape(form_data['vehicleName'].decode("utf-8"))
-
-                    # always allow for statistical analysis
-                    allow_for_analysis = 1
-                    if 'public' in form_data:
-                        if form_data['public'].decode("utf-8") == 'true':
-                            is_public = 1
-
+                form_data = self.multipart_streamer.get_values(UPLOAD_FORM_FIELDS)
                 file_obj = self.multipart_streamer.get_parts_by_name('filearg')[0]
-                upload_file_name = file_obj.get_filename()
-
-                # check if the file is encrypted
-                ulge_key_path = get_ulge_private_key_path()
-                if ulge_key_path and upload_file_name.lower().endswith('.ulge'):
-                    file_payload = file_obj.get_payload()  # full content as bytes
-                    try:
-                        decrypted_data = decrypt_ulge_payload(
-                        file_payload,
-                        get_ulge_private_key_path()
-                    )
-
-                    except Exception as e:
-                        raise CustomHTTPError(400, f"Decryption failed: {str(e)}") from e
-
-                    if decrypted_data[:len(ULog.HEADER_BYTES)] != ULog.HEADER_BYTES:
-                        raise CustomHTTPError(400, "Decrypted file is not a valid ULog")
-
-                    # Write decrypted .ulg to disk
-                    log_id, new_file_name = self._generate_unique_log_filename()
-
-                    with open(new_file_name, 'wb') as output_file:
-                        output_file.write(decrypted_data)
-
-                    print(f"Decryption successful for {upload_file_name}, saved to {new_file_name}")
-
-                else:
-                    # Regular .ulg file
-                    log_id, new_file_name = self._generate_unique_log_filename()
-
-                    header_len = len(ULog.HEADER_BYTES)
-                    if file_obj.get_payload_partial(header_len) != ULog.HEADER_BYTES:
-                        raise CustomHTTPError(400, 'Invalid File')
-
-                    print('Moving uploaded file to', new_file_name)
-                    file_obj.move(new_file_name)
-
-                if obfuscated == 1:
-                    # TODO: randomize gps data, ...
-                    pass
-
-                # generate a token: secure random string (url-safe)
-                token = str(binascii.hexlify(os.urandom(16)), 'ascii')
-
-                # Load the ulog file but only if not uploaded via CI.
-                # Then we open the DB connection.
-                ulog = None
-                if source != 'CI':
-                    ulog_file_name = get_log_filename(log_id)
-                    ulog = load_ulog_file(ulog_file_name)
-
-                # put additional data into a DB
-                con = sqlite3.connect(get_db_filename())
-                cur = con.cursor()
-                cur.execute(
-                    'insert into Logs (Id, Title, Description, '
-                    'OriginalFilename, Date, AllowForAnalysis, Obfuscated, '
-                    'Source, Email, WindSpeed, Rating, Feedback, Type, '
-                    'videoUrl, ErrorLabels, Public, Token) values '
-                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                    [log_id, title, description, upload_file_name,
-                     datetime.datetime.now(), allow_for_analysis,
-                     obfuscated, source, stored_email, wind_speed, rating,
-                     feedback, upload_type, video_url, error_labels, is_public, token])
-
-                if ulog is not None:
-                    vehicle_data = update_vehicle_db_entry(cur, ulog, log_id, vehicle_name)
-                    vehicle_name = vehicle_data.name
-
-                con.commit()
-
-                url = '/plot_app?log='+log_id
-                full_plot_url = get_http_protocol()+'://'+get_domain_name()+url
-                print(full_plot_url)
-
-                delete_url = get_http_protocol()+'://'+get_domain_name()+ \
-                    '/edit_entry?action=delete&log='+log_id+'&token='+token
-
-                # information for the notification email
-                info = {}
-                info['description'] = description
-                info['feedback'] = feedback
-                info['upload_filename'] = upload_file_name
-                info['type'] = ''
-                info['airframe'] = ''
-                info['hardware'] = ''
-                info['uuid'] = ''
-                info['software'] = ''
-                info['rating'] = rating
-                if len(vehicle_name) > 0:
-                    info['vehicle_name'] = vehicle_name
-
-                if ulog is not None:
-                    px4_ulog = PX4ULog(ulog)
-                    info['type'] = px4_ulog.get_mav_type()
-                    airframe_name_tuple = get_airframe_name(ulog)
-                    if airframe_name_tuple is not None:
-                        airframe_name, airframe_id = airframe_name_tuple
-                        if len(airframe_name) == 0:
-                            info['airframe'] = airframe_id
-                        else:
-                            info['airframe'] = airframe_name
-                    sys_hardware = ''
-                    if 'ver_hw' in ulog.msg_info_dict:
-                        sys_hardware = escape(ulog.msg_info_dict['ver_hw'])
-                        info['hardware'] = sys_hardware
-                    if 'sys_uuid' in ulog.msg_info_dict and sys_hardware != 'SITL':
-                        info['uuid'] = escape(ulog.msg_info_dict['sys_uuid'])
-                    branch_info = ''
-                    if 'ver_sw_branch' in ulog.msg_info_dict:
-                        branch_info = ' (branch: '+ulog.msg_info_dict['ver_sw_branch']+')'
-                    if 'ver_sw' in ulog.msg_info_dict:
-                        ver_sw = escape(ulog.msg_info_dict['ver_sw'])
-                        info['software'] = ver_sw + branch_info
-
-
-                if upload_type == 'flightreport' and is_public and source != 'CI':
-                    destinations = set(email_notifications_config['public_flightreport'])
-                    if rating in ['unsatisfactory', 'crash_sw_hw', 'crash_pilot']:
-                        destinations = destinations | \
-                            set(email_notifications_config['public_flightreport_bad'])
-                    send_flightreport_email(
-                        list(destinations),
-                        full_plot_url,
-                        DBData.rating_str_static(rating),
-                        DBData.wind_speed_str_static(wind_speed), delete_url,
-                        email, info)
-
-                    # also generate the additional DB entry
-                    # (we may have the log already loaded in 'ulog', however the
-                    # lru cache will make it very quick to load it again)
-                    generate_db_data_from_log_file(log_id, con)
-                    # also generate the preview image
-                    IOLoop.instance().add_callback(generate_overview_img_from_id, log_id)
-
-                con.commit()
-                cur.close()
-                con.close()
-
-                # send notification emails
-                send_notification_email(email, full_plot_url, delete_url, info)
-
-                if should_redirect:
-                    self.redirect(url)
-                else:
-                    # Return plot url as json
-                    self.write(json.dumps({"url": url}))
+                self.handle_upload(form_data, file_obj)
 
             except CustomHTTPError:
                 raise
 
-            except ULogException as e:
-                raise CustomHTTPError(
-                    400,
-                    'Failed to parse the file. It is most likely corrupt.') from e
             except Exception as e:
                 print('Error when handling POST data', sys.exc_info()[0],
                       sys.exc_info()[1])
@@ -345,3 +328,196 @@ class UploadHandler(TornadoRequestHandlerBase):
             finally:
                 self.multipart_streamer.release_parts()
 
+    def handle_upload(self, form_data, file_obj):
+        """
+        Store an uploaded log file, add it to the DB and queue the processing
+        jobs, then send the response
+        :param form_data: dict of the form fields (see UPLOAD_FORM_FIELDS)
+        :param file_obj: the uploaded file: multipart_streamer.TemporaryFileStreamedPart
+                         or an object with the same interface
+        """
+        description = escape(form_data['description'].decode("utf-8"))
+        email = form_data['email'].decode("utf-8")
+        upload_type = 'personal'
+        if 'type' in form_data:
+            upload_type = form_data['type'].decode("utf-8")
+        source = 'webui'
+        title = '' # may be used in future...
+        if 'source' in form_data:
+            source = form_data['source'].decode("utf-8")
+        obfuscated = 0
+        if 'obfuscated' in form_data:
+            if form_data['obfuscated'].decode("utf-8") == 'true':
+                obfuscated = 1
+        allow_for_analysis = 0
+        if 'allowForAnalysis' in form_data:
+            if form_data['allowForAnalysis'].decode("utf-8") == 'true':
+                allow_for_analysis = 1
+        feedback = ''
+        if 'feedback' in form_data:
+            feedback = escape(form_data['feedback'].decode("utf-8"))
+        should_redirect = source != 'QGroundControl'
+        if 'redirect' in form_data:
+            should_redirect = form_data['redirect'].decode("utf-8") == 'true'
+        wind_speed = -1
+        rating = ''
+        stored_email = ''
+        video_url = ''
+        is_public = 0
+        vehicle_name = ''
+        error_labels = ''
+
+        if upload_type == 'flightreport':
+            if 'windSpeed' in form_data:
+                try:
+                    wind_speed = int(escape(form_data['windSpeed'].decode("utf-8")))
+                except ValueError:
+                    wind_speed = -1
+            if 'rating' in form_data:
+                rating = escape(form_data['rating'].decode("utf-8"))
+                if rating == 'notset': rating = ''
+            # get video url & check if valid
+            if 'videoUrl' in form_data:
+                video_url = escape(form_data['videoUrl'].decode("utf-8"), quote=True)
+                if not validate_url(video_url):
+                    video_url = ''
+            if 'vehicleName' in form_data:
+                vehicle_name = escape(form_data['vehicleName'].decode("utf-8"))
+
+            # always allow for statistical analysis
+            allow_for_analysis = 1
+            if 'public' in form_data:
+                if form_data['public'].decode("utf-8") == 'true':
+                    is_public = 1
+
+        upload_file_name = file_obj.get_filename()
+
+        # check if the file is encrypted
+        ulge_key_path = get_ulge_private_key_path()
+        if ulge_key_path and upload_file_name.lower().endswith('.ulge'):
+            # decrypt block by block from the temporary file (the
+            # decrypted ULog header is checked with the first block)
+            log_id, new_file_name = generate_unique_log_filename()
+            try:
+                sha256 = decrypt_ulge_file(file_obj.f_out.name, new_file_name,
+                                           ulge_key_path)
+            except Exception as e:
+                raise CustomHTTPError(400, f"Decryption failed: {str(e)}") from e
+
+            print(f"Decryption successful for {upload_file_name}, saved to {new_file_name}")
+
+        else:
+            # Regular .ulg file
+            log_id, new_file_name = generate_unique_log_filename()
+
+            header_len = len(ULog.HEADER_BYTES)
+            if file_obj.get_payload_partial(header_len) != ULog.HEADER_BYTES:
+                raise CustomHTTPError(400, 'Invalid File')
+
+            print('Moving uploaded file to', new_file_name)
+            file_obj.move(new_file_name)
+            # computed while the upload was streamed
+            sha256 = file_obj.get_sha256()
+
+        if obfuscated == 1:
+            # TODO: randomize gps data, ...
+            pass
+
+        duplicate_log_id = store_uploaded_log_file(log_id, new_file_name, sha256)
+
+        # generate a token: secure random string (url-safe)
+        token = str(binascii.hexlify(os.urandom(16)), 'ascii')
+
+        url = '/plot_app?log='+log_id
+        full_plot_url = get_http_protocol()+'://'+get_domain_name()+url
+        print(full_plot_url)
+
+        delete_url = get_http_protocol()+'://'+get_domain_name()+ \
+            '/edit_entry?action=delete&log='+log_id+'&token='+token
+
+        # information for the notification emails (completed with
+        # information from the log by the email jobs)
+        info = {}
+        info['description'] = description
+        info['feedback'] = feedback
+        info['upload_filename'] = upload_file_name
+        info['rating'] = rating
+
+        # warm-up steps (only what is not reused from a duplicate)
+        is_public_flightreport = upload_type == 'flightreport' and is_public
+        warmup_steps = ['generate_db_data']
+        if is_public_flightreport and \
+                not os.path.exists(get_overview_img_filename(log_id)):
+            warmup_steps.append('overview_img')
+
+        # put additional data into a DB
+        con = sqlite3.connect(get_db_filename())
+        cur = con.cursor()
+        cur.execute(
+            'insert into Logs (Id, Title, Description, '
+            'OriginalFilename, Date, AllowForAnalysis, Obfuscated, '
+            'Source, Email, WindSpeed, Rating, Feedback, Type, '
+            'videoUrl, ErrorLabels, Public, Token, Sha256) values '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [log_id, title, description, upload_file_name,
+             datetime.datetime.now(), allow_for_analysis,
+             obfuscated, source, stored_email, wind_speed, rating,
+             feedback, upload_type, video_url, error_labels, is_public, token,
+             sha256])
+
+        if duplicate_log_id is not None and \
+                copy_generated_db_data(duplicate_log_id, log_id, cur):
+            warmup_steps.remove('generate_db_data')
+
+        # decode the log into the caches, generate the additional DB entry
+        # and the preview image, so that the first page view does not have
+        # to do it (started by the processing job)
+        if source == 'CI' or \
+                (len(warmup_steps) == 0 and has_warm_cache(log_id)):
+            warmup_steps = None
+
+        # the remaining processing is done by background jobs, which
+        # are added in the same transaction: the upload is complete
+        # once it is committed
+        enqueue_job(log_id, PROCESS_UPLOAD_JOB_TYPE,
+                    {'vehicle_name': vehicle_name,
+                     'update_vehicle': source != 'CI',
+                     'sha256': sha256, 'warmup_steps': warmup_steps},
+                    priority=PRIORITY_HIGH, cur=cur)
+
+        if email != '':
+            enqueue_job(log_id, NOTIFICATION_EMAIL_JOB_TYPE,
+                        {'email': email, 'plot_url': full_plot_url,
+                         'delete_url': delete_url, 'info': info,
+                         'vehicle_name': vehicle_name,
+                         'use_log': source != 'CI'},
+                        cur=cur)
+
+        if is_public_flightreport and source != 'CI':
+            destinations = set(email_notifications_config['public_flightreport'])
+            if rating in ['unsatisfactory', 'crash_sw_hw', 'crash_pilot']:
+                destinations = destinations | \
+                    set(email_notifications_config['public_flightreport_bad'])
+            if len(destinations) > 0:
+                enqueue_job(log_id, FLIGHTREPORT_EMAIL_JOB_TYPE,
+                            {'destinations': sorted(destinations),
+                             'plot_url': full_plot_url,
+                             'rating_description': DBData.rating_str_static(rating),
+                             'wind_speed': DBData.wind_speed_str_static(wind_speed),
+                             'delete_url': delete_url, 'uploader_email': email,
+                             'info': info, 'vehicle_name': vehicle_name},
+                            cur=cur)
+
+        con.commit()
+        cur.close()
+        con.close()
+        notify_job_workers()
+
+        if should_redirect:
+            self.redirect(url)
+        else:
+            # Return plot url as json (and the url to poll the
+            # processing state, see JobStatusHandler)
+            self.write(json.dumps({"url": url,
+                                   "status_url": '/job_status?log='+log_id}))
+
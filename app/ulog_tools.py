@@ -42,6 +42,10 @@ class ULogDataTools:
                 }
             }
             
+            # 指定时间范围时，从日志中读取该范围内的电池数据
+            if time_range is not None and self.log_id:
+                battery_data["time_range_data"] = self._get_battery_range_data(time_range)
+
             # 分析电池配置
             if battery_data["summary"]["voltage_max_v"] > 0:
                 config_analysis = analyze_battery_configuration(battery_data["summary"]["voltage_max_v"])
@@ -74,6 +78,39 @@ class ULogDataTools:
             logger.error(f"Failed to get battery status data: {e}")
             return {"error": str(e), "log_id": self.log_id}
     
+    def _get_battery_range_data(self, time_range: Tuple[float, float]) -> Dict[str, Any]:
+        """
+        从日志中读取时间范围内的battery_status数据（只解码该范围内的消息）
+
+        Args:
+            time_range: (start_time, end_time) 相对于日志开始的时间，单位秒
+
+        Returns:
+            每个电池实例的电压、电流统计
+        """
+        from helper import load_ulog_file, load_ulog_range, get_log_filename
+        start_timestamp = load_ulog_file(get_log_filename(self.log_id)).start_timestamp
+        t_start = start_timestamp + int(time_range[0] * 1e6)
+        t_end = start_timestamp + int(time_range[1] * 1e6)
+        range_data = {"start_time_s": time_range[0], "end_time_s": time_range[1],
+                      "batteries": []}
+        for dataset in load_ulog_range(self.log_id, ['battery_status'], t_start, t_end):
+            voltage = dataset.data['voltage_v']
+            current = dataset.data['current_a']
+            if len(voltage) == 0:
+                continue
+            range_data["batteries"].append({
+                "instance": dataset.multi_id,
+                "num_samples": len(voltage),
+                "voltage_max_v": float(np.max(voltage)),
+                "voltage_min_v": float(np.min(voltage)),
+                "current_max_a": float(np.max(current)),
+                "current_mean_a": float(np.mean(current)),
+                "discharged_mah": float(dataset.data['discharged_mah'][-1] -
+                                        dataset.data['discharged_mah'][0])
+            })
+        return range_data
+
     def get_power_system_data(self) -> Dict[str, Any]:
         """
         获取电力系统数据